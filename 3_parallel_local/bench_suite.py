@@ -0,0 +1,416 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from bench_threads import replicate_rows, time_processes, time_threads, worker_counts
+from model import ENGINES, State, numba, run_simulation, step
+from run_threads import cpu_count
+
+
+# Groupes de mesures, dans l'ordre d'exécution
+SUITES = ("engines", "memory", "scaling", "sweep")
+
+# Sens d'une régression pour chaque unité (True : plus grand est meilleur)
+HIGHER_IS_BETTER = {"steps/s": True, "s": False, "MiB": False}
+
+# Runners chronométrés de bout en bout par la suite 'sweep'
+RUNNERS = ("run_parallel.py", "run_threads.py", "run_mpi.py")
+
+# Paramètres de la ligne de référence des suites 'engines' et 'memory'
+WORKLOAD = {"initial_mailly": 10, "initial_moulin": 2, "p1": 0.5, "p2": 0.47, "seed": 123}
+
+# Répertoire des runners
+HERE = Path(__file__).resolve().parent
+
+
+def parse_args():
+    """Parse command line arguments for the benchmark suite.
+
+    Returns:
+        Parsed arguments containing:
+        - suites: Comma-separated suites to run (engines, memory, scaling, sweep)
+        - params: Path to CSV file with parameter combinations (scaling, sweep)
+        - out_dir: Directory of the JSON result files
+        - steps: Number of steps of the engine and memory workloads
+        - repeat: Number of timed runs of each measure (the median is kept)
+        - max_workers: Largest number of threads / processes tried
+        - rows_per_worker: Rows per worker of the scaling sweep
+        - engine: Simulation engine of the scaling and sweep suites
+        - compare: Previous JSON result file to compare against
+        - threshold: Relative change reported as a regression
+    """
+    parser = argparse.ArgumentParser(description="Benchmark suite: engines, memory, scaling and end-to-end sweeps.")
+
+    parser.add_argument(
+        "--suites",
+        type=str,
+        default=",".join(SUITES),
+        help=f"Comma-separated suites to run, among {', '.join(SUITES)}"
+    )
+    parser.add_argument(
+        "--params",
+        type=str,
+        default="params.csv",
+        help="Path to CSV file with parameter combinations (scaling and sweep suites)"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="bench",
+        help="Directory to save the JSON result file"
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=1_000_000,
+        help="Number of steps of the engine and memory workloads (a tenth for the python engine)"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timed runs of each measure (the median is kept)"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Largest number of threads / processes tried (default: CPU count)"
+    )
+    parser.add_argument(
+        "--rows-per-worker",
+        type=int,
+        default=4,
+        help="Rows per worker of the scaling sweep (weak scaling; strong scaling uses the largest count)"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="vectorized",
+        choices=ENGINES,
+        help="Simulation engine of the scaling and sweep suites"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Previous JSON result file: report the measures that changed by more than --threshold"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative change reported as a regression or an improvement"
+    )
+
+    return parser.parse_args()
+
+
+def result(suite: str, name: str, unit: str, samples: List[float], **params) -> Dict:
+    """One measure of the JSON file: median of ``samples`` (in ``unit``) and its parameters."""
+    return {
+        "suite": suite,
+        "name": name,
+        "unit": unit,
+        "value": statistics.median(samples),
+        "samples": samples,
+        "params": params,
+    }
+
+
+def timed(function: Callable[[], object], repeat: int) -> List[float]:
+    """Wall times (s) of ``repeat`` calls of ``function``."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def engine_steps(engine: str, steps: int) -> int:
+    """Steps of the workload of ``engine``: the python engines run a tenth of it."""
+    return max(steps // 10, 1) if engine == "python" else steps
+
+
+def available_engines() -> List[str]:
+    """Engines that run natively here (numba only when it is installed)."""
+    return [engine for engine in ENGINES if engine != "numba" or numba is not None]
+
+
+def step_loop(steps: int) -> None:
+    """Call step() ``steps`` times, without the history of run_simulation."""
+    state = State(WORKLOAD["initial_mailly"], WORKLOAD["initial_moulin"])
+    rng = np.random.default_rng(WORKLOAD["seed"])
+    metrics = {"unmet_mailly": 0, "unmet_moulin": 0, "unmet_return_mailly": 0, "unmet_return_moulin": 0}
+    for _ in range(steps):
+        step(state, WORKLOAD["p1"], WORKLOAD["p2"], rng, metrics)
+
+
+def bench_engines(args) -> List[Dict]:
+    """Throughput (steps per second) of step() and of run_simulation per engine."""
+    results = []
+    steps = engine_steps("python", args.steps)
+    samples = [steps / seconds for seconds in timed(lambda: step_loop(steps), args.repeat)]
+    results.append(result("engines", "step", "steps/s", samples, steps=steps))
+
+    for engine in available_engines():
+        steps = engine_steps(engine, args.steps)
+        for output in ("history", "summary"):
+            def run():
+                run_simulation(**WORKLOAD, steps=steps, engine=engine, output=output)
+
+            # première exécution hors mesure (compilation numba, caches)
+            run_simulation(**WORKLOAD, steps=1000, engine=engine, output=output)
+            samples = [steps / seconds for seconds in timed(run, args.repeat)]
+            results.append(result("engines", f"{engine}/{output}", "steps/s", samples, steps=steps))
+    return results
+
+
+def bench_memory(args) -> List[Dict]:
+    """Peak memory allocated by one run_simulation call per engine (tracemalloc).
+
+    NumPy reports its buffers to tracemalloc, so the peak covers the history
+    columns and the random number blocks of the vectorized engines.
+    """
+    results = []
+    for engine in available_engines():
+        steps = engine_steps(engine, args.steps)
+        for output in ("history", "summary"):
+            run_simulation(**WORKLOAD, steps=1000, engine=engine, output=output)
+            tracemalloc.start()
+            run_simulation(**WORKLOAD, steps=steps, engine=engine, output=output)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(result("memory", f"{engine}/{output}", "MiB", [peak / 2**20], steps=steps))
+    return results
+
+
+def bench_scaling(args) -> List[Dict]:
+    """Strong and weak scaling of the thread and process pools over worker counts.
+
+    Strong scaling runs the same rows (rows_per_worker x max_workers copies
+    of params.csv rows) with 1, 2, 4, ... workers; weak scaling gives each
+    worker rows_per_worker rows. Both use summary output, so that only the
+    simulations are timed.
+    """
+    table = pd.read_csv(args.params)
+    max_workers = args.max_workers or cpu_count()
+    repeat = -(-max_workers * args.rows_per_worker // len(table))
+    rows = replicate_rows(table, repeat)
+
+    # première exécution hors mesure (compilation, imports)
+    time_threads(rows[:1], 1, args.engine)
+
+    results = []
+    for backend, timer in (("threads", time_threads), ("processes", time_processes)):
+        for num_workers in worker_counts(max_workers):
+            weak = rows[:num_workers * args.rows_per_worker]
+            for mode, subset in (("strong", rows[:max_workers * args.rows_per_worker]), ("weak", weak)):
+                samples = timed(lambda: timer(subset, num_workers, args.engine), args.repeat)
+                results.append(result(
+                    "scaling", f"{backend}/{mode}/workers={num_workers}", "s", samples,
+                    backend=backend, mode=mode, workers=num_workers, rows=len(subset), engine=args.engine,
+                ))
+    return results
+
+
+def run_command(command: List[str], cwd: Path) -> Dict[str, Optional[float]]:
+    """Wall time (s) and peak resident memory (MiB) of one run of ``command``.
+
+    The peak is the largest resident set of the process tree (ru_maxrss of
+    os.wait4), None where wait4 is not available.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss est en Kio sous Linux, en octets sous macOS
+        peak = usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    else:
+        _, stderr = process.communicate()
+        peak = None
+    seconds = time.perf_counter() - start
+    process.stderr.close()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+    return {"seconds": seconds, "peak": peak}
+
+
+def runner_command(runner: str, params: Path, out_dir: Path, workers: int, engine: str) -> Optional[List[str]]:
+    """Command line of one end-to-end run of ``runner`` (None when it cannot run here)."""
+    if runner == "run_mpi.py":
+        mpiexec = shutil.which("mpiexec")
+        try:
+            import mpi4py  # noqa: F401
+        except ImportError:
+            mpiexec = None
+        if mpiexec is None:
+            return None
+        return [
+            mpiexec, "-n", str(workers), sys.executable, runner,
+            "--params", str(params), "--out-dir", str(out_dir), "--engine", engine,
+        ]
+    return [
+        sys.executable, runner, "--csv-file", str(params), "--output-dir", str(out_dir),
+        "--workers", str(workers), "--engine", engine,
+    ]
+
+
+def bench_sweep(args) -> List[Dict]:
+    """End-to-end wall time and peak memory of each runner on the params.csv fixture.
+
+    Each runner is started in a fresh interpreter with its default outputs,
+    so the time includes start-up, CSV parsing and writing the results.
+    run_mpi.py is skipped when mpi4py or mpiexec is missing, and a runner
+    that fails is reported and left out of the results.
+    """
+    params = Path(args.params).resolve()
+    workers = args.max_workers or cpu_count()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for runner in RUNNERS:
+            runs = []
+            try:
+                for k in range(args.repeat):
+                    command = runner_command(runner, params, Path(tmp) / f"{runner}_{k}", workers, args.engine)
+                    if command is None:
+                        print(f"  {runner}: skipped (mpi4py or mpiexec not available)")
+                        break
+                    runs.append(run_command(command, HERE))
+            except subprocess.CalledProcessError as error:
+                # un runner en échec n'arrête pas la suite
+                lines = error.stderr.decode(errors="replace").strip().splitlines()
+                print(f"  {runner}: failed with status {error.returncode}: {lines[-1] if lines else ''}")
+                runs = []
+            if not runs:
+                continue
+            options = {"rows": len(pd.read_csv(params)), "workers": workers, "engine": args.engine}
+            results.append(result("sweep", f"{runner}/wall", "s", [run["seconds"] for run in runs], **options))
+            if runs[0]["peak"] is not None:
+                results.append(result("sweep", f"{runner}/peak_rss", "MiB", [run["peak"] for run in runs], **options))
+    return results
+
+
+def git_revision() -> Dict[str, object]:
+    """Commit of the working tree and whether it has uncommitted changes (None outside git)."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE, capture_output=True, text=True, check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def machine() -> Dict[str, object]:
+    """Description of the interpreter and the machine, stored with the results."""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "numpy": np.__version__,
+        "numba": getattr(numba, "__version__", None),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": cpu_count(),
+    }
+
+
+def compare(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """Print the change of every measure present in both files.
+
+    Returns:
+        Names of the measures that got worse by more than ``threshold``
+    """
+    before = {(item["suite"], item["name"]): item for item in previous["results"]}
+    regressions = []
+    print(f"Compared with {previous.get('commit') or 'unknown commit'} ({previous.get('date')}):")
+    for item in current["results"]:
+        old = before.get((item["suite"], item["name"]))
+        if old is None or old["unit"] != item["unit"] or not old["value"]:
+            continue
+        change = item["value"] / old["value"] - 1
+        if not HIGHER_IS_BETTER[item["unit"]]:
+            change = -change
+        if change < -threshold:
+            label = "REGRESSION"
+            regressions.append(f"{item['suite']}/{item['name']}")
+        elif change > threshold:
+            label = "improvement"
+        else:
+            label = ""
+        print(
+            f"  {item['suite']:>8} {item['name']:<36} {old['value']:12.4g} -> "
+            f"{item['value']:12.4g} {item['unit']:<8} {100 * change:+6.1f}% {label}"
+        )
+    return regressions
+
+
+def main():
+    """Run the selected suites and save their results as JSON.
+
+    The file ``<out-dir>/<date>_<commit>.json`` holds the commit, the
+    machine, the options and one entry per measure (median value, raw
+    samples, unit and workload parameters). With --compare, measures are
+    matched by suite and name against a previous file; the exit status is 1
+    when one got worse by more than --threshold, so that the suite can gate
+    a commit.
+    """
+    args = parse_args()
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = sorted(set(suites) - set(SUITES))
+    if unknown:
+        raise SystemExit(f"Unknown suites {unknown}, expected some of {SUITES}")
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    benches = {"engines": bench_engines, "memory": bench_memory, "scaling": bench_scaling, "sweep": bench_sweep}
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **git_revision(),
+        "machine": machine(),
+        "options": vars(args),
+        "results": [],
+    }
+    for suite in SUITES:
+        if suite not in suites:
+            continue
+        print(f"[{suite}]")
+        for item in benches[suite](args):
+            report["results"].append(item)
+            print(f"  {item['name']:<36} {item['value']:12.4g} {item['unit']}")
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    json_path = out_dir / f"{stamp}_{report['commit'] or 'nogit'}.json"
+    with open(json_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark results to {json_path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {100 * args.threshold:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
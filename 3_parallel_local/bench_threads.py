@@ -0,0 +1,149 @@
+import argparse
+from pathlib import Path
+import multiprocessing as mp
+import time
+from typing import Dict, List
+import pandas as pd
+
+from model import ENGINES
+import run_parallel
+from run_threads import check_engine, cpu_count, gil_enabled, run_sweep
+
+
+def parse_args():
+    """Parse command line arguments for the thread-scaling benchmark.
+
+    Returns:
+        Parsed arguments containing:
+        - params: Path to CSV file with parameter combinations
+        - out_dir: Output directory for scaling.csv
+        - repeat: Number of copies of the parameter rows to run
+        - max_workers: Largest number of threads / processes tried
+        - engine: Simulation engine run by the threads
+    """
+    parser = argparse.ArgumentParser(description="Thread scaling of run_threads.py against run_parallel.py.")
+
+    parser.add_argument(
+        "--params",
+        type=str,
+        default="params.csv",
+        help="Path to CSV file with parameter combinations"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="results",
+        help="Directory to save scaling.csv"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=8,
+        help="Number of copies of the parameter rows (with shifted seeds) to run"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Largest number of threads / processes tried (default: CPU count)"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="vectorized",
+        choices=ENGINES,
+        help="Simulation engine run by the threads (default as in run_threads.py)"
+    )
+
+    return parser.parse_args()
+
+
+def worker_counts(max_workers: int) -> List[int]:
+    """Powers of two up to ``max_workers``, and ``max_workers`` itself."""
+    counts, n = [], 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def replicate_rows(table: pd.DataFrame, repeat: int) -> List[Dict]:
+    """``repeat`` copies of the parameter rows, with seeds shifted so that no two rows share one.
+
+    Returns:
+        Rows with their 'simulation_id', ready for run_row
+    """
+    copies = []
+    for k in range(repeat):
+        copy = table.copy()
+        copy["seed"] = copy["seed"] + k * len(table)
+        copies.append(copy)
+    table = pd.concat(copies, ignore_index=True)
+    table = table.reset_index().rename(columns={"index": "simulation_id"})
+    return table.to_dict(orient="records")
+
+
+def time_processes(simulation_list: List[Dict], num_workers: int, engine: str) -> float:
+    """Wall time of the rows in a run_parallel.py process pool."""
+    start = time.perf_counter()
+    with mp.Pool(
+        num_workers,
+        initializer=run_parallel.init_worker,
+        initargs=(1, True, None, engine),
+    ) as pool:
+        for _ in pool.imap_unordered(run_parallel.run_row, simulation_list):
+            pass
+    return time.perf_counter() - start
+
+
+def time_threads(simulation_list: List[Dict], num_workers: int, engine: str) -> float:
+    """Wall time of the rows in a run_threads.py thread pool."""
+    start = time.perf_counter()
+    run_sweep(simulation_list, num_workers, engine, output="summary")
+    return time.perf_counter() - start
+
+
+def main():
+    """Measure the scaling curve of threads and processes on the same rows.
+
+    Both runners use summary output so that only the simulation itself is
+    timed. scaling.csv holds one line per (backend, workers) with the wall
+    time and the speed-up over one worker of the same backend.
+    """
+    args = parse_args()
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    simulation_list = replicate_rows(pd.read_csv(args.params), args.repeat)
+
+    max_workers = args.max_workers or cpu_count()
+    engine = check_engine(args.engine, max_workers)
+    gil = "GIL enabled" if gil_enabled() else "free-threaded"
+    print(f"{len(simulation_list)} rows, {engine} engine, {gil}, up to {max_workers} workers")
+
+    # première exécution hors mesure (compilation, imports)
+    run_sweep(simulation_list[:1], 1, engine, output="summary")
+
+    rows = []
+    for backend, timer in (("threads", time_threads), ("processes", time_processes)):
+        baseline = None
+        for num_workers in worker_counts(max_workers):
+            seconds = timer(simulation_list, num_workers, engine)
+            baseline = baseline or seconds
+            rows.append({
+                "backend": backend,
+                "engine": engine,
+                "workers": num_workers,
+                "seconds": seconds,
+                "speedup": baseline / seconds,
+            })
+            print(f"{backend:>9} x{num_workers:<3} {seconds:8.2f}s  speed-up {baseline / seconds:5.2f}")
+
+    scaling_csv_path = out_dir / "scaling.csv"
+    pd.DataFrame(rows).to_csv(scaling_csv_path, index=False)
+    print(f"Saved scaling curve to {scaling_csv_path}")
+
+
+if __name__ == "__main__":
+    main()
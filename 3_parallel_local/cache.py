@@ -0,0 +1,226 @@
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+import pickle
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+import numpy as np
+
+from model import MODEL_VERSION, SimulationResult, effective_engine, run_simulation
+
+
+# Taille maximale du cache par défaut, en octets
+DEFAULT_MAX_BYTES = 2**30
+
+# Format des entrées, à incrémenter quand il change (fait partie des clés)
+CACHE_FORMAT = 2
+
+# Alignement des tableaux dans une entrée, en octets
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _normalize(value):
+    """JSON-friendly form of a key field (NaN -> None, SeedSequence -> its stream)."""
+    if isinstance(value, np.random.SeedSequence):
+        return {"entropy": value.entropy, "spawn_key": list(value.spawn_key)}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def make_key(**fields) -> str:
+    """Hash of the fields that determine a result (order does not matter)."""
+    text = json.dumps({name: _normalize(value) for name, value in fields.items()}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of simulation results keyed by make_key.
+
+    Entries are files under ``directory/<2 first hex digits>/``: a pickle
+    of the result whose large arrays are stored out-of-band after it (pickle
+    protocol 5), so get() can map them from the file instead of reading them
+    into memory. A new entry is written to a temporary file and renamed into
+    place, which is atomic, so concurrent workers (processes, threads, MPI ranks, array
+    tasks) never see a partial entry; two writers of the same key write the
+    same result. Reading an entry updates its modification time, and
+    prune() removes the least recently used entries beyond ``max_bytes``.
+    The hit and miss counters are updated under a lock, so one cache can be
+    shared by the threads of run_threads.py.
+    """
+
+    def __init__(self, directory, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str, mmap: bool = False) -> Optional[Any]:
+        """Cached result of ``key``, or None when it is not cached.
+
+        With ``mmap=True`` the arrays of the result are read-only memory maps
+        of the entry, read from disk only when they are used.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                sizes, header = pickle.load(f)
+                buffers = []
+                offset = f.tell()
+                for size in sizes:
+                    offset = _aligned(offset)
+                    if mmap:
+                        buffers.append(np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(size,)))
+                    else:
+                        f.seek(offset)
+                        buffers.append(bytearray(f.read(size)))
+                    offset += size
+            result = pickle.loads(header, buffers=buffers)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            # absente, ou supprimée par prune() entre-temps
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: Any) -> None:
+        """Store ``result`` under ``key`` (atomic rename of a temporary file)."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        buffers = []
+        header = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                raws = [buffer.raw() for buffer in buffers]
+                pickle.dump(([raw.nbytes for raw in raws], header), f, protocol=pickle.HIGHEST_PROTOCOL)
+                for raw in raws:
+                    f.seek(_aligned(f.tell()))
+                    f.write(raw)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def prune(self) -> int:
+        """Remove the least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            Number of removed entries
+        """
+        entries = []
+        for path in self.directory.glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def open_cache(directory: Optional[str], max_mb: float) -> Optional[ResultCache]:
+    """ResultCache for the --cache-dir / --cache-size options (None: no cache)."""
+    if directory is None:
+        return None
+    return ResultCache(directory, max_bytes=int(max_mb * 2**20))
+
+
+def row_key(params: Dict, seed, **options) -> str:
+    """Cache key of one params.csv row run with the given seed and options.
+
+    The engine is the one that will actually run (see
+    model.effective_engine): a numba row run without numba is stored as a
+    python result, not under the key of the compiled engine.
+    """
+    if "engine" in options:
+        options["engine"] = effective_engine(options["engine"])
+    return make_key(
+        version=MODEL_VERSION,
+        format=CACHE_FORMAT,
+        steps=int(params["steps"]),
+        p1=float(params["p1"]),
+        p2=float(params["p2"]),
+        init_mailly=int(params["init_mailly"]),
+        init_moulin=int(params["init_moulin"]),
+        cap_mailly=params.get("cap_mailly"),
+        cap_moulin=params.get("cap_moulin"),
+        seed=seed,
+        **options,
+    )
+
+
+def simulate_row(params: Dict, seed, cache: Optional[ResultCache] = None, out=None, **options):
+    """run_simulation for one params.csv row, looked up in ``cache`` first.
+
+    With ``out`` (shared memory or a trajectory store) the history is not
+    written to the cache, which would hold a second copy of every
+    trajectory; a cached history is copied from the mapped entry into
+    ``out`` without loading it into memory first.
+
+    Args:
+        params: Row of the parameter table
+        seed: Seed of the row (see seeds.row_sequence)
+        cache: Result cache, or None to always simulate
+        out: Preallocated history columns, as in run_simulation; a cached
+            history is copied into them
+        options: Other run_simulation arguments (engine, record_every, output)
+
+    Returns:
+        SimulationResult or SimulationSummary, as run_simulation
+    """
+    key = None
+    if cache is not None:
+        key = row_key(params, seed, **options)
+        result = cache.get(key, mmap=out is not None)
+        if result is not None:
+            if out is not None:
+                history = {}
+                for name in ("mailly", "moulin", "unmet_mailly", "unmet_moulin"):
+                    column = getattr(result, name)
+                    out[name][:column.size] = column
+                    history[name] = out[name][:column.size]
+                result = SimulationResult(**history, metrics=result.metrics, record_every=result.record_every)
+            return result
+
+    result = run_simulation(
+        initial_mailly=int(params["init_mailly"]),
+        initial_moulin=int(params["init_moulin"]),
+        steps=int(params["steps"]),
+        p1=float(params["p1"]),
+        p2=float(params["p2"]),
+        seed=seed,
+        capacity_mailly=params.get("cap_mailly"),
+        capacity_moulin=params.get("cap_moulin"),
+        out=out,
+        **options,
+    )
+    if cache is not None and out is None:
+        cache.put(key, result)
+    return result
@@ -0,0 +1,428 @@
+import argparse
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from model import _capacity, _occupancy_bounds, run_batch, run_simulation
+from seeds import replica_sequences, row_sequence
+
+
+# Métriques comparées entre la solution exacte et la simulation
+VALIDATED_METRICS = (
+    "unmet_mailly",
+    "unmet_moulin",
+    "final_imbalance",
+    "mean_mailly",
+    "time_empty_mailly",
+    "time_empty_moulin",
+    "unmet_return_mailly",
+    "unmet_return_moulin",
+    "time_full_mailly",
+    "time_full_moulin",
+)
+
+
+def transition_bands(
+    total: int,
+    p1: float,
+    p2: float,
+    lo: int = 0,
+    hi: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bands of the one-step transition matrix of the number of bikes at Mailly.
+
+    The chain state is the number of bikes at Mailly, between ``lo`` and
+    ``hi`` (0..total without docks limits, see model._occupancy_bounds);
+    Moulin holds the other bikes. A step moves at most one bike, so the
+    matrix is tridiagonal. At ``lo`` no bike can leave Mailly (it is empty,
+    or Moulin has no free dock), at ``hi`` none can arrive.
+
+    Args:
+        total: Total number of bikes in the system
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        lo: Fewest bikes Mailly can hold
+        hi: Most bikes Mailly can hold (None: total)
+
+    Returns:
+        Tuple (down, diag, up) over the states lo..hi, with
+        down[i - 1] = P[lo + i, lo + i - 1], diag[i] = P[lo + i, lo + i]
+        and up[i] = P[lo + i, lo + i + 1]
+    """
+    size = (total if hi is None else hi) - lo
+    # Mailly -> Moulin puis Moulin -> Mailly dans le même pas
+    down = np.full(size, p1 * (1.0 - p2))
+    up = np.full(size, (1.0 - p1) * p2)
+    if size:
+        up[0] = p2  # aucun départ possible de Mailly : seul le retour vers Mailly
+    diag = np.ones(size + 1)
+    diag[1:] -= down
+    diag[:-1] -= up
+    return down, diag, up
+
+
+def transition_matrix(total: int, p1: float, p2: float, lo: int = 0, hi: Optional[int] = None) -> sp.csr_matrix:
+    """One-step transition matrix of the number of bikes at Mailly.
+
+    Args:
+        total: Total number of bikes in the system
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        lo, hi: Range of the bikes at Mailly, as in transition_bands
+
+    Returns:
+        Sparse tridiagonal (hi - lo + 1) x (hi - lo + 1) stochastic matrix
+    """
+    down, diag, up = transition_bands(total, p1, p2, lo, hi)
+    return sp.diags([down, diag, up], [-1, 0, 1], format="csr")
+
+
+def _step_distribution(current: np.ndarray, bands) -> np.ndarray:
+    """Distribution after one more step (row vector times the banded matrix)."""
+    down, diag, up = bands
+    result = current * diag
+    result[1:] += current[:-1] * up
+    result[:-1] += current[1:] * down
+    return result
+
+
+def stationary_distribution(total: int, p1: float, p2: float, lo: int = 0, hi: Optional[int] = None) -> np.ndarray:
+    """Stationary distribution of the number of bikes at Mailly.
+
+    The chain only moves by one bike per step, so it is a birth-death chain
+    and the stationary distribution follows from detailed balance.
+
+    Args:
+        total: Total number of bikes in the system
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        lo, hi: Range of the bikes at Mailly, as in transition_bands
+
+    Returns:
+        Probability of each number of bikes at Mailly (lo..hi)
+
+    Raises:
+        ValueError: If the chain is not irreducible (p1 or p2 equal to 0 or 1),
+            so that the long-run distribution depends on the initial state
+    """
+    down, _, up = transition_bands(total, p1, p2, lo, hi)
+    if np.any(up <= 0) or np.any(down <= 0):
+        raise ValueError(
+            f"Chain with p1={p1}, p2={p2} and {total} bikes is not irreducible"
+        )
+    # pi[x + 1] / pi[x] = P[x, x + 1] / P[x + 1, x], en log pour la stabilité
+    log_pi = np.concatenate(([0.0], np.cumsum(np.log(up) - np.log(down))))
+    pi = np.exp(log_pi - log_pi.max())
+    return pi / pi.sum()
+
+
+def _power_and_sum(transition: np.ndarray, steps: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute P^steps and P^0 + ... + P^(steps - 1) by repeated squaring."""
+    n = transition.shape[0]
+    power, total = np.eye(n), np.zeros((n, n))
+    base, base_sum = transition, np.eye(n)
+    while steps:
+        if steps & 1:
+            total = total + power @ base_sum
+            power = power @ base
+        steps >>= 1
+        if steps:
+            base_sum = base_sum + base @ base_sum
+            base = base @ base
+    return power, total
+
+
+def distribution_after(
+    initial_mailly: int,
+    total: int,
+    steps: int,
+    p1: float,
+    p2: float,
+    method: str = "auto",
+    lo: int = 0,
+    hi: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Distribution of the bikes at Mailly after ``steps`` steps.
+
+    Args:
+        initial_mailly: Initial number of bikes at Mailly station
+        total: Total number of bikes in the system
+        steps: Number of simulation steps
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        method: "squaring" (dense repeated squaring, log(steps) products),
+            "matvec" (one banded matrix-vector product per step) or "auto"
+            to pick the cheaper of the two for this size
+        lo, hi: Range of the bikes at Mailly, as in transition_bands
+
+    Returns:
+        Tuple containing (over the states lo..hi):
+        - Distribution after the last step
+        - Sum of the distributions at the start of each step (t = 0..steps-1),
+          i.e. the expected number of steps started in each state
+    """
+    bands = transition_bands(total, p1, p2, lo, hi)
+    n = bands[1].size
+    start = np.zeros(n)
+    start[initial_mailly - lo] = 1.0
+
+    if method == "auto":
+        squaring_cost = 2 * n**3 * max(steps, 1).bit_length()
+        method = "squaring" if squaring_cost < 3 * n * steps else "matvec"
+
+    if method == "squaring":
+        dense = transition_matrix(total, p1, p2, lo, hi).toarray()
+        power, power_sum = _power_and_sum(dense, steps)
+        return start @ power, start @ power_sum
+    if method == "matvec":
+        current, visits = start, np.zeros(n)
+        for _ in range(steps):
+            visits += current
+            current = _step_distribution(current, bands)
+        return current, visits
+    raise ValueError(f"Unknown method {method!r}, expected 'auto', 'squaring' or 'matvec'")
+
+
+def expected_metrics(
+    initial_mailly: int,
+    initial_moulin: int,
+    steps: int,
+    p1: float,
+    p2: float,
+    method: str = "auto",
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+) -> Dict[str, float]:
+    """Exact expectations of the metrics reported by run_simulation.
+
+    Dock capacities only narrow the range of the chain: Mailly holds
+    between ``lo`` and ``hi`` bikes (model._occupancy_bounds), and a trip
+    refused at a bound counts as unmet demand (station empty) or as a
+    refused return (destination full).
+
+    Args:
+        initial_mailly: Initial number of bikes at Mailly station
+        initial_moulin: Initial number of bikes at Moulin station
+        steps: Number of simulation steps
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        method: Method passed to distribution_after
+        capacity_mailly: Number of docks at Mailly (None or NaN: unlimited)
+        capacity_moulin: Number of docks at Moulin (None or NaN: unlimited)
+
+    Returns:
+        Dictionary with the expected 'unmet_mailly', 'unmet_moulin',
+        'unmet_return_mailly', 'unmet_return_moulin', 'final_imbalance',
+        'mean_mailly', 'mean_moulin', 'time_empty_mailly',
+        'time_empty_moulin', 'time_full_mailly' and 'time_full_moulin' over
+        the run, and the long-run unmet demand per step 'unmet_mailly_rate'
+        and 'unmet_moulin_rate' (NaN when the chain is not irreducible)
+
+    Raises:
+        ValueError: If a station starts with more bikes than docks
+    """
+    total = initial_mailly + initial_moulin
+    capacity_mailly = _capacity(capacity_mailly, initial_mailly, "Mailly")
+    capacity_moulin = _capacity(capacity_moulin, initial_moulin, "Moulin")
+    lo, hi = (int(bound) for bound in _occupancy_bounds(total, capacity_mailly, capacity_moulin))
+    final, visits = distribution_after(initial_mailly, total, steps, p1, p2, method, lo, hi)
+    occupancy = _step_distribution(visits, transition_bands(total, p1, p2, lo, hi))
+    bikes = np.arange(lo, hi + 1)
+
+    # à hi, la demande vers Mailly est refusée si aucun vélo n'en est parti
+    # dans le même pas (un départ est possible sauf si lo == hi)
+    keeps_all = 1.0 - p1 if hi > lo else 1.0
+
+    # à lo, un départ de Mailly est refusé : Mailly vide (lo == 0) ou Moulin pleine
+    refused_mailly, refused_moulin = p1 * visits[0], p2 * keeps_all * visits[-1]
+    metrics = {
+        "unmet_mailly": refused_mailly if lo == 0 else 0.0,
+        "unmet_moulin": refused_moulin if hi == total else 0.0,
+        "unmet_return_mailly": refused_moulin if hi < total else 0.0,
+        "unmet_return_moulin": refused_mailly if lo > 0 else 0.0,
+        "final_imbalance": final @ (2 * bikes - total),
+        "mean_mailly": occupancy @ bikes / steps if steps else np.nan,
+        "mean_moulin": occupancy @ (total - bikes) / steps if steps else np.nan,
+        "time_empty_mailly": occupancy[0] if lo == 0 else 0.0,
+        "time_empty_moulin": occupancy[-1] if hi == total else 0.0,
+        "time_full_mailly": occupancy[-1],
+        "time_full_moulin": occupancy[0],
+    }
+    try:
+        pi = stationary_distribution(total, p1, p2, lo, hi)
+        metrics["unmet_mailly_rate"] = p1 * pi[0] if lo == 0 else 0.0
+        metrics["unmet_moulin_rate"] = p2 * keeps_all * pi[-1] if hi == total else 0.0
+    except ValueError:
+        metrics["unmet_mailly_rate"] = np.nan
+        metrics["unmet_moulin_rate"] = np.nan
+    return {key: float(value) for key, value in metrics.items()}
+
+
+def solve_row(row: Dict[str, float], method: str = "auto") -> Dict[str, float]:
+    """Expected metrics for one row of params.csv (with its optional cap_* columns)."""
+    return expected_metrics(
+        initial_mailly=int(row["init_mailly"]),
+        initial_moulin=int(row["init_moulin"]),
+        steps=int(row["steps"]),
+        p1=float(row["p1"]),
+        p2=float(row["p2"]),
+        method=method,
+        capacity_mailly=row.get("cap_mailly"),
+        capacity_moulin=row.get("cap_moulin"),
+    )
+
+
+def validate_row(
+    row: Dict[str, float],
+    replicas: int = 1000,
+    engine: Optional[str] = None,
+    row_index: int = 0,
+    root_seed: Optional[int] = None,
+) -> pd.DataFrame:
+    """Compare the exact expectations with Monte Carlo runs of the model.
+
+    By default the replicas are simulated with run_batch, whose replica ``i``
+    is the run_simulation trajectory for the same seed. Giving an engine runs
+    run_simulation with it instead, which checks that engines with their own
+    random stream (jump, numba) follow the right distribution.
+
+    Args:
+        row: One row of params.csv
+        replicas: Number of simulated replicas
+        engine: run_simulation engine to check, or None for run_batch
+        row_index: Position of the row in params.csv
+        root_seed: Seed of the whole sweep (see seeds.row_sequence); rows
+            without a 'seed' column use it or the default sweep stream
+
+    Returns:
+        DataFrame with one line per metric: exact value, Monte Carlo mean,
+        its standard error and the z-score of the difference
+    """
+    exact = solve_row(row)
+    seeds = replica_sequences(row_sequence(row, row_index, root_seed), replicas)
+    args = (
+        int(row["init_mailly"]),
+        int(row["init_moulin"]),
+        int(row["steps"]),
+        float(row["p1"]),
+        float(row["p2"]),
+    )
+    capacities = {"capacity_mailly": row.get("cap_mailly"), "capacity_moulin": row.get("cap_moulin")}
+    if engine is None:
+        summary = run_batch(*args, seeds, output="summary", **capacities)
+        simulated = dict(summary.metrics)
+        simulated.update(summary.statistics())
+    else:
+        runs = []
+        for seed in seeds:
+            summary = run_simulation(*args, seed, engine=engine, output="summary", **capacities)
+            runs.append({**summary.metrics, **summary.statistics()})
+        simulated = pd.DataFrame(runs).to_dict(orient="list")
+
+    lines = []
+    for name in VALIDATED_METRICS:
+        values = np.asarray(simulated[name], dtype=float)
+        mean = values.mean()
+        stderr = values.std(ddof=1) / np.sqrt(values.size)
+        z = (mean - exact[name]) / stderr if stderr > 0 else 0.0
+        lines.append({
+            "metric": name,
+            "exact": exact[name],
+            "mc_mean": mean,
+            "mc_stderr": stderr,
+            "z": z,
+        })
+    return pd.DataFrame(lines)
+
+
+def parse_args():
+    """Parse command line arguments for the exact solver.
+
+    Returns:
+        Parsed arguments containing:
+        - params: Path to CSV file with parameter combinations
+        - out_csv: Output CSV file with the expected metrics of each row
+        - method: Method used for the distribution after 'steps' steps
+        - validate: Number of Monte Carlo replicas used to check each row (0: no check)
+        - engine: run_simulation engine checked by --validate (default: run_batch)
+        - root_seed: Seed of the whole sweep used by --validate (None: use the seed column)
+    """
+    parser = argparse.ArgumentParser(description="Exact Markov-chain solver for the two-station model.")
+
+    parser.add_argument(
+        "--params",
+        type=str,
+        required=True,
+        help="Path to CSV file with parameter combinations"
+    )
+    parser.add_argument(
+        "--out-csv",
+        type=str,
+        default="expected_metrics.csv",
+        help="Output CSV file with the expected metrics of each row"
+    )
+    parser.add_argument(
+        "--method",
+        choices=("auto", "squaring", "matvec"),
+        default="auto",
+        help="Method used for the distribution after 'steps' steps"
+    )
+    parser.add_argument(
+        "--validate",
+        type=int,
+        default=0,
+        help="Number of Monte Carlo replicas used to check each row (0: no check)"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default=None,
+        help="run_simulation engine checked by --validate (default: run_batch)"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep used by --validate: row i uses child i of SeedSequence(root_seed) instead of its seed column"
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Compute the expected metrics of every row of a parameter file.
+
+    Output files:
+    - out_csv: parameters and expected metrics, one line per row
+    - validation.csv (next to out_csv, with --validate): exact vs Monte Carlo
+    """
+    args = parse_args()
+
+    params = pd.read_csv(args.params)
+    rows = params.to_dict(orient="records")
+
+    expected = pd.DataFrame([solve_row(row, args.method) for row in rows])
+    results = pd.concat([params, expected], axis=1)
+
+    out_csv = Path(args.out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(out_csv, index=False)
+    print(f"Saved expected metrics to {out_csv}")
+
+    if args.validate:
+        checks = []
+        for i, row in enumerate(rows):
+            check = validate_row(row, args.validate, args.engine, i, args.root_seed)
+            check.insert(0, "row", i)
+            checks.append(check)
+        validation = pd.concat(checks, ignore_index=True)
+        validation_path = out_csv.parent / "validation.csv"
+        validation.to_csv(validation_path, index=False)
+        print(validation.to_string(index=False))
+        print(f"Saved validation to {validation_path}")
+
+
+if __name__ == "__main__":
+    main()
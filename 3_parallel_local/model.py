@@ -1,8 +1,38 @@
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Optional, Union
+import warnings
 import numpy as np
 import pandas as pd
 
+from seeds import Seed, stream_key
+from store import create_store, flush_store
+
+try:
+    import numba
+except ImportError:  # moteur compilé optionnel
+    numba = None
+
+
+# Version des résultats, à incrémenter quand un moteur change ses sorties
+# (invalide les résultats en cache, voir cache.py)
+MODEL_VERSION = 1
+
+# Moteurs disponibles pour run_simulation
+ENGINES = ("python", "vectorized", "jump", "numba")
+
+# Moteurs acceptant une politique de rééquilibrage (appelée tous les k pas)
+POLICY_ENGINES = ("python", "vectorized")
+
+# Sorties possibles : historique complet ou statistiques résumées
+OUTPUTS = ("history", "summary")
+
+# Nombre de pas tirés en une fois par le moteur vectorisé
+BLOCK_STEPS = 16384
+
+# Nombre de couples (réplique, pas) tirés en une fois par run_batch
+# (environ 30 octets par couple)
+BATCH_BLOCK_ENTRIES = 1 << 21
+
 
 @dataclass
 class State:
@@ -11,12 +41,22 @@ class State:
     Attributes:
         mailly: Number of bikes at Mailly station
         moulin: Number of bikes at Moulin station
+        unmet_mailly: Departures refused at Mailly because it had no bike
+        unmet_moulin: Departures refused at Moulin because it had no bike
+        unmet_return_mailly: Trips refused because Mailly had no free dock
+        unmet_return_moulin: Trips refused because Moulin had no free dock
+        truck_moves: Number of rebalancing truck interventions that moved bikes
+        bikes_moved: Total number of bikes moved by the truck
     """
 
     mailly: int
     moulin: int
     unmet_mailly: int = 0
     unmet_moulin: int = 0
+    unmet_return_mailly: int = 0
+    unmet_return_moulin: int = 0
+    truck_moves: int = 0
+    bikes_moved: int = 0
 
 
 def step(
@@ -25,6 +65,8 @@ def step(
     p2: float,
     rng: np.random.Generator,
     metrics: Dict[str, int],
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
 ) -> State:
     """Simulate one time step of the bike-sharing system.
 
@@ -34,6 +76,8 @@ def step(
         p2: Probability of a user wanting to go from Moulin to Mailly
         rng: Random number generator for stochastic events
         metrics: Dictionary to track simulation metrics (unmet demand, etc.)
+        capacity_mailly: Number of docks at Mailly (None: unlimited)
+        capacity_moulin: Number of docks at Moulin (None: unlimited)
 
     Returns:
         Updated state after one simulation step
@@ -41,90 +85,1212 @@ def step(
     Note:
         - Update the state by moving bikes between stations based on probabilities
         - If a station has no bikes available, increment the appropriate unmet demand counter
+        - If the destination has no free dock, the bike stays at the origin and
+          the 'unmet_return_<destination>' counter is incremented
     """
     # Mailly vers Moulin
     if rng.random() < p1:
-        if state.mailly > 0:
-            state.mailly -= 1
-            state.moulin += 1
-        else:
+        if state.mailly == 0:
             state.unmet_mailly += 1
             metrics["unmet_mailly"] += 1
+        elif capacity_moulin is not None and state.moulin >= capacity_moulin:
+            state.unmet_return_moulin += 1
+            metrics["unmet_return_moulin"] += 1
+        else:
+            state.mailly -= 1
+            state.moulin += 1
 
     # Moulin vers Mailly
     if rng.random() < p2:
-        if state.moulin > 0:
-            state.moulin -= 1
-            state.mailly += 1
-        else:
+        if state.moulin == 0:
             state.unmet_moulin += 1
             metrics["unmet_moulin"] += 1
+        elif capacity_mailly is not None and state.mailly >= capacity_mailly:
+            state.unmet_return_mailly += 1
+            metrics["unmet_return_mailly"] += 1
+        else:
+            state.moulin -= 1
+            state.mailly += 1
 
     return state
 
 
+@dataclass
+class SimulationResult:
+    """History of a simulation stored as preallocated typed NumPy columns.
+
+    For run_simulation the history arrays have shape (records,) and the
+    metrics are ints; for run_batch they have shape (N, records) and the
+    metrics are (N,) arrays.
+
+    Attributes:
+        mailly: Number of bikes at Mailly after each recorded step
+        moulin: Number of bikes at Moulin after each recorded step
+        unmet_mailly: Cumulative unmet requests at Mailly after each recorded step
+        unmet_moulin: Cumulative unmet requests at Moulin after each recorded step
+        metrics: Final 'unmet_mailly', 'unmet_moulin', 'unmet_return_mailly',
+            'unmet_return_moulin' and 'final_imbalance'
+        record_every: Number of steps between two recorded states
+    """
+
+    mailly: np.ndarray
+    moulin: np.ndarray
+    unmet_mailly: np.ndarray
+    unmet_moulin: np.ndarray
+    metrics: Dict[str, Union[int, np.ndarray]]
+    record_every: int = 1
+
+    @property
+    def final_imbalance(self) -> Union[int, np.ndarray]:
+        """Final difference mailly - moulin."""
+        return self.metrics["final_imbalance"]
+
+    @property
+    def time(self) -> np.ndarray:
+        """Step number (starting at 1) of each recorded state."""
+        return np.arange(1, self.mailly.shape[-1] + 1) * self.record_every
+
+    def to_record(self, lists: bool = True) -> Dict[str, Union[int, list, np.ndarray]]:
+        """Flatten into one record: final metrics and bike counts.
+
+        The bike counts are lists, or the arrays themselves with
+        ``lists=False`` (cheaper to pickle and to write with output.py).
+        """
+        record = dict(self.metrics)
+        record["mailly"] = self.mailly.tolist() if lists else self.mailly
+        record["moulin"] = self.moulin.tolist() if lists else self.moulin
+        return record
+
+
+def _count_dtype(max_value: int) -> np.dtype:
+    """Smallest integer dtype able to hold counts up to ``max_value``."""
+    for dtype in (np.uint16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def history_dtypes(total: int, steps: int) -> Dict[str, np.dtype]:
+    """Dtype of each history column for ``total`` bikes and ``steps`` steps.
+
+    Bike counts are bounded by the total number of bikes and unmet counts by
+    the number of steps, so the smallest integer type holding them is used.
+    """
+    bikes = _count_dtype(total)
+    unmet = _count_dtype(steps)
+    return {
+        "mailly": bikes,
+        "moulin": bikes,
+        "unmet_mailly": unmet,
+        "unmet_moulin": unmet,
+    }
+
+
+def _empty_history(shape, total: int, steps: int) -> Dict[str, np.ndarray]:
+    """Preallocate history columns; bike counts are bounded by ``total``."""
+    return {
+        name: np.empty(shape, dtype=dtype)
+        for name, dtype in history_dtypes(total, steps).items()
+    }
+
+
+def _history_views(out: Dict[str, np.ndarray], records: int, total: int, steps: int):
+    """First ``records`` entries of caller-provided history columns.
+
+    Raises:
+        ValueError: If a column is missing, too short or cannot hold the counts
+    """
+    views = {}
+    for name, dtype in history_dtypes(total, steps).items():
+        if name not in out:
+            raise ValueError(f"Missing history column {name!r} in out")
+        column = out[name]
+        if column.ndim != 1 or column.size < records:
+            raise ValueError(f"out[{name!r}] must be 1-D with at least {records} entries")
+        if np.iinfo(column.dtype).max < np.iinfo(dtype).max:
+            raise ValueError(f"out[{name!r}] has dtype {column.dtype}, too small for {dtype}")
+        views[name] = column[:records]
+    return views
+
+
+def _capacity(value, initial: int, station: str) -> Optional[int]:
+    """Dock capacity of a station, None (or NaN in a params row) when unlimited.
+
+    Raises:
+        ValueError: If the station starts with more bikes than docks
+    """
+    if value is None or pd.isna(value):
+        return None
+    value = int(value)
+    if value < initial:
+        raise ValueError(f"{station} starts with {initial} bikes but has {value} docks")
+    return value
+
+
+def _occupancy_bounds(total, capacity_mailly=None, capacity_moulin=None):
+    """Range (lo, hi) of the number of bikes at Mailly allowed by the docks.
+
+    Mailly holds at most capacity_mailly bikes and at least the bikes that
+    do not fit at Moulin. Without capacities the range is (0, total).
+    """
+    lo = 0 if capacity_moulin is None else np.maximum(0, total - capacity_moulin)
+    hi = total if capacity_mailly is None else np.minimum(total, capacity_mailly)
+    return lo, hi
+
+
+def _truck_moves(policy, mailly, moulin, lo, hi):
+    """Bikes the truck moves to Mailly (negative: to Moulin) for a policy.
+
+    The moves asked by ``policy.moves(mailly, moulin)`` are clipped so that
+    the bikes at Mailly stay within [lo, hi]: the truck cannot take more
+    bikes than a station holds nor fill a station beyond its docks.
+    """
+    wanted = np.asarray(policy.moves(mailly, moulin))
+    return np.clip(wanted, lo - mailly, hi - mailly).astype(np.int64)
+
+
+def _apply_truck(state: State, policy, lo: int, hi: int) -> None:
+    """Apply one intervention of the rebalancing truck to ``state``."""
+    move = int(_truck_moves(policy, state.mailly, state.moulin, lo, hi))
+    if move:
+        state.mailly += move
+        state.moulin -= move
+        state.truck_moves += 1
+        state.bikes_moved += abs(move)
+
+
+@dataclass
+class SimulationSummary:
+    """Final metrics and occupancy statistics of a simulation.
+
+    Its size does not depend on the number of steps. As for SimulationResult,
+    results of run_batch hold one row (or one array entry) per replica.
+
+    Attributes:
+        metrics: Final 'unmet_mailly', 'unmet_moulin', 'unmet_return_mailly',
+            'unmet_return_moulin' and 'final_imbalance'
+        occupancy: Histogram of the bikes at Mailly after each step: entry k
+            counts the steps with k bikes at Mailly (and total - k at Moulin)
+        empty_spells: Number of separate periods during which each station
+            ('mailly', 'moulin') stayed empty
+        total: Total number of bikes in the system
+        capacity_mailly: Number of docks at Mailly (None: unlimited)
+        capacity_moulin: Number of docks at Moulin (None: unlimited)
+    """
+
+    metrics: Dict[str, Union[int, np.ndarray]]
+    occupancy: np.ndarray
+    empty_spells: Dict[str, Union[int, np.ndarray]]
+    total: Union[int, np.ndarray]
+    capacity_mailly: Optional[Union[int, np.ndarray]] = None
+    capacity_moulin: Optional[Union[int, np.ndarray]] = None
+
+    @property
+    def final_imbalance(self) -> Union[int, np.ndarray]:
+        """Final difference mailly - moulin."""
+        return self.metrics["final_imbalance"]
+
+    def statistics(self) -> Dict[str, Union[float, np.ndarray]]:
+        """Mean, std, min, max and time spent empty or full at each station.
+
+        A station is full when it holds all the bikes or has no free dock.
+        Min and max are floats, NaN (like the mean and std) for a run of
+        0 steps, whose histogram is empty.
+        """
+        counts = np.arange(self.occupancy.shape[-1])
+        total = np.asarray(self.total)[..., None]
+        steps = self.occupancy.sum(axis=-1)
+        seen = self.occupancy > 0
+        # nombre d'étapes où Mailly a 0 vélos / tous les vélos
+        at_zero = self.occupancy[..., 0]
+        at_total = np.take_along_axis(self.occupancy, total, axis=-1)[..., 0]
+        # nombre d'étapes où Mailly / Moulin n'a plus de borne libre
+        lo, hi = _occupancy_bounds(self.total, self.capacity_mailly, self.capacity_moulin)
+        full_mailly = np.take_along_axis(self.occupancy, np.asarray(hi)[..., None], axis=-1)[..., 0]
+        full_moulin = np.take_along_axis(self.occupancy, np.asarray(lo)[..., None], axis=-1)[..., 0]
+        stats = {}
+        for station, bikes in (("mailly", counts), ("moulin", total - counts)):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = (self.occupancy * bikes).sum(axis=-1) / steps
+                var = (self.occupancy * bikes**2).sum(axis=-1) / steps - mean**2
+            stats[f"mean_{station}"] = mean
+            stats[f"std_{station}"] = np.sqrt(np.maximum(var, 0.0))
+            # histogramme vide (0 pas) : NaN, sinon min > max ; toujours en
+            # float pour que la colonne garde le même type d'une ligne à l'autre
+            low = np.where(seen, bikes, total).min(axis=-1)
+            high = np.where(seen, bikes, 0).max(axis=-1)
+            stats[f"min_{station}"] = np.where(steps > 0, low, np.nan)
+            stats[f"max_{station}"] = np.where(steps > 0, high, np.nan)
+            empty, full = (at_zero, full_mailly) if station == "mailly" else (at_total, full_moulin)
+            stats[f"time_empty_{station}"] = empty
+            stats[f"time_full_{station}"] = full
+            stats[f"empty_spells_{station}"] = self.empty_spells[station]
+        if self.occupancy.ndim == 1:
+            stats = {key: np.asarray(value).item() for key, value in stats.items()}
+        return stats
+
+    def to_record(self, lists: bool = True) -> Dict[str, Union[int, float, list, np.ndarray]]:
+        """Flatten into one record: metrics, statistics, histogram (list or array)."""
+        record = dict(self.metrics)
+        record.update(self.statistics())
+        record["occupancy_mailly"] = self.occupancy.tolist() if lists else self.occupancy
+        return record
+
+
+class OccupancyAccumulator:
+    """Online occupancy statistics of one simulation.
+
+    Only the bikes at Mailly are tracked, Moulin holds the others. States are
+    fed one step at a time (add_step), one block of steps (add_block) or as
+    runs of identical states (add_segments).
+    """
+
+    def __init__(
+        self,
+        total: int,
+        capacity_mailly: Optional[int] = None,
+        capacity_moulin: Optional[int] = None,
+    ):
+        self.total = total
+        self.capacity_mailly = capacity_mailly
+        self.capacity_moulin = capacity_moulin
+        self.histogram = np.zeros(total + 1, dtype=np.int64)
+        self.empty_spells = {"mailly": 0, "moulin": 0}
+        self._previous = -1
+
+    def add_step(self, mailly: int) -> None:
+        """Record the number of bikes at Mailly after one step."""
+        self.histogram[mailly] += 1
+        if mailly == 0 and self._previous != 0:
+            self.empty_spells["mailly"] += 1
+        if mailly == self.total and self._previous != self.total:
+            self.empty_spells["moulin"] += 1
+        self._previous = mailly
+
+    def add_block(self, mailly: np.ndarray) -> None:
+        """Record the number of bikes at Mailly after each step of a block."""
+        self.add_segments(mailly)
+
+    def add_segments(self, mailly: np.ndarray, durations: Optional[np.ndarray] = None) -> None:
+        """Record runs of steps: ``mailly[i]`` bikes for ``durations[i]`` steps."""
+        if durations is not None:
+            kept = durations > 0
+            mailly, durations = mailly[kept], durations[kept]
+        if mailly.size == 0:
+            return
+        counts = np.bincount(mailly, weights=durations, minlength=self.total + 1)
+        self.histogram += counts.astype(np.int64)
+        previous = np.concatenate(([self._previous], mailly[:-1]))
+        for station, empty in (("mailly", 0), ("moulin", self.total)):
+            starts = (mailly == empty) & (previous != empty)
+            self.empty_spells[station] += int(np.count_nonzero(starts))
+        self._previous = int(mailly[-1])
+
+    def summary(self, metrics: Dict[str, int]) -> SimulationSummary:
+        """Build the summary of the run from its final metrics."""
+        return SimulationSummary(
+            metrics=metrics,
+            occupancy=self.histogram,
+            empty_spells=dict(self.empty_spells),
+            total=self.total,
+            capacity_mailly=self.capacity_mailly,
+            capacity_moulin=self.capacity_moulin,
+        )
+
+
+def effective_engine(engine: str) -> str:
+    """Engine that run_simulation really runs for ``engine`` ("python" for "numba" without numba)."""
+    if engine == "numba" and numba is None:
+        return "python"
+    return engine
+
+
 def run_simulation(
     initial_mailly: int,
     initial_moulin: int,
     steps: int,
     p1: float,
     p2: float,
-    seed: int,
-) -> Dict[str, list]:
+    seed: Seed,
+    engine: str = "python",
+    record_every: int = 1,
+    output: str = "history",
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+    policy=None,
+    out: Optional[Dict[str, np.ndarray]] = None,
+    history_dir=None,
+) -> Union[SimulationResult, SimulationSummary]:
     """Run a complete bike-sharing simulation with extended metrics.
 
     Args:
-        initial: Initial state of the system
+        initial_mailly: Initial number of bikes at Mailly station
+        initial_moulin: Initial number of bikes at Moulin station
         steps: Number of simulation steps to run
         p1: Probability of movement from Mailly to Moulin
         p2: Probability of movement from Moulin to Mailly
-        seed: Random seed for reproducibility
+        seed: Random seed for reproducibility, an int or a SeedSequence (see
+            seeds.py for the streams of sweep rows and replicas)
+        engine: "python" to call step() once per time step, or "vectorized"
+            to resolve whole blocks of steps with NumPy array operations.
+            Both engines produce identical results for the same seed.
+            "jump" samples the waiting time until the next demand on each
+            route and skips the steps in between; its results follow the
+            same distribution but not the same random stream, and it is
+            fastest when p1 and p2 are small. "numba" runs the step loop as
+            a compiled kernel with its own counter-based random stream (same
+            distribution, different stream); it falls back to "python" with
+            a warning when numba is not installed.
+        record_every: Record the state after every k-th step only, so that
+            the history holds steps // k entries
+        output: "history" to return the per-step history, or "summary" to
+            keep only online statistics whose size does not depend on steps
+        capacity_mailly: Number of docks at Mailly (None or NaN: unlimited)
+        capacity_moulin: Number of docks at Moulin (None or NaN: unlimited)
+        policy: Rebalancing policy (see policies.py) whose ``moves(mailly,
+            moulin)`` is called at the end of every ``policy.every``-th step
+            to move bikes by truck; only the engines in POLICY_ENGINES
+            support it
+        out: Preallocated history columns to write into instead of new
+            arrays (e.g. views of shared memory), one 1-D array per history
+            column with at least steps // record_every entries
+        history_dir: Directory of a trajectory store (see store.py) to write
+            the history into, one memory-mapped .npy file per column, for
+            runs whose history does not fit in memory. The returned history
+            arrays are then the memory maps; read them back lazily with
+            store.TrajectoryStore
 
     Returns:
-        - Dictionary indexed by step, metrics including:
+        SimulationResult with typed history arrays:
             - 'mailly': Number of bikes at Mailly station
             - 'moulin': Number of bikes at Moulin station
             - 'unmet_mailly': Number of unmet requests at Mailly
             - 'unmet_moulin': Number of unmet requests at Moulin
-            - 'final_imbalance': Final difference between station bike counts
-
-    Note:
-        - Create the state object with initial bike counts
-        - Initialize metrics dictionary with all required counters
-        - Record state at each time step for the DataFrame
-        - Calculate final imbalance as mailly - moulin
+        and the final 'unmet_mailly', 'unmet_moulin', 'unmet_return_mailly',
+        'unmet_return_moulin' (trips refused because the destination had no
+        free dock), 'truck_moves' and 'bikes_moved' (rebalancing truck) and
+        'final_imbalance' (mailly - moulin) stored once in its metrics
+        dictionary.
+        With output="summary", a SimulationSummary with the same metrics and
+        the occupancy statistics of both stations instead.
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+    if effective_engine(engine) != engine:
+        warnings.warn(f"numba is not installed, using engine={effective_engine(engine)!r}", RuntimeWarning)
+        engine = effective_engine(engine)
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown output {output!r}, expected one of {OUTPUTS}")
+    if record_every < 1:
+        raise ValueError(f"record_every must be >= 1, got {record_every}")
+    capacity_mailly = _capacity(capacity_mailly, initial_mailly, "Mailly")
+    capacity_moulin = _capacity(capacity_moulin, initial_moulin, "Moulin")
+    capacities = {"capacity_mailly": capacity_mailly, "capacity_moulin": capacity_moulin}
+    if policy is not None:
+        if engine not in POLICY_ENGINES:
+            raise ValueError(f"Engine {engine!r} does not support policies, use one of {POLICY_ENGINES}")
+        if policy.every < 1:
+            raise ValueError(f"policy.every must be >= 1, got {policy.every}")
+
     # initialiser rng
     rng = np.random.default_rng(seed)
 
-    # l'état initiale
-    state = State(mailly=initial_mailly, moulin=initial_moulin)
+    # colonnes préallouées, ou accumulateurs en mode résumé
+    total = initial_mailly + initial_moulin
+    history, accumulator = None, None
+    if output == "summary":
+        accumulator = OccupancyAccumulator(total, **capacities)
+    elif out is not None:
+        history = _history_views(out, steps // record_every, total, steps)
+    elif history_dir is not None:
+        history = create_store(history_dir, history_dtypes(total, steps), steps // record_every, record_every)
+    else:
+        history = _empty_history(steps // record_every, total, steps)
 
-    # Metrics dictionary
-    metrics = {"unmet_mailly": 0, "unmet_moulin": 0}
+    if engine == "numba":
+        state = _run_numba(
+            initial_mailly,
+            initial_moulin,
+            steps,
+            p1,
+            p2,
+            stream_key(seed),
+            history=history,
+            record_every=record_every,
+            accumulator=accumulator,
+            **capacities,
+        )
+    elif engine == "jump":
+        state = _run_jump(
+            initial_mailly,
+            initial_moulin,
+            steps,
+            p1,
+            p2,
+            rng,
+            history=history,
+            record_every=record_every,
+            accumulator=accumulator,
+            **capacities,
+        )
+    elif engine == "vectorized":
+        state = _run_vectorized(
+            initial_mailly,
+            initial_moulin,
+            steps,
+            p1,
+            p2,
+            rng,
+            history=history,
+            record_every=record_every,
+            accumulator=accumulator,
+            policy=policy,
+            **capacities,
+        )
+    else:
+        # l'état initiale
+        state = State(mailly=initial_mailly, moulin=initial_moulin)
+        lo, hi = _occupancy_bounds(total, capacity_mailly, capacity_moulin)
 
-    #listes pour enregistrer chaque étape
-    history = {
-        "mailly": [],
-        "moulin": [],
-        "unmet_mailly": [],
-        "unmet_moulin": [],
-        "final_imbalance": []
-    }
+        # Metrics dictionary
+        metrics = {
+            "unmet_mailly": 0,
+            "unmet_moulin": 0,
+            "unmet_return_mailly": 0,
+            "unmet_return_moulin": 0,
+        }
 
-    # Simulation loop
-    for _ in range(steps):
-        state = step(state, p1, p2, rng, metrics)
+        # Simulation loop
+        for t in range(1, steps + 1):
+            state = step(state, p1, p2, rng, metrics, capacity_mailly, capacity_moulin)
 
-        # Enregistrer les mesures
-        history["mailly"].append(state.mailly)
-        history["moulin"].append(state.moulin)
-        history["unmet_mailly"].append(state.unmet_mailly)
-        history["unmet_moulin"].append(state.unmet_moulin)
-        history["final_imbalance"].append(0)
+            # passage du camion de rééquilibrage
+            if policy is not None and t % policy.every == 0:
+                _apply_truck(state, policy, lo, hi)
+
+            if accumulator is not None:
+                accumulator.add_step(state.mailly)
+
+            # Enregistrer les mesures tous les record_every pas
+            elif t % record_every == 0:
+                i = t // record_every - 1
+                history["mailly"][i] = state.mailly
+                history["moulin"][i] = state.moulin
+                history["unmet_mailly"][i] = state.unmet_mailly
+                history["unmet_moulin"][i] = state.unmet_moulin
 
     # calculer le déséquilibre final
-    final_diff = state.mailly - state.moulin
-    history["final_imbalance"] = [final_diff] * steps
+    metrics = {
+        "unmet_mailly": state.unmet_mailly,
+        "unmet_moulin": state.unmet_moulin,
+        "unmet_return_mailly": state.unmet_return_mailly,
+        "unmet_return_moulin": state.unmet_return_moulin,
+        "truck_moves": state.truck_moves,
+        "bikes_moved": state.bikes_moved,
+        "final_imbalance": state.mailly - state.moulin,
+    }
+    if accumulator is not None:
+        return accumulator.summary(metrics)
+    # historique sur disque (magasin ou memmap passé dans out)
+    flush_store(history)
+    return SimulationResult(**history, metrics=metrics, record_every=record_every)
+
 
-    return history
+def _clamp_scan(shift: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+    """Compose clamp maps ``x -> min(max(x + shift, lo), hi)`` cumulatively.
+
+    Clamp maps are closed under composition, so the map for the first ``k``
+    half-steps is again a clamp map. The prefix compositions are computed
+    with a log-depth (Hillis-Steele) scan instead of a loop over half-steps.
+
+    Args:
+        shift: Bike movement of each half-step
+        lo: Lower bound applied after each half-step
+        hi: Upper bound applied after each half-step
+
+    Returns:
+        Tuple (shift, lo, hi) of the composed maps for every prefix
+    """
+    shift, lo, hi = shift.copy(), lo.copy(), hi.copy()
+    new_lo = np.empty_like(lo)
+    new_hi = np.empty_like(hi)
+    offset = 1
+    while offset < shift.size:
+        # (map du préfixe k - offset) suivi de (map k)
+        m = shift.size - offset
+        later_shift, later_lo, later_hi = shift[offset:], lo[offset:], hi[offset:]
+        for bound, out in ((lo, new_lo[:m]), (hi, new_hi[:m])):
+            np.add(bound[:-offset], later_shift, out=out)
+            np.maximum(out, later_lo, out=out)
+            np.minimum(out, later_hi, out=out)
+        shift[offset:] += shift[:-offset]
+        lo[offset:] = new_lo[:m]
+        hi[offset:] = new_hi[:m]
+        offset *= 2
+    return shift, lo, hi
+
+
+def _aligned_block(block_steps: int, record_every: int) -> int:
+    """Block length that is a multiple of ``record_every``."""
+    return max(record_every, block_steps // record_every * record_every)
+
+
+def _run_vectorized(
+    initial_mailly: int,
+    initial_moulin: int,
+    steps: int,
+    p1: float,
+    p2: float,
+    rng: np.random.Generator,
+    history: Optional[Dict[str, np.ndarray]] = None,
+    record_every: int = 1,
+    accumulator: Optional[OccupancyAccumulator] = None,
+    block_steps: int = BLOCK_STEPS,
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+    policy=None,
+) -> State:
+    """Vectorized engine behind ``run_simulation(engine="vectorized")``.
+
+    Each step is split into two half-steps: Mailly -> Moulin (bike count at
+    Mailly decreases, floored at 0 or at the bikes Moulin cannot dock) then
+    Moulin -> Mailly (count increases, capped at the total number of bikes
+    or at the docks of Mailly). Uniform draws are taken in blocks in the
+    same order as step(), so trajectories match it exactly.
+
+    With a policy, blocks end at the steps where the truck passes, so the
+    policy is called once per block and never per step.
+
+    Recorded states are written into ``history`` and every state is fed to
+    ``accumulator`` when they are given; the final state is returned.
+    """
+    total = initial_mailly + initial_moulin
+    lo, hi = _occupancy_bounds(total, capacity_mailly, capacity_moulin)
+    state = State(mailly=initial_mailly, moulin=initial_moulin)
+    block_steps = _aligned_block(block_steps, record_every)
+
+    start = 0
+    while start < steps:
+        n = min(block_steps, steps - start)
+        if policy is not None:
+            n = min(n, policy.every - start % policy.every)
+
+        # deux tirages par pas, dans l'ordre de step()
+        draws = rng.random((n, 2))
+        departs = draws[:, 0] < p1
+        arrivals = draws[:, 1] < p2
+
+        half_shift = np.empty((n, 2), dtype=np.int32)
+        half_shift[:, 0] = -departs.astype(np.int32)
+        half_shift[:, 1] = arrivals
+        half_shift = half_shift.ravel()
+        shift, floor, cap = _clamp_scan(
+            half_shift,
+            np.full(2 * n, lo, dtype=np.int32),
+            np.full(2 * n, hi, dtype=np.int32),
+        )
+        after = np.minimum(np.maximum(state.mailly + shift, floor), cap)
+        before = np.concatenate(([state.mailly], after[:-1])).reshape(n, 2)
+
+        # demandes non satisfaites : station vide au moment du départ
+        unmet_a = np.cumsum(departs & (before[:, 0] == 0)) + state.unmet_mailly
+        unmet_b = np.cumsum(arrivals & (before[:, 1] == total)) + state.unmet_moulin
+        # retours refusés : plus de borne libre à l'arrivée
+        state.unmet_return_moulin += int(np.count_nonzero(departs & (before[:, 0] == lo) & (before[:, 0] > 0)))
+        state.unmet_return_mailly += int(np.count_nonzero(arrivals & (before[:, 1] == hi) & (before[:, 1] < total)))
+        block_mailly = after[1::2]
+
+        state.mailly = int(block_mailly[-1])
+        state.moulin = total - state.mailly
+        state.unmet_mailly = int(unmet_a[-1])
+        state.unmet_moulin = int(unmet_b[-1])
+
+        # passage du camion à la fin du bloc
+        if policy is not None and (start + n) % policy.every == 0:
+            _apply_truck(state, policy, lo, hi)
+            block_mailly[-1] = state.mailly
+
+        if accumulator is not None:
+            accumulator.add_block(block_mailly)
+
+        # enregistrer un pas sur record_every (block_mailly[i] : pas start + i + 1)
+        if history is not None:
+            offset = (record_every - 1 - start) % record_every
+            kept = slice(offset, None, record_every)
+            first = (start + offset + 1) // record_every - 1
+            recorded = block_mailly[kept]
+            rows = slice(first, first + recorded.size)
+            history["mailly"][rows] = recorded
+            history["moulin"][rows] = total - recorded
+            history["unmet_mailly"][rows] = unmet_a[kept]
+            history["unmet_moulin"][rows] = unmet_b[kept]
+
+        start += n
+
+    return state
+
+
+class _EventClock:
+    """Steps at which the demand of one route occurs, drawn as geometric gaps.
+
+    Over the steps, the demand of a route is a Bernoulli(p) process, so the
+    gaps between two demands follow a geometric distribution.
+    """
+
+    def __init__(self, rng: np.random.Generator, p: float, chunk: int):
+        self.rng = rng
+        self.p = p
+        self.chunk = max(chunk, 16)
+        self._pending = np.empty(0, dtype=np.int64)
+        self._last = -1
+
+    def until(self, stop: int) -> np.ndarray:
+        """Indices (from 0) of the next event steps before ``stop``."""
+        if self.p <= 0:
+            return np.empty(0, dtype=np.int64)
+        while self._last < stop:
+            gaps = self.rng.geometric(min(self.p, 1.0), size=self.chunk)
+            times = self._last + np.cumsum(gaps)
+            self._pending = np.concatenate((self._pending, times))
+            self._last = int(times[-1])
+        count = int(np.searchsorted(self._pending, stop))
+        events, self._pending = self._pending[:count], self._pending[count:]
+        return events
+
+
+def _run_jump(
+    initial_mailly: int,
+    initial_moulin: int,
+    steps: int,
+    p1: float,
+    p2: float,
+    rng: np.random.Generator,
+    history: Optional[Dict[str, np.ndarray]] = None,
+    record_every: int = 1,
+    accumulator: Optional[OccupancyAccumulator] = None,
+    block_events: int = BLOCK_STEPS,
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+) -> State:
+    """Event-skipping engine behind ``run_simulation(engine="jump")``.
+
+    Only the demand events are drawn and resolved (with the same clamp scan
+    as the vectorized engine). Between two events the state is constant, so
+    recorded states are looked up by step number and the occupancy statistics
+    are weighted by the length of each constant run. The cost grows with the
+    number of events, not with the number of steps.
+    """
+    total = initial_mailly + initial_moulin
+    lo, hi = _occupancy_bounds(total, capacity_mailly, capacity_moulin)
+    state = State(mailly=initial_mailly, moulin=initial_moulin)
+
+    # fenêtres d'environ block_events événements
+    rate = p1 + p2
+    window = steps if rate <= 0 else min(steps, int(block_events / rate))
+    window = max(window, 1)
+    departures = _EventClock(rng, p1, int(window * p1) + 1)
+    arrivals = _EventClock(rng, p2, int(window * p2) + 1)
+
+    for start in range(0, steps, window):
+        stop = min(start + window, steps)
+
+        # demi-pas : départ de Mailly (2t) puis arrivée à Mailly (2t + 1)
+        a = departures.until(stop)
+        b = arrivals.until(stop)
+        keys = np.concatenate((2 * a, 2 * b + 1))
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        moves = np.concatenate(
+            (np.full(a.size, -1, dtype=np.int32), np.ones(b.size, dtype=np.int32))
+        )[order]
+        event_steps = keys // 2
+
+        shift, floor, cap = _clamp_scan(
+            moves,
+            np.full(moves.size, lo, dtype=np.int32),
+            np.full(moves.size, hi, dtype=np.int32),
+        )
+        after = np.minimum(np.maximum(state.mailly + shift, floor), cap)
+        before = np.concatenate(([state.mailly], after[:-1]))
+
+        # demandes non satisfaites : station vide au moment du départ
+        unmet_a = np.cumsum((moves < 0) & (before == 0))
+        unmet_b = np.cumsum((moves > 0) & (before == total))
+        # retours refusés : plus de borne libre à l'arrivée
+        state.unmet_return_moulin += int(np.count_nonzero((moves < 0) & (before == lo) & (before > 0)))
+        state.unmet_return_mailly += int(np.count_nonzero((moves > 0) & (before == hi) & (before < total)))
+
+        # événement fictif au pas start - 1 portant l'état de début de fenêtre
+        event_steps = np.concatenate(([start - 1], event_steps))
+        mailly = np.concatenate(([state.mailly], after))
+        unmet_a = np.concatenate(([0], unmet_a)) + state.unmet_mailly
+        unmet_b = np.concatenate(([0], unmet_b)) + state.unmet_moulin
+
+        if accumulator is not None:
+            # état après le dernier événement de chaque pas, constant ensuite
+            last = np.append(event_steps[1:] != event_steps[:-1], True)
+            run_starts = np.maximum(event_steps[last], start)
+            run_ends = np.append(run_starts[1:], stop)
+            accumulator.add_segments(mailly[last], run_ends - run_starts)
+
+        if history is not None:
+            # pas enregistrés dans la fenêtre : t + 1 multiple de record_every
+            first = -(-(start + 1) // record_every)
+            recorded = np.arange(first * record_every - 1, stop, record_every)
+            latest = np.searchsorted(event_steps, recorded, side="right") - 1
+            rows = slice(first - 1, first - 1 + recorded.size)
+            history["mailly"][rows] = mailly[latest]
+            history["moulin"][rows] = total - mailly[latest]
+            history["unmet_mailly"][rows] = unmet_a[latest]
+            history["unmet_moulin"][rows] = unmet_b[latest]
+
+        state.mailly = int(mailly[-1])
+        state.moulin = total - state.mailly
+        state.unmet_mailly = int(unmet_a[-1])
+        state.unmet_moulin = int(unmet_b[-1])
+
+    return state
+
+
+# Constantes de SplitMix64
+_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(z):
+    """SplitMix64 output function."""
+    z = (z ^ (z >> np.uint64(30))) * _MIX1
+    z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+def _uniform(key, counter):
+    """Counter-based uniform draw in [0, 1): draw number ``counter`` of stream ``key``."""
+    z = _mix(key + (counter + np.uint64(1)) * _GAMMA)
+    return (z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+def _compiled_steps(
+    mailly,
+    total,
+    lo,
+    hi,
+    steps,
+    p1,
+    p2,
+    seed,
+    record_every,
+    out_mailly,
+    out_moulin,
+    out_unmet_mailly,
+    out_unmet_moulin,
+    occupancy,
+):
+    """Step loop of the numba engine, same rules as step().
+
+    Draws 2t and 2t + 1 of the counter-based stream decide the two moves of
+    step t. The bikes at Mailly stay within [lo, hi], the range allowed by
+    the docks (see _occupancy_bounds). Recorded states go to the ``out_*``
+    arrays (history mode) or to the ``occupancy`` histogram (summary mode,
+    when it is not empty).
+
+    Returns:
+        Tuple (mailly, unmet_mailly, unmet_moulin, unmet_return_mailly,
+        unmet_return_moulin, empty spells at Mailly, empty spells at Moulin)
+    """
+    key = _mix(np.uint64(seed))
+    summary = occupancy.size > 0
+    unmet_mailly = 0
+    unmet_moulin = 0
+    return_mailly = 0
+    return_moulin = 0
+    spells_mailly = 0
+    spells_moulin = 0
+    previous = -1
+    for t in range(steps):
+        # Mailly vers Moulin
+        if _uniform(key, np.uint64(2 * t)) < p1:
+            if mailly == 0:
+                unmet_mailly += 1
+            elif mailly == lo:
+                return_moulin += 1
+            else:
+                mailly -= 1
+
+        # Moulin vers Mailly
+        if _uniform(key, np.uint64(2 * t + 1)) < p2:
+            if mailly == total:
+                unmet_moulin += 1
+            elif mailly == hi:
+                return_mailly += 1
+            else:
+                mailly += 1
+
+        if summary:
+            occupancy[mailly] += 1
+            if mailly == 0 and previous != 0:
+                spells_mailly += 1
+            if mailly == total and previous != total:
+                spells_moulin += 1
+            previous = mailly
+        elif (t + 1) % record_every == 0:
+            i = (t + 1) // record_every - 1
+            out_mailly[i] = mailly
+            out_moulin[i] = total - mailly
+            out_unmet_mailly[i] = unmet_mailly
+            out_unmet_moulin[i] = unmet_moulin
+    return (
+        mailly,
+        unmet_mailly,
+        unmet_moulin,
+        return_mailly,
+        return_moulin,
+        spells_mailly,
+        spells_moulin,
+    )
+
+
+if numba is not None:
+    _mix = numba.njit(nogil=True, cache=True)(_mix)
+    _uniform = numba.njit(nogil=True, cache=True)(_uniform)
+    _compiled_steps = numba.njit(nogil=True, cache=True)(_compiled_steps)
+
+
+def _run_numba(
+    initial_mailly: int,
+    initial_moulin: int,
+    steps: int,
+    p1: float,
+    p2: float,
+    seed: int,
+    history: Optional[Dict[str, np.ndarray]] = None,
+    record_every: int = 1,
+    accumulator: Optional[OccupancyAccumulator] = None,
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+) -> State:
+    """Compiled engine behind ``run_simulation(engine="numba")``.
+
+    The kernel releases the GIL, so several threads can run it in parallel.
+    """
+    total = initial_mailly + initial_moulin
+    lo, hi = _occupancy_bounds(total, capacity_mailly, capacity_moulin)
+    unused = np.empty(0, dtype=np.int64)
+    if history is None:
+        history = dict.fromkeys(("mailly", "moulin", "unmet_mailly", "unmet_moulin"), unused)
+    occupancy = accumulator.histogram if accumulator is not None else unused
+
+    counts = _compiled_steps(
+        initial_mailly,
+        total,
+        lo,
+        hi,
+        steps,
+        float(p1),
+        float(p2),
+        seed,
+        record_every,
+        history["mailly"],
+        history["moulin"],
+        history["unmet_mailly"],
+        history["unmet_moulin"],
+        occupancy,
+    )
+    mailly, unmet_mailly, unmet_moulin, return_mailly, return_moulin = counts[:5]
+    spells_mailly, spells_moulin = counts[5:]
+    if accumulator is not None:
+        accumulator.empty_spells["mailly"] += spells_mailly
+        accumulator.empty_spells["moulin"] += spells_moulin
+    return State(
+        mailly=mailly,
+        moulin=total - mailly,
+        unmet_mailly=unmet_mailly,
+        unmet_moulin=unmet_moulin,
+        unmet_return_mailly=return_mailly,
+        unmet_return_moulin=return_moulin,
+    )
+
+
+def _batch_moves(
+    departs,
+    arrivals,
+    first,
+    last,
+    mailly,
+    moulin,
+    cap_mailly,
+    cap_moulin,
+    unmet_mailly,
+    unmet_moulin,
+    return_mailly,
+    return_moulin,
+    out_mailly,
+    out_unmet_mailly,
+    out_unmet_moulin,
+):
+    """Apply steps first..last - 1 of a block to every replica (compiled with numba).
+
+    Same rules as step(): departs[i, t] / arrivals[i, t] tell whether replica
+    i has a user at Mailly / Moulin at step t of the block. States are
+    updated in place and the state after each step goes to the ``out_*``
+    arrays.
+    """
+    for i in range(mailly.size):
+        a, b = mailly[i], moulin[i]
+        unmet_a, unmet_b = unmet_mailly[i], unmet_moulin[i]
+        for t in range(first, last):
+            # Mailly vers Moulin
+            if departs[i, t]:
+                if a == 0:
+                    unmet_a += 1
+                elif b >= cap_moulin[i]:
+                    return_moulin[i] += 1
+                else:
+                    a -= 1
+                    b += 1
+
+            # Moulin vers Mailly
+            if arrivals[i, t]:
+                if b == 0:
+                    unmet_b += 1
+                elif a >= cap_mailly[i]:
+                    return_mailly[i] += 1
+                else:
+                    b -= 1
+                    a += 1
+
+            out_mailly[i, t] = a
+            out_unmet_mailly[i, t] = unmet_a
+            out_unmet_moulin[i, t] = unmet_b
+        mailly[i], moulin[i] = a, b
+        unmet_mailly[i], unmet_moulin[i] = unmet_a, unmet_b
+
+
+if numba is not None:
+    _batch_moves = numba.njit(nogil=True, cache=True)(_batch_moves)
+
+
+def _batch_moves_numpy(
+    departs,
+    arrivals,
+    first,
+    last,
+    mailly,
+    moulin,
+    cap_mailly,
+    cap_moulin,
+    unmet_mailly,
+    unmet_moulin,
+    return_mailly,
+    return_moulin,
+    out_mailly,
+    out_unmet_mailly,
+    out_unmet_moulin,
+):
+    """_batch_moves without numba: one step at a time on the (N,) state arrays."""
+    for t in range(first, last):
+        # Mailly vers Moulin
+        wants = departs[:, t]
+        has_bike = mailly > 0
+        moved = wants & has_bike & (moulin < cap_moulin)
+        mailly -= moved
+        moulin += moved
+        unmet_mailly += wants & ~has_bike
+        return_moulin += wants & has_bike & ~moved
+
+        # Moulin vers Mailly
+        wants = arrivals[:, t]
+        has_bike = moulin > 0
+        moved = wants & has_bike & (mailly < cap_mailly)
+        moulin -= moved
+        mailly += moved
+        unmet_moulin += wants & ~has_bike
+        return_mailly += wants & has_bike & ~moved
+
+        out_mailly[:, t] = mailly
+        out_unmet_mailly[:, t] = unmet_mailly
+        out_unmet_moulin[:, t] = unmet_moulin
+
+
+def run_batch(
+    initial_mailly,
+    initial_moulin,
+    steps,
+    p1,
+    p2,
+    seeds,
+    record_every: int = 1,
+    output: str = "history",
+    block_steps: int = BLOCK_STEPS,
+    capacity_mailly=None,
+    capacity_moulin=None,
+    policy=None,
+    block_entries: int = BATCH_BLOCK_ENTRIES,
+) -> Union[SimulationResult, SimulationSummary]:
+    """Run many independent replicas together as ``(N,)`` state arrays.
+
+    Every argument may be a scalar or a sequence of length N; scalars are
+    broadcast, so the same call serves N parameter rows or N seeds for one
+    row. Replica ``i`` draws from ``np.random.default_rng(seeds[i])`` in the
+    same order as step(), so its trajectory is identical to the one returned
+    by run_simulation for the same parameters.
+
+    Steps are processed in blocks of at most ``block_entries // N`` steps,
+    so the memory used per block does not grow with the number of replicas.
+    With numba installed, the steps of a block are applied by a compiled
+    kernel (_batch_moves); otherwise one step at a time with array
+    operations, with the same results.
+
+    Args:
+        initial_mailly: Initial number of bikes at Mailly station
+        initial_moulin: Initial number of bikes at Moulin station
+        steps: Number of simulation steps to run
+        p1: Probability of movement from Mailly to Moulin
+        p2: Probability of movement from Moulin to Mailly
+        seeds: Random seed (int or SeedSequence) of each replica
+        record_every: Record the state after every k-th step only
+        output: "history" or "summary", as in run_simulation
+        block_steps: Maximum number of steps drawn at once for each replica
+        capacity_mailly: Number of docks at Mailly (None or NaN: unlimited)
+        capacity_moulin: Number of docks at Moulin (None or NaN: unlimited)
+        policy: Rebalancing policy called on the (N,) bike arrays at the end
+            of every ``policy.every``-th step; its parameters may be (N,)
+            arrays to give each replica its own policy settings
+        block_entries: Maximum number of (replica, step) pairs of a block
+
+    Returns:
+        SimulationResult whose history arrays have shape
+        (N, max(steps) // record_every) and whose metrics are (N,) arrays.
+        Replicas with fewer steps keep their final values until the end.
+        With output="summary", a SimulationSummary with an (N, total + 1)
+        occupancy histogram counting only the steps of each replica.
+    """
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown output {output!r}, expected one of {OUTPUTS}")
+    if record_every < 1:
+        raise ValueError(f"record_every must be >= 1, got {record_every}")
+
+    capacities = [np.nan if c is None else c for c in (capacity_mailly, capacity_moulin)]
+    mailly, moulin, steps, p1, p2, seeds, cap_mailly, cap_moulin = np.broadcast_arrays(
+        initial_mailly, initial_moulin, steps, p1, p2, seeds, *capacities
+    )
+    mailly = mailly.astype(np.int32)
+    moulin = moulin.astype(np.int32)
+    steps = steps.astype(np.int64)
+    replicas = mailly.size
+    horizon = int(steps.max()) if replicas else 0
+
+    # capacité illimitée : autant de bornes que de vélos
+    total = mailly + moulin
+    cap_mailly = np.where(pd.isna(cap_mailly), total, cap_mailly).astype(np.int32)
+    cap_moulin = np.where(pd.isna(cap_moulin), total, cap_moulin).astype(np.int32)
+    if np.any(cap_mailly < mailly) or np.any(cap_moulin < moulin):
+        raise ValueError("A replica starts with more bikes than the docks of its station")
+    lo, hi = _occupancy_bounds(total, cap_mailly, cap_moulin)
+    if policy is not None and policy.every < 1:
+        raise ValueError(f"policy.every must be >= 1, got {policy.every}")
+
+    # un générateur par réplique, tiré par blocs
+    rngs = [
+        np.random.default_rng(seed if isinstance(seed, np.random.SeedSequence) else int(seed))
+        for seed in seeds
+    ]
+    unmet_mailly = np.zeros(replicas, dtype=np.int32)
+    unmet_moulin = np.zeros(replicas, dtype=np.int32)
+    return_mailly = np.zeros(replicas, dtype=np.int32)
+    return_moulin = np.zeros(replicas, dtype=np.int32)
+    truck_moves = np.zeros(replicas, dtype=np.int32)
+    bikes_moved = np.zeros(replicas, dtype=np.int64)
+
+    max_total = int(total.max()) if replicas else 0
+    history, occupancy = None, None
+    if output == "summary":
+        occupancy = np.zeros((replicas, max_total + 1), dtype=np.int64)
+        empty_spells = {"mailly": np.zeros(replicas, dtype=np.int64),
+                        "moulin": np.zeros(replicas, dtype=np.int64)}
+        previous = np.full(replicas, -1, dtype=np.int32)
+    else:
+        history = _empty_history((replicas, horizon // record_every), max_total, horizon)
+
+    # blocs bornés en nombre de couples (réplique, pas)
+    block_steps = max(1, min(block_steps, block_entries // max(replicas, 1)))
+    moves = _batch_moves if numba is not None else _batch_moves_numpy
+    buffer = np.empty((replicas, block_steps, 2))
+    for start in range(0, horizon, block_steps):
+        n = min(block_steps, horizon - start)
+        done = start + np.arange(1, n + 1)
+
+        # u = 1 au-delà de l'horizon d'une réplique : aucun événement
+        draws = buffer[:, :n]
+        for i, count in enumerate(np.clip(steps - start, 0, n).tolist()):
+            if count:
+                rngs[i].random(out=draws[i, :count])
+            if count < n:
+                draws[i, count:] = 1.0
+        departs = draws[:, :, 0] < p1[:, None]
+        arrivals = draws[:, :, 1] < p2[:, None]
+
+        block_mailly = np.empty((replicas, n), dtype=np.int32)
+        block_unmet_mailly = np.empty((replicas, n), dtype=np.int32)
+        block_unmet_moulin = np.empty((replicas, n), dtype=np.int32)
+        first = 0
+        while first < n:
+            # le bloc s'arrête aux pas où passe le camion
+            last = n if policy is None else min(n, first + policy.every - (start + first) % policy.every)
+            moves(
+                departs, arrivals, first, last, mailly, moulin, cap_mailly, cap_moulin,
+                unmet_mailly, unmet_moulin, return_mailly, return_moulin,
+                block_mailly, block_unmet_mailly, block_unmet_moulin,
+            )
+            if policy is not None and done[last - 1] % policy.every == 0:
+                # passage du camion, seulement pour les répliques encore actives
+                move = np.where(done[last - 1] <= steps, _truck_moves(policy, mailly, moulin, lo, hi), 0)
+                mailly += move.astype(np.int32)
+                moulin -= move.astype(np.int32)
+                truck_moves += move != 0
+                bikes_moved += np.abs(move)
+                block_mailly[:, last - 1] = mailly
+            first = last
+
+        if occupancy is not None:
+            # seulement les pas de l'horizon de chaque réplique
+            active = done <= steps[:, None]
+            cells = block_mailly + (max_total + 1) * np.arange(replicas, dtype=np.int64)[:, None]
+            occupancy += np.bincount(cells[active], minlength=occupancy.size).reshape(occupancy.shape)
+            before = np.concatenate((previous[:, None], block_mailly[:, :-1]), axis=1)
+            for station, empty in (("mailly", 0), ("moulin", total[:, None])):
+                starts = active & (block_mailly == empty) & (before != empty)
+                empty_spells[station] += np.count_nonzero(starts, axis=1)
+            previous = block_mailly[:, -1].copy()
+        else:
+            # enregistrer un pas sur record_every (colonne t : pas start + t + 1)
+            offset = (record_every - 1 - start) % record_every
+            kept = slice(offset, None, record_every)
+            column = (start + offset + 1) // record_every - 1
+            recorded = block_mailly[:, kept]
+            columns = slice(column, column + recorded.shape[1])
+            history["mailly"][:, columns] = recorded
+            history["moulin"][:, columns] = total[:, None] - recorded
+            history["unmet_mailly"][:, columns] = block_unmet_mailly[:, kept]
+            history["unmet_moulin"][:, columns] = block_unmet_moulin[:, kept]
+
+    metrics = {
+        "unmet_mailly": unmet_mailly,
+        "unmet_moulin": unmet_moulin,
+        "unmet_return_mailly": return_mailly,
+        "unmet_return_moulin": return_moulin,
+        "truck_moves": truck_moves,
+        "bikes_moved": bikes_moved,
+        "final_imbalance": mailly - moulin,
+    }
+    if occupancy is not None:
+        return SimulationSummary(
+            metrics=metrics,
+            occupancy=occupancy,
+            empty_spells=empty_spells,
+            total=total,
+            capacity_mailly=cap_mailly,
+            capacity_moulin=cap_moulin,
+        )
+    return SimulationResult(**history, metrics=metrics, record_every=record_every)
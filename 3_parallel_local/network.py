@@ -0,0 +1,431 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple, Union
+import numpy as np
+import scipy.sparse as sp
+
+from model import BLOCK_STEPS, OUTPUTS, numba
+
+
+# Nombre de comparaisons (pas x entrées de la matrice) tirées en une fois
+BLOCK_ENTRIES = 1 << 22
+
+
+@dataclass
+class Network:
+    """Stations of a bike-sharing system and their origin-destination demand.
+
+    Attributes:
+        demand: Sparse (CSR) matrix where demand[i, j] is the probability
+            that a user at station i wants to ride to station j during a step.
+            Each row sums to at most 1: at most one user per station and step.
+        names: Name of each station
+        capacity: Number of docks at each station, or None when unlimited
+    """
+
+    demand: sp.csr_matrix
+    names: Tuple[str, ...]
+    capacity: Optional[np.ndarray] = None
+
+    @property
+    def size(self) -> int:
+        """Number of stations."""
+        return self.demand.shape[0]
+
+
+def make_network(
+    demand,
+    names: Optional[Sequence[str]] = None,
+    capacity: Optional[Sequence[float]] = None,
+) -> Network:
+    """Build a network from a dense or sparse origin-destination matrix.
+
+    Args:
+        demand: Square matrix (NumPy array or scipy.sparse) of trip probabilities
+        names: Station names (default: "0", "1", ...)
+        capacity: Number of docks at each station; None, or NaN for a
+            station, means unlimited
+
+    Returns:
+        Network with the demand stored in CSR format
+
+    Raises:
+        ValueError: If the matrix is not square, has probabilities outside
+            [0, 1] or a row summing to more than 1
+    """
+    demand = sp.csr_matrix(demand, dtype=float)
+    demand.eliminate_zeros()
+    demand.sort_indices()
+    n, m = demand.shape
+    if n != m:
+        raise ValueError(f"Demand matrix must be square, got {n}x{m}")
+    if demand.nnz and (demand.data.min() < 0 or demand.data.max() > 1):
+        raise ValueError("Demand probabilities must be in [0, 1]")
+    if n and np.asarray(demand.sum(axis=1)).max() > 1 + 1e-12:
+        raise ValueError("Each row of the demand matrix must sum to at most 1")
+    names = tuple(str(i) for i in range(n)) if names is None else tuple(names)
+    if len(names) != n:
+        raise ValueError(f"Expected {n} station names, got {len(names)}")
+    if capacity is not None:
+        capacity = np.asarray(capacity, dtype=float)
+        if capacity.shape != (n,):
+            raise ValueError(f"Expected {n} station capacities, got shape {capacity.shape}")
+        # capacité illimitée : plus grand entier représentable
+        limited = ~np.isnan(capacity)
+        docks = np.full(n, np.iinfo(np.int64).max)
+        docks[limited] = capacity[limited]
+        capacity = docks
+    return Network(demand=demand, names=names, capacity=capacity)
+
+
+def two_station_network(
+    p1: float,
+    p2: float,
+    capacity_mailly: Optional[int] = None,
+    capacity_moulin: Optional[int] = None,
+) -> Network:
+    """The Mailly/Moulin model of model.py as a two-station network.
+
+    run_network on this network with initial bikes (mailly, moulin) gives
+    the same trajectories as run_simulation for the same seed and capacities.
+    """
+    capacity = None
+    if capacity_mailly is not None or capacity_moulin is not None:
+        capacity = [np.nan if c is None else c for c in (capacity_mailly, capacity_moulin)]
+    return make_network([[0.0, p1], [p2, 0.0]], names=("mailly", "moulin"), capacity=capacity)
+
+
+@dataclass
+class NetworkResult:
+    """History of a network simulation.
+
+    Attributes:
+        bikes: Bikes at each station after each recorded step, shape (records, n)
+        unmet: Cumulative unmet departures at each station, shape (records, n)
+        metrics: Final 'unmet', 'unmet_return' (trips refused because the
+            station had no free dock) and 'bikes' of each station, arrays of
+            shape (n,)
+        record_every: Number of steps between two recorded states
+    """
+
+    bikes: np.ndarray
+    unmet: np.ndarray
+    metrics: Dict[str, np.ndarray]
+    record_every: int = 1
+
+    @property
+    def time(self) -> np.ndarray:
+        """Step number (starting at 1) of each recorded state."""
+        return np.arange(1, self.bikes.shape[0] + 1) * self.record_every
+
+
+@dataclass
+class NetworkSummary:
+    """Final metrics and per-station occupancy statistics of a network run.
+
+    Attributes:
+        metrics: Final 'unmet', 'unmet_return' and 'bikes' of each station,
+            arrays of shape (n,)
+        steps: Number of simulated steps
+        bike_sum: Sum over the steps of the bikes at each station
+        bike_square_sum: Sum over the steps of the squared bikes at each station
+        min_bikes: Minimum number of bikes seen at each station
+        max_bikes: Maximum number of bikes seen at each station
+        time_empty: Number of steps each station spent empty
+        time_full: Number of steps each station spent with no free dock or
+            holding all the bikes
+    """
+
+    metrics: Dict[str, np.ndarray]
+    steps: int
+    bike_sum: np.ndarray
+    bike_square_sum: np.ndarray
+    min_bikes: np.ndarray
+    max_bikes: np.ndarray
+    time_empty: np.ndarray
+    time_full: np.ndarray
+
+    def statistics(self) -> Dict[str, np.ndarray]:
+        """Mean, std, min, max and time spent empty or full at each station.
+
+        Min and max are floats, NaN (like the mean and std) for a run of
+        0 steps.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.bike_sum / self.steps
+            var = self.bike_square_sum / self.steps - mean**2
+        low, high = self.min_bikes.astype(float), self.max_bikes.astype(float)
+        if self.steps == 0:
+            low.fill(np.nan)
+            high.fill(np.nan)
+        return {
+            "mean": mean,
+            "std": np.sqrt(np.maximum(var, 0.0)),
+            "min": low,
+            "max": high,
+            "time_empty": self.time_empty,
+            "time_full": self.time_full,
+        }
+
+
+def _draw_trips(
+    network: Network,
+    draws: np.ndarray,
+    entry_rows: np.ndarray,
+    cumulative: np.ndarray,
+) -> np.ndarray:
+    """Destination of the user drawn at each station, or -1 if there is none.
+
+    Station i has a user going to the first destination j of its row with
+    draws[:, i] < cumulative demand up to j, as step() does with ``u < p``.
+
+    Args:
+        network: Network whose demand is used
+        draws: Uniform draws of shape (steps, n)
+        entry_rows: Row (origin) of each stored entry of the demand matrix
+        cumulative: Cumulative probability of each entry within its row
+
+    Returns:
+        Array of shape (steps, n) with the destination index or -1
+    """
+    demand = network.demand
+    if demand.nnz == 0:
+        return np.full(draws.shape, -1, dtype=np.int64)
+
+    # nombre de destinations dépassées par le tirage dans chaque ligne
+    passed = draws[:, entry_rows] >= cumulative
+    passed_so_far = np.zeros((draws.shape[0], demand.nnz + 1), dtype=np.int32)
+    np.cumsum(passed, axis=1, out=passed_so_far[:, 1:])
+    skipped = passed_so_far[:, demand.indptr[1:]] - passed_so_far[:, demand.indptr[:-1]]
+
+    has_trip = skipped < np.diff(demand.indptr)
+    entry = np.minimum(demand.indptr[:-1] + skipped, demand.nnz - 1)
+    return np.where(has_trip, demand.indices[entry], -1)
+
+
+def _resolve_step(
+    bikes: np.ndarray,
+    unmet: np.ndarray,
+    unmet_return: np.ndarray,
+    capacity: np.ndarray,
+    origins: np.ndarray,
+    destinations: np.ndarray,
+) -> None:
+    """Apply the trips of one step in place, in increasing origin order.
+
+    The outcome of a trip only depends on the stations it touches, so every
+    pending trip that is the first pending one on both of its stations can be
+    settled at once with array operations. Rounds repeat until all trips are
+    settled; this gives the same result as processing origins one by one.
+    A trip to a station with no free dock leaves the bike at its origin.
+
+    Args:
+        bikes: Bikes at each station, updated in place
+        unmet: Unmet departures at each station, updated in place
+        unmet_return: Refused returns at each station, updated in place
+        capacity: Number of docks at each station
+        origins: Origin of each trip, in increasing order
+        destinations: Destination of each trip
+    """
+    pending = np.arange(origins.size)
+    first = np.empty(bikes.size, dtype=np.int64)
+    while pending.size:
+        o = origins[pending]
+        d = destinations[pending]
+
+        # premier trajet en attente touchant chaque station
+        first.fill(origins.size)
+        np.minimum.at(first, d, pending)
+        np.minimum.at(first, o, pending)
+        leader = (first[o] == pending) & (first[d] == pending)
+
+        o, d = o[leader], d[leader]
+        has_bike = bikes[o] > 0
+        served = has_bike & (bikes[d] < capacity[d])
+        bikes[o[served]] -= 1
+        bikes[d[served]] += 1
+        unmet[o[~has_bike]] += 1
+        unmet_return[d[has_bike & ~served]] += 1
+        pending = pending[~leader]
+
+
+def _resolve_block(
+    draws: np.ndarray,
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    cumulative: np.ndarray,
+    bikes: np.ndarray,
+    unmet: np.ndarray,
+    unmet_return: np.ndarray,
+    capacity: np.ndarray,
+    out_bikes: np.ndarray,
+    out_unmet: np.ndarray,
+) -> None:
+    """Draw and apply the trips of a block of steps (compiled with numba).
+
+    Same rules as _draw_trips followed by _resolve_step for each step: the
+    destination of station i is the first entry of its row with
+    draws[t, i] < cumulative (binary search), and trips are applied in
+    station order. The state after each step goes to out_bikes / out_unmet.
+    """
+    count, n = draws.shape
+    for t in range(count):
+        for i in range(n):
+            u = draws[t, i]
+            first, last = indptr[i], indptr[i + 1]
+            # cas le plus fréquent : pas d'usager (tirage au-delà du total de la ligne)
+            if first == last or u >= cumulative[last - 1]:
+                continue
+            # première destination dont la probabilité cumulée dépasse le tirage
+            while first < last:
+                middle = (first + last) // 2
+                if u >= cumulative[middle]:
+                    first = middle + 1
+                else:
+                    last = middle
+            d = indices[first]
+            if bikes[i] == 0:
+                unmet[i] += 1
+            elif bikes[d] >= capacity[d]:
+                unmet_return[d] += 1
+            else:
+                bikes[i] -= 1
+                bikes[d] += 1
+        out_bikes[t] = bikes
+        out_unmet[t] = unmet
+
+
+if numba is not None:
+    _resolve_block = numba.njit(nogil=True, cache=True)(_resolve_block)
+
+
+def run_network(
+    network: Network,
+    initial_bikes,
+    steps: int,
+    seed: int,
+    record_every: int = 1,
+    output: str = "history",
+    block_steps: int = BLOCK_STEPS,
+) -> Union[NetworkResult, NetworkSummary]:
+    """Simulate a bike-sharing network with any number of stations.
+
+    At each step every station draws one uniform number (in station order,
+    like the two draws of step()) that decides whether a user wants to leave
+    from it and to which destination. Trips are then applied in station
+    order: a user finding no bike is counted as unmet demand at the origin,
+    and a trip to a station with no free dock as an unmet return there.
+
+    With numba installed, each block of steps is resolved by a compiled
+    kernel (_resolve_block); otherwise the trips of a block are drawn with
+    array operations and applied one step at a time, with the same results.
+
+    Args:
+        network: Stations and origin-destination demand
+        initial_bikes: Initial number of bikes at each station
+        steps: Number of simulation steps to run
+        seed: Random seed for reproducibility
+        record_every: Record the state after every k-th step only
+        output: "history" or "summary", as in run_simulation
+        block_steps: Maximum number of steps drawn at once
+
+    Returns:
+        NetworkResult with (records, n) histories, or NetworkSummary with
+        per-station statistics when output="summary"
+    """
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown output {output!r}, expected one of {OUTPUTS}")
+    if record_every < 1:
+        raise ValueError(f"record_every must be >= 1, got {record_every}")
+
+    n = network.size
+    bikes = np.array(initial_bikes, dtype=np.int64)
+    if bikes.shape != (n,):
+        raise ValueError(f"Expected {n} initial bike counts, got shape {bikes.shape}")
+    unmet = np.zeros(n, dtype=np.int64)
+    unmet_return = np.zeros(n, dtype=np.int64)
+    capacity = network.capacity
+    if capacity is None:
+        capacity = np.full(n, np.iinfo(np.int64).max)
+    if np.any(bikes > capacity):
+        raise ValueError("A station starts with more bikes than its capacity")
+    rng = np.random.default_rng(seed)
+
+    demand = network.demand
+    entry_rows = np.repeat(np.arange(n), np.diff(demand.indptr))
+    # probabilités cumulées ligne par ligne (comme u < p dans step())
+    cumulative = demand.data.copy()
+    for i in range(n):
+        row = slice(demand.indptr[i], demand.indptr[i + 1])
+        cumulative[row] = np.cumsum(cumulative[row])
+
+    # blocs alignés sur record_every, bornés en nombre de comparaisons
+    block_steps = min(block_steps, max(1, BLOCK_ENTRIES // max(demand.nnz, n, 1)))
+    block_steps = max(record_every, block_steps // record_every * record_every)
+
+    if output == "summary":
+        bike_sum = np.zeros(n, dtype=np.int64)
+        bike_square_sum = np.zeros(n, dtype=np.int64)
+        min_bikes = np.full(n, np.iinfo(np.int64).max)
+        max_bikes = np.zeros(n, dtype=np.int64)
+        time_empty = np.zeros(n, dtype=np.int64)
+        time_full = np.zeros(n, dtype=np.int64)
+        # station pleine : plus de borne libre ou tous les vélos du réseau
+        full = np.minimum(capacity, bikes.sum())
+    else:
+        records = steps // record_every
+        total = int(bikes.sum())
+        history_bikes = np.empty((records, n), dtype=np.uint16 if total < 2**16 else np.int32)
+        history_unmet = np.empty((records, n), dtype=np.int32 if steps < 2**31 else np.int64)
+
+    for start in range(0, steps, block_steps):
+        count = min(block_steps, steps - start)
+        draws = rng.random((count, n))
+        block_bikes = np.empty((count, n), dtype=np.int64)
+        block_unmet = np.empty((count, n), dtype=np.int64)
+        if numba is not None:
+            _resolve_block(
+                draws, demand.indptr, demand.indices, cumulative,
+                bikes, unmet, unmet_return, capacity, block_bikes, block_unmet,
+            )
+        else:
+            trips = _draw_trips(network, draws, entry_rows, cumulative)
+            for t in range(count):
+                origins = np.flatnonzero(trips[t] >= 0)
+                if origins.size:
+                    _resolve_step(bikes, unmet, unmet_return, capacity, origins, trips[t, origins])
+                block_bikes[t] = bikes
+                block_unmet[t] = unmet
+
+        if output == "summary":
+            bike_sum += block_bikes.sum(axis=0)
+            bike_square_sum += (block_bikes**2).sum(axis=0)
+            np.minimum(min_bikes, block_bikes.min(axis=0), out=min_bikes)
+            np.maximum(max_bikes, block_bikes.max(axis=0), out=max_bikes)
+            time_empty += (block_bikes == 0).sum(axis=0)
+            time_full += (block_bikes >= full).sum(axis=0)
+        else:
+            kept = slice(record_every - 1, None, record_every)
+            first = start // record_every
+            recorded = block_bikes[kept]
+            rows = slice(first, first + recorded.shape[0])
+            history_bikes[rows] = recorded
+            history_unmet[rows] = block_unmet[kept]
+
+    metrics = {"unmet": unmet, "unmet_return": unmet_return, "bikes": bikes}
+    if output == "summary":
+        return NetworkSummary(
+            metrics=metrics,
+            steps=steps,
+            bike_sum=bike_sum,
+            bike_square_sum=bike_square_sum,
+            min_bikes=min_bikes,
+            max_bikes=max_bikes,
+            time_empty=time_empty,
+            time_full=time_full,
+        )
+    return NetworkResult(
+        bikes=history_bikes,
+        unmet=history_unmet,
+        metrics=metrics,
+        record_every=record_every,
+    )
@@ -0,0 +1,268 @@
+import csv
+from pathlib import Path
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Union
+import warnings
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pyarrow (sortie colonnaire optionnelle) et pandas sont importés au premier
+# usage : ils coûtent plus cher à importer qu'une tâche courte de run_one.py
+pa = ds = feather = pq = None
+
+
+# Formats de sortie : tables colonnaires compressées, ou export CSV
+FORMATS = ("parquet", "feather", "csv")
+
+# Extension des fichiers de chaque format
+EXTENSIONS = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+
+# Colonnes d'un enregistrement contenant une valeur par pas enregistré
+SERIES_COLUMNS = ("mailly", "moulin", "unmet_mailly", "unmet_moulin")
+
+# Histogramme d'occupation du mode résumé (entrée k : pas avec k vélos à Mailly)
+HISTOGRAM_COLUMN = "occupancy_mailly"
+
+# Compression des fichiers parquet et feather
+COMPRESSION = "zstd"
+
+
+def _import_arrow() -> bool:
+    """Import pyarrow on first use; False when it is not installed."""
+    global pa, ds, feather, pq
+    if pa is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.dataset as ds
+            import pyarrow.feather as feather
+            import pyarrow.parquet as pq
+        except ImportError:
+            return False
+    return True
+
+
+def resolve_format(fmt: str) -> str:
+    """Output format to use: ``fmt``, or "csv" with a warning when pyarrow is missing."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    if fmt != "csv" and not _import_arrow():
+        warnings.warn(f"pyarrow is not installed, writing csv instead of {fmt}", RuntimeWarning)
+        return "csv"
+    return fmt
+
+
+def _index_dtype(max_value: int) -> np.dtype:
+    """Smallest signed integer dtype holding step numbers up to ``max_value``."""
+    return np.dtype(np.int32) if max_value <= np.iinfo(np.int32).max else np.dtype(np.int64)
+
+
+def write_table(frame: Union["pd.DataFrame", Dict[str, Sequence]], stem: Path, fmt: str) -> Path:
+    """Write one table to ``stem`` + the extension of ``fmt``.
+
+    ``frame`` is a DataFrame, or a dictionary of equal-length columns (NumPy
+    arrays or lists) which is written without pandas: with the csv module,
+    or with pyarrow for parquet and feather.
+
+    Returns:
+        Path of the written file
+    """
+    path = Path(stem).with_suffix(EXTENSIONS[fmt])
+    if isinstance(frame, dict):
+        if fmt == "csv":
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(frame)
+                writer.writerows(zip(*(np.asarray(column).tolist() for column in frame.values())))
+            return path
+        _import_arrow()
+        table = pa.table(frame)
+        if fmt == "parquet":
+            pq.write_table(table, path, compression=COMPRESSION)
+        else:
+            feather.write_feather(table, path, compression=COMPRESSION)
+        return path
+
+    if fmt == "parquet":
+        frame.to_parquet(path, index=False, compression=COMPRESSION)
+    elif fmt == "feather":
+        frame.reset_index(drop=True).to_feather(path, compression=COMPRESSION)
+    else:
+        frame.to_csv(path, index=False)
+    return path
+
+
+def read_table(stem: Path) -> Optional["pd.DataFrame"]:
+    """Read back a table written by write_table in any format (None if missing)."""
+    import pandas as pd
+
+    for fmt, extension in EXTENSIONS.items():
+        path = Path(stem).with_suffix(extension)
+        if path.exists():
+            if fmt == "parquet":
+                return pd.read_parquet(path)
+            if fmt == "feather":
+                return pd.read_feather(path)
+            return pd.read_csv(path)
+    return None
+
+
+def read_dataset(path: Path) -> "pd.DataFrame":
+    """Read a series dataset of ResultWriter (directory of partitions, or CSV)."""
+    path = Path(path)
+    if path.with_suffix(".csv").exists():
+        import pandas as pd
+
+        return pd.read_csv(path.with_suffix(".csv"))
+    _import_arrow()
+    fmt = "parquet" if any(path.rglob("*.parquet")) else "feather"
+    dataset = ds.dataset(path, format=fmt, partitioning="hive")
+    return dataset.to_table().to_pandas()
+
+
+class ResultWriter:
+    """Stream simulation records to a metrics table and tidy series datasets.
+
+    Scalar fields of a record go to ``<name>.<format>``, written in row
+    groups of ``batch_rows`` records. The per-step series (SERIES_COLUMNS)
+    go to the long ``timeseries`` dataset, with one row per (run, recorded
+    step) and a 'time' column, and the occupancy histogram goes to the
+    ``occupancy`` dataset (columns 'bikes', 'steps'). With parquet or
+    feather these datasets are directories partitioned by run id
+    (``timeseries/<run_id>=<id>/part-0.parquet``), with compact integer
+    columns and zstd compression. With csv they are single long files.
+
+    write() may be called from several threads: each run writes its own
+    partition in parallel, and the shared files are written under a lock.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        fmt: str = "parquet",
+        record_every: int = 1,
+        name: str = "metrics",
+        run_id: str = "simulation_id",
+        batch_rows: int = 1024,
+    ):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.fmt = resolve_format(fmt)
+        self.record_every = record_every
+        self.run_id = run_id
+        self.batch_rows = batch_rows
+        self.path = self.out_dir / f"{name}{EXTENSIONS[self.fmt]}"
+        self._rows: List[Dict] = []
+        self._file = None
+        self._writer = None
+        self._schema = None
+        self._series_writers: Dict[str, csv.writer] = {}
+        self._series_files = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record: Dict) -> None:
+        """Add one record (the record itself is not modified)."""
+        record = dict(record)
+        run = record[self.run_id]
+        # 'unmet_mailly' est aussi une métrique finale : seules les séries sont retirées
+        series = {
+            name: np.asarray(record.pop(name))
+            for name in SERIES_COLUMNS
+            if name in record and np.ndim(record[name]) > 0
+        }
+        if series:
+            length = len(next(iter(series.values())))
+            time = np.arange(1, length + 1, dtype=_index_dtype(length * self.record_every))
+            self._write_series("timeseries", run, {"time": time * self.record_every, **series})
+        if HISTOGRAM_COLUMN in record:
+            steps = np.asarray(record.pop(HISTOGRAM_COLUMN))
+            bikes = np.arange(steps.size, dtype=_index_dtype(steps.size))
+            self._write_series("occupancy", run, {"bikes": bikes, "steps": steps})
+
+        with self._lock:
+            self._rows.append(record)
+            if len(self._rows) >= self.batch_rows:
+                self._flush()
+
+    def _write_series(self, dataset: str, run, columns: Dict[str, np.ndarray]) -> None:
+        """Write the series of one run to its partition (or append to the CSV)."""
+        if self.fmt == "csv":
+            with self._lock:
+                writer = self._series_writers.get(dataset)
+                if writer is None:
+                    f = open(self.out_dir / f"{dataset}.csv", "w", newline="")
+                    self._series_files.append(f)
+                    writer = csv.writer(f)
+                    writer.writerow([self.run_id, *columns])
+                    self._series_writers[dataset] = writer
+                length = len(next(iter(columns.values())))
+                writer.writerows(zip([run] * length, *columns.values()))
+            return
+
+        part = self.out_dir / dataset / f"{self.run_id}={run}"
+        part.mkdir(parents=True, exist_ok=True)
+        table = pa.table(columns)
+        if self.fmt == "parquet":
+            pq.write_table(table, part / "part-0.parquet", compression=COMPRESSION)
+        else:
+            feather.write_feather(table, part / "part-0.feather", compression=COMPRESSION)
+
+    def _flush(self) -> None:
+        """Write the buffered scalar records as one row group."""
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        if self.fmt == "csv":
+            if self._writer is None:
+                self._file = open(self.path, "w", newline="")
+                self._writer = csv.DictWriter(self._file, fieldnames=list(rows[0]))
+                self._writer.writeheader()
+            self._writer.writerows(rows)
+            return
+
+        self._write_group(pa.Table.from_pylist(rows, schema=self._schema))
+
+    def write_frame(self, frame: "pd.DataFrame") -> None:
+        """Add scalar rows already held in a DataFrame (e.g. a previous metrics table)."""
+        if frame.empty:
+            return
+        with self._lock:
+            self._flush()
+            if self.fmt == "csv":
+                self._rows = frame.to_dict(orient="records")
+                self._flush()
+                return
+            if self._schema is not None:
+                frame = frame.reindex(columns=self._schema.names)
+            self._write_group(pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False))
+
+    def _write_group(self, table) -> None:
+        """Write one row group, opening the file with the schema of the first one."""
+        if self._writer is None:
+            self._schema = table.schema
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression=COMPRESSION)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+                self._writer = pa.ipc.new_file(str(self.path), self._schema, options=options)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        """Flush the remaining records and close all files (a second call does nothing)."""
+        with self._lock:
+            self._flush()
+        if self._writer is not None and self.fmt != "csv":
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        for f in self._series_files:
+            f.close()
+        self._writer, self._file, self._series_files = None, None, []
+        self._series_writers = {}
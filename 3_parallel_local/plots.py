@@ -0,0 +1,296 @@
+import math
+import multiprocessing as mp
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import warnings
+import numpy as np
+
+from store import TrajectoryStore
+
+
+# Modes de tracé : un PNG par simulation, une figure à facettes, une mosaïque
+PLOT_MODES = ("runs", "facets", "tiles")
+
+# Séries tracées pour chaque simulation
+SERIES = ("mailly", "moulin")
+
+# Colonnes de pixels d'un graphique par simulation : au-delà, décimation min/max
+PLOT_BINS = 1000
+
+# Taille (pouces) et résolution des graphiques par simulation
+RUN_FIGSIZE = (8, 4)
+RUN_DPI = 100
+
+# Taille d'une vignette de la mosaïque, en pixels
+TILE_SIZE = (240, 120)
+
+# Nombre maximal de facettes d'une figure résumé (au-delà : mode tiles)
+MAX_FACETS = 100
+
+# Points par série d'une facette
+FACET_BINS = 200
+
+# Traceur du processus courant, réutilisé pour toutes ses simulations
+_plotter = None
+
+
+def decimate(time: np.ndarray, series: Dict[str, np.ndarray], bins: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Min/max decimation of trajectories to at most 2 * ``bins`` points.
+
+    Each bin of consecutive records becomes two points at the time of its
+    first record, its minimum and its maximum: drawn with one bin per pixel
+    column, the plot is the same as with every point, but the cost no
+    longer grows with the length of the run.
+
+    Returns:
+        Decimated time and series (unchanged when already short enough)
+    """
+    length = len(time)
+    if length <= 2 * bins:
+        return np.asarray(time), {name: np.asarray(values) for name, values in series.items()}
+    starts = np.linspace(0, length, bins + 1).astype(np.int64)[:-1]
+    decimated = {}
+    for name, values in series.items():
+        values = np.asarray(values)
+        pairs = np.empty((bins, 2), dtype=values.dtype)
+        pairs[:, 0] = np.minimum.reduceat(values, starts)
+        pairs[:, 1] = np.maximum.reduceat(values, starts)
+        decimated[name] = pairs.ravel()
+    return np.repeat(np.asarray(time)[starts], 2), decimated
+
+
+def array_source(series: Dict[str, np.ndarray], record_every: int, bins: int = PLOT_BINS) -> Dict:
+    """Plot source of trajectories held in memory, decimated right away.
+
+    Only the decimated points are kept (and pickled to the plotting
+    workers), so a sweep can queue the plots of thousands of long runs.
+    """
+    length = len(next(iter(series.values())))
+    time = record_every * np.arange(1, length + 1, dtype=np.int64)
+    time, series = decimate(time, series, bins)
+    return {"kind": "arrays", "time": time, **series}
+
+
+def npy_source(directory, row: int, records: int, record_every: int) -> Dict:
+    """Plot source of row ``row`` of the trajectories_<column>.npy files (--shared-memory)."""
+    return {"kind": "npy", "directory": str(directory), "row": row, "records": records, "record_every": record_every}
+
+
+def store_source(directory) -> Dict:
+    """Plot source of a trajectory store directory (--trajectory-store)."""
+    return {"kind": "store", "directory": str(directory)}
+
+
+def load(source: Dict, bins: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Time and decimated series of a plot source, read in the plotting worker."""
+    if source["kind"] == "arrays":
+        return decimate(source["time"], {name: source[name] for name in SERIES}, bins)
+    if source["kind"] == "npy":
+        series = {
+            name: np.load(Path(source["directory"]) / f"trajectories_{name}.npy", mmap_mode="r")[source["row"], :source["records"]]
+            for name in SERIES
+        }
+        time = source["record_every"] * np.arange(1, source["records"] + 1, dtype=np.int64)
+        return decimate(time, series, bins)
+    store = TrajectoryStore(source["directory"])
+    envelopes = {name: store.binned(name, bins) for name in SERIES}
+    # enveloppe min/max du magasin, au même format que decimate()
+    series = {name: np.column_stack([env["min"], env["max"]]).ravel() for name, env in envelopes.items()}
+    return np.repeat(envelopes[SERIES[0]]["time"], 2), series
+
+
+class TrajectoryPlotter:
+    """One Agg figure whose axes and lines are reused for every simulation.
+
+    Creating a pyplot figure per simulation dominates the plotting time of
+    large sweeps; here only the data, the limits and the title change
+    between two runs. The figure is not registered with pyplot, so nothing
+    is drawn on screen and no figure is left open.
+    """
+
+    def __init__(self, size_px: Tuple[int, int], dpi: int = RUN_DPI, labels: bool = True):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(size_px[0] / dpi, size_px[1] / dpi), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.lines = {
+            name: self.axes.plot([], [], label=name.capitalize(), linewidth=1 if labels else 0.6)[0]
+            for name in SERIES
+        }
+        if labels:
+            self.title = self.axes.set_title("Simulation 0")
+            self.axes.set_xlabel("Time step")
+            self.axes.set_ylabel("Number of bikes")
+            self.axes.legend(loc="upper right")
+            # marges calculées une fois, avec un titre type
+            self.figure.tight_layout()
+        else:
+            # vignette : ni axes ni marges, le titre dans le coin
+            self.axes.set_axis_off()
+            self.figure.subplots_adjust(0, 0, 1, 1)
+            self.title = self.axes.text(0.01, 0.97, "", transform=self.axes.transAxes, va="top", fontsize=7)
+
+    def draw(self, time: np.ndarray, series: Dict[str, np.ndarray], title: str) -> None:
+        for name, line in self.lines.items():
+            line.set_data(time, series[name])
+        self.title.set_text(title)
+        self.axes.relim()
+        self.axes.autoscale_view()
+
+    def save(self, path) -> None:
+        self.figure.savefig(path)
+
+    def render(self) -> np.ndarray:
+        """The figure as an (height, width, 3) uint8 RGB image."""
+        self.canvas.draw()
+        return np.asarray(self.canvas.buffer_rgba())[..., :3].copy()
+
+
+def init_plotter(mode: str) -> None:
+    """Create the plotter of this process for ``mode`` (pool initializer)."""
+    global _plotter
+    import matplotlib
+
+    matplotlib.use("Agg")
+    _plotter = None
+    if mode == "runs":
+        _plotter = TrajectoryPlotter((RUN_FIGSIZE[0] * RUN_DPI, RUN_FIGSIZE[1] * RUN_DPI))
+    elif mode == "tiles":
+        _plotter = TrajectoryPlotter(TILE_SIZE, labels=False)
+
+
+def render_task(task: Dict) -> Tuple[int, Optional[object]]:
+    """Plot one simulation in the plotting worker (top-level, so picklable).
+
+    Args:
+        task: 'run' (id), 'title', 'source' (see the *_source functions),
+            'mode', and 'path' (PNG file, "runs" mode)
+
+    Returns:
+        The run id and: None once the PNG is saved ("runs"), the RGB tile
+        ("tiles"), or the time and series to draw in a facet ("facets")
+    """
+    mode = task["mode"]
+    if mode == "facets":
+        return task["run"], load(task["source"], FACET_BINS)
+    if _plotter is None:
+        init_plotter(mode)
+    if mode == "runs":
+        time, series = load(task["source"], PLOT_BINS)
+        _plotter.draw(time, series, task["title"])
+        _plotter.save(task["path"])
+        return task["run"], None
+    time, series = load(task["source"], TILE_SIZE[0])
+    _plotter.draw(time, series, task["title"])
+    return task["run"], _plotter.render()
+
+
+def save_tiles(tiles: Dict[int, np.ndarray], runs: List[int], path) -> Path:
+    """Paste the tiles of ``runs`` (in this order) into one mosaic PNG."""
+    import matplotlib.image
+
+    columns = max(1, math.ceil(math.sqrt(len(runs))))
+    rows = max(1, math.ceil(len(runs) / columns))
+    height, width = TILE_SIZE[1], TILE_SIZE[0]
+    mosaic = np.full((rows * height, columns * width, 3), 255, dtype=np.uint8)
+    for k, run in enumerate(runs):
+        r, c = divmod(k, columns)
+        tile = tiles[run][:height, :width]
+        mosaic[r * height:r * height + tile.shape[0], c * width:c * width + tile.shape[1]] = tile
+    matplotlib.image.imsave(path, mosaic)
+    return Path(path)
+
+
+def save_facets(curves: Dict[int, Tuple], tasks: List[Dict], path) -> Path:
+    """Draw the curves of ``tasks`` as small multiples with shared axes in one PNG."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    columns = max(1, math.ceil(math.sqrt(len(tasks))))
+    rows = max(1, math.ceil(len(tasks) / columns))
+    width, height = 2.2 * columns + 0.85, 1.4 * rows + 0.9
+    figure = Figure(figsize=(width, height), dpi=RUN_DPI)
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(rows, columns, sharex=True, sharey=True, squeeze=False).ravel()
+    for ax, task in zip(axes, tasks):
+        time, series = curves[task["run"]]
+        for name in SERIES:
+            ax.plot(time, series[name], linewidth=0.6, label=name.capitalize())
+        ax.set_title(task["title"], fontsize=7)
+        ax.tick_params(labelsize=6)
+    for ax in axes[len(tasks):]:
+        ax.set_visible(False)
+    handles, labels = axes[0].get_legend_handles_labels()
+    # marges fixes en pouces : la mise en page automatique coûte cher sur des centaines d'axes
+    figure.subplots_adjust(
+        left=0.85 / width, right=1 - 0.1 / width, bottom=0.6 / height, top=1 - 0.5 / height,
+        wspace=0.15, hspace=0.35,
+    )
+    figure.legend(handles, labels, loc="upper center", ncols=len(SERIES))
+    figure.supxlabel("Time step")
+    figure.supylabel("Number of bikes", x=0.15 / width)
+    figure.savefig(path)
+    return Path(path)
+
+
+def plot_task(run: int, title: str, source: Dict, out_dir) -> Dict:
+    """Plotting task of one simulation (its PNG is out_dir/simulation_<run>.png in "runs" mode)."""
+    return {"run": run, "title": title, "source": source, "path": str(Path(out_dir) / f"simulation_{run}.png")}
+
+
+def prepare_tasks(tasks: List[Dict], mode: str) -> List[Dict]:
+    """Tasks sorted by run id and tagged with ``mode``, at most MAX_FACETS for "facets"."""
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot mode {mode!r}, expected one of {PLOT_MODES}")
+    tasks = sorted(tasks, key=lambda task: task["run"])
+    if mode == "facets" and len(tasks) > MAX_FACETS:
+        warnings.warn(
+            f"{len(tasks)} simulations: plotting the first {MAX_FACETS} facets only (use mode 'tiles')",
+            RuntimeWarning,
+        )
+        tasks = tasks[:MAX_FACETS]
+    return [{**task, "mode": mode} for task in tasks]
+
+
+def finish(mode: str, tasks: List[Dict], results: List[Tuple[int, object]], out_dir) -> List[Path]:
+    """Write the mosaic or the facet figure from the results of render_task.
+
+    Returns:
+        Paths of the written images
+    """
+    out_dir = Path(out_dir)
+    if mode == "runs":
+        return [Path(task["path"]) for task in tasks]
+    rendered = dict(results)
+    if mode == "tiles":
+        return [save_tiles(rendered, [task["run"] for task in tasks], out_dir / "tiles.png")]
+    return [save_facets(rendered, tasks, out_dir / "summary.png")]
+
+
+def plot_runs(tasks: List[Dict], out_dir, mode: str = "runs", workers: int = 1) -> List[Path]:
+    """Plot simulations in a pool of ``workers`` processes with the Agg backend.
+
+    "runs" saves simulation_<id>.png per task; "tiles" renders one small
+    tile per simulation and pastes them into tiles.png; "facets" draws up
+    to MAX_FACETS simulations as small multiples in summary.png (with a
+    warning beyond that: use "tiles" for thousands of runs). Each worker
+    reuses one figure, and long trajectories are min/max decimated first.
+
+    Returns:
+        Paths of the written images
+    """
+    tasks = prepare_tasks(tasks, mode)
+    if not tasks:
+        return []
+
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        init_plotter(mode)
+        results = [render_task(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with mp.Pool(workers, initializer=init_plotter, initargs=(mode,)) as pool:
+            results = list(pool.imap_unordered(render_task, tasks, chunksize=chunksize))
+    return finish(mode, tasks, results, out_dir)
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from typing import Optional, Union
+import numpy as np
+import pandas as pd
+
+
+# Paramètre scalaire, ou tableau (N,) pour donner un réglage par réplique
+Parameter = Union[int, float, np.ndarray]
+
+
+def _limit(moves: np.ndarray, truck_capacity: Optional[Parameter]) -> np.ndarray:
+    """Clip the moves to the number of bikes the truck can carry."""
+    if truck_capacity is None:
+        return moves
+    return np.clip(moves, -np.asarray(truck_capacity), truck_capacity)
+
+
+@dataclass
+class ThresholdPolicy:
+    """Refill a station as soon as it falls below a threshold.
+
+    At each visit of the truck, a station holding fewer than ``low`` bikes is
+    refilled up to ``refill`` bikes taken from the other station (Mailly
+    first when both are low).
+
+    Attributes:
+        low: Number of bikes below which a station is refilled
+        refill: Number of bikes a refilled station should hold
+        every: Number of steps between two visits of the truck
+        truck_capacity: Maximum number of bikes moved per visit (None: no limit)
+    """
+
+    low: Parameter
+    refill: Parameter
+    every: int = 1
+    truck_capacity: Optional[Parameter] = None
+
+    def moves(self, mailly, moulin) -> np.ndarray:
+        """Bikes to move to Mailly (negative: to Moulin)."""
+        to_mailly = np.where(mailly < self.low, self.refill - mailly, 0)
+        to_moulin = np.where(moulin < self.low, self.refill - moulin, 0)
+        return _limit(np.where(to_mailly > 0, to_mailly, -to_moulin), self.truck_capacity)
+
+
+@dataclass
+class PeriodicPolicy:
+    """Even out the two stations at fixed intervals, whatever their levels.
+
+    Attributes:
+        every: Number of steps between two visits of the truck
+        amount: Maximum number of bikes moved per visit (None: balance fully)
+    """
+
+    every: int
+    amount: Optional[Parameter] = None
+
+    def moves(self, mailly, moulin) -> np.ndarray:
+        """Bikes to move to Mailly (negative: to Moulin)."""
+        # moitié de l'écart, arrondie vers zéro pour ne pas inverser le déséquilibre
+        half_gap = np.trunc((np.asarray(moulin) - mailly) / 2)
+        return _limit(half_gap, self.amount)
+
+
+@dataclass
+class TargetPolicy:
+    """Bring Mailly back to a target level when it drifts too far from it.
+
+    Attributes:
+        target_mailly: Number of bikes Mailly should hold after a visit
+        every: Number of steps between two visits of the truck
+        tolerance: Deviation from the target left untouched
+        truck_capacity: Maximum number of bikes moved per visit (None: no limit)
+    """
+
+    target_mailly: Parameter
+    every: int = 1
+    tolerance: Parameter = 0
+    truck_capacity: Optional[Parameter] = None
+
+    def moves(self, mailly, moulin) -> np.ndarray:
+        """Bikes to move to Mailly (negative: to Moulin)."""
+        gap = self.target_mailly - np.asarray(mailly)
+        return _limit(np.where(np.abs(gap) > self.tolerance, gap, 0), self.truck_capacity)
+
+
+# Politiques disponibles par nom (colonne 'policy' de policies.csv)
+POLICIES = {
+    "threshold": ThresholdPolicy,
+    "periodic": PeriodicPolicy,
+    "target": TargetPolicy,
+}
+
+# Paramètres de chaque politique dans policies.csv (en plus de 'every')
+POLICY_PARAMETERS = {
+    "threshold": ("low", "refill", "truck_capacity"),
+    "periodic": ("amount",),
+    "target": ("target_mailly", "tolerance", "truck_capacity"),
+}
+
+
+def make_policy(name: str, every: int = 1, **parameters):
+    """Build a policy from its name and parameters.
+
+    Parameters may be scalars or (N,) arrays (one value per replica). Unused
+    optional parameters can be given as NaN: a NaN truck capacity or amount
+    means no limit.
+
+    Args:
+        name: "none" for no rebalancing, or one of the keys of POLICIES
+        every: Number of steps between two visits of the truck
+        **parameters: Parameters of the policy (see POLICY_PARAMETERS)
+
+    Returns:
+        Policy instance, or None for "none"
+
+    Raises:
+        ValueError: If the policy name is unknown
+    """
+    if name == "none":
+        return None
+    if name not in POLICIES:
+        raise ValueError(f"Unknown policy {name!r}, expected 'none' or one of {tuple(POLICIES)}")
+    kwargs = {}
+    for key in POLICY_PARAMETERS[name]:
+        if key not in parameters:
+            continue
+        value = np.asarray(parameters[key], dtype=float)
+        if key in ("truck_capacity", "amount"):
+            if np.all(np.isnan(value)):
+                continue
+            value = np.where(np.isnan(value), np.inf, value)
+        elif np.any(pd.isna(value)):
+            raise ValueError(f"Missing value for parameter {key!r} of policy {name!r}")
+        kwargs[key] = value if value.ndim else value.item()
+    return POLICIES[name](every=int(every), **kwargs)
@@ -0,0 +1,393 @@
+import argparse
+import heapq
+import math
+import multiprocessing as mp
+import os
+from pathlib import Path
+import queue
+from statistics import NormalDist
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+from model import run_batch
+from seeds import replica_sequences, row_sequence
+from stats import PhaseTimer, WorkerStats, write_run_stats
+
+
+# Métriques estimées par défaut (moyenne sur les répliques d'une ligne)
+TARGET_METRICS = ("unmet_mailly", "unmet_moulin", "final_imbalance")
+
+# Un tour de répliques au plus GROWTH fois plus grand que les précédents
+# réunis : une variance surestimée sur peu de répliques ne fait pas
+# dépasser la cible de beaucoup
+GROWTH = 4
+
+# Statuts finaux d'une ligne
+CONVERGED, MAX_REPLICAS, BUDGET = "converged", "max_replicas", "budget"
+
+
+def parse_args():
+    """Parse command line arguments for the adaptive replication sweep.
+
+    Returns:
+        Parsed arguments containing:
+        - params: Path to CSV file with the rows (same columns as params.csv)
+        - out_dir: Output directory for the estimates
+        - metrics: Metrics whose mean is estimated
+        - tolerance: Target half-width of the confidence intervals
+        - rel_tolerance: Target half-width relative to the absolute mean
+        - confidence: Confidence level of the intervals
+        - min_replicas: Replicas of the first round of every row
+        - max_replicas: Maximum number of replicas of one row
+        - budget: Maximum number of replicas of the whole sweep
+        - batch_size: Maximum number of replicas simulated together by a worker
+        - root_seed: Seed of the whole sweep (None: use the seed column)
+        - workers: Number of worker processes ('auto' for automatic detection)
+    """
+    parser = argparse.ArgumentParser(description="Replicate each row until its confidence intervals are narrow enough.")
+
+    parser.add_argument(
+        "--params",
+        type=str,
+        default="params.csv",
+        help="Path to CSV file with the rows"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="results",
+        help="Directory to save adaptive.csv and run_stats.json"
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        nargs="+",
+        default=list(TARGET_METRICS),
+        help="Metrics whose mean is estimated (final metrics of the summary mode)"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        help="Target half-width of the confidence interval of every metric"
+    )
+    parser.add_argument(
+        "--rel-tolerance",
+        type=float,
+        default=0.0,
+        help="Target half-width relative to |mean| (the larger of the two targets is used)"
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals"
+    )
+    parser.add_argument(
+        "--min-replicas",
+        type=int,
+        default=100,
+        help="Replicas of the first round of every row, before any stopping test"
+    )
+    parser.add_argument(
+        "--max-replicas",
+        type=int,
+        default=100_000,
+        help="Maximum number of replicas of one row"
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=None,
+        help="Maximum number of replicas of the whole sweep (default: no limit)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Maximum number of replicas simulated together by a worker"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep: row i uses child i of SeedSequence(root_seed) instead of its seed column"
+    )
+    parser.add_argument(
+        "--workers",
+        type=str,
+        default="auto",
+        help="Number of worker processes ('auto' for automatic detection)"
+    )
+
+    return parser.parse_args()
+
+
+class RowEstimate:
+    """Running mean and variance of the target metrics of one row.
+
+    Batches are merged with the pairwise update of Chan et al., so only
+    (count, mean, M2) per metric travel back from the workers.
+    """
+
+    def __init__(self, metrics: List[str]):
+        self.count = 0
+        self.mean = {name: 0.0 for name in metrics}
+        self.m2 = {name: 0.0 for name in metrics}
+
+    def merge(self, count: int, mean: Dict[str, float], m2: Dict[str, float]) -> None:
+        """Add a batch of ``count`` replicas summarized by its mean and M2."""
+        total = self.count + count
+        for name in self.mean:
+            delta = mean[name] - self.mean[name]
+            self.mean[name] += delta * count / total
+            self.m2[name] += m2[name] + delta * delta * self.count * count / total
+        self.count = total
+
+    def std(self, name: str) -> float:
+        return math.sqrt(self.m2[name] / (self.count - 1)) if self.count > 1 else math.nan
+
+    def half_width(self, name: str, z: float) -> float:
+        return z * self.std(name) / math.sqrt(self.count) if self.count > 1 else math.inf
+
+    def target(self, name: str, tolerance: float, rel_tolerance: float) -> float:
+        return max(tolerance, rel_tolerance * abs(self.mean[name]))
+
+    def ratio(self, z: float, tolerance: float, rel_tolerance: float) -> float:
+        """Largest half-width over target of the metrics (<= 1: converged)."""
+        ratios = []
+        for name in self.mean:
+            width, target = self.half_width(name, z), self.target(name, tolerance, rel_tolerance)
+            ratios.append(width / target if target > 0 else (math.inf if width > 0 else 0.0))
+        return max(ratios)
+
+
+def run_task(task: Dict) -> Dict:
+    """Simulate one batch of replicas of a row.
+
+    Replicas ``start`` to ``start + count - 1`` use the children of the row
+    stream with those indices, so the estimate of a row does not depend on
+    how its replicas were split into batches.
+
+    Returns:
+        Row index, replica count and per metric mean and M2 (sum of squared
+        deviations) of the batch, with the worker and its phases
+    """
+    timer = PhaseTimer()
+    row = task["row"]
+    with timer.phase("simulate"):
+        parent = row_sequence(row, task["row_index"], task["root_seed"])
+        summary = run_batch(
+            int(row["init_mailly"]),
+            int(row["init_moulin"]),
+            int(row["steps"]),
+            float(row["p1"]),
+            float(row["p2"]),
+            np.array(replica_sequences(parent, task["count"], task["start"]), dtype=object),
+            output="summary",
+            capacity_mailly=row.get("cap_mailly"),
+            capacity_moulin=row.get("cap_moulin"),
+        )
+    with timer.phase("record"):
+        mean, m2 = {}, {}
+        for name in task["metrics"]:
+            values = np.asarray(summary.metrics[name], dtype=float)
+            mean[name] = float(values.mean())
+            m2[name] = float(((values - mean[name]) ** 2).sum())
+    return {
+        "row_index": task["row_index"],
+        "count": task["count"],
+        "mean": mean,
+        "m2": m2,
+        "worker": f"pid_{os.getpid()}",
+        "phases": timer.to_dict(),
+    }
+
+
+def split_round(row_index: int, start: int, count: int, batch_size: int) -> List[Tuple[int, int, int]]:
+    """(row_index, start, count) of the batches of one round of ``count`` replicas."""
+    return [
+        (row_index, first, min(batch_size, start + count - first))
+        for first in range(start, start + count, batch_size)
+    ]
+
+
+def next_round(estimate: RowEstimate, ratio: float, min_replicas: int, max_replicas: int) -> int:
+    """Replicas of the next round of a row that has not converged.
+
+    The half-width shrinks as 1/sqrt(n), so about ``n * ratio**2`` replicas
+    reach the target; the round is at least ``min_replicas`` and at most
+    GROWTH times the replicas already run.
+    """
+    needed = estimate.count * ratio ** 2 if math.isfinite(ratio) else math.inf
+    extra = max(min_replicas, math.ceil(needed) - estimate.count) if math.isfinite(needed) else math.inf
+    extra = min(extra, GROWTH * estimate.count, max_replicas - estimate.count)
+    return int(extra)
+
+
+def main():
+    """Estimate the mean metrics of every row with as many replicas as it needs.
+
+    Each row first runs --min-replicas replicas. After every round, the
+    confidence interval of each target metric is mean ± z·std/sqrt(n). A
+    row stops when every half-width is within its target, when it reaches
+    --max-replicas, or when the sweep has spent --budget replicas. Otherwise
+    its next round is sized from the current variance (and, with --budget,
+    to at most an equal share of the replicas left). Rounds are split into
+    batches of at most --batch-size replicas that run in a process pool,
+    and the rows furthest from their target are served first.
+
+    Stopping decisions only look at complete rounds, and replica i of a row
+    always uses the same stream, so the results do not depend on the number
+    of workers or the batch size (up to rounding; with --budget, which rows get
+    the last replicas depends on the completion order).
+    """
+    args = parse_args()
+    if not 0 < args.confidence < 1:
+        raise ValueError(f"confidence must be in (0, 1), got {args.confidence}")
+    if args.min_replicas < 2:
+        raise ValueError(f"min_replicas must be >= 2, got {args.min_replicas}")
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    start_time = time.perf_counter()
+    timer = PhaseTimer()
+    workers = WorkerStats()
+    with timer.phase("read_params"):
+        rows = pd.read_csv(args.params)
+    records = rows.to_dict(orient="records")
+
+    if args.workers == "auto":
+        num_workers = mp.cpu_count()
+    else:
+        num_workers = int(args.workers)
+
+    z = NormalDist().inv_cdf((1 + args.confidence) / 2)
+    budget = math.inf if args.budget is None else args.budget
+    print(
+        f"Estimating {', '.join(args.metrics)} on {len(rows)} rows to ±{args.tolerance:g} "
+        f"({100 * args.confidence:g}% confidence) using {num_workers} workers"
+    )
+
+    estimates = [RowEstimate(args.metrics) for _ in records]
+    rounds = [0] * len(records)
+    status: Dict[int, str] = {}
+    # lignes prêtes pour un nouveau tour, la plus éloignée de sa cible d'abord
+    ready = [(-math.inf, index) for index in range(len(records))]
+    batches: List[Tuple[int, int, int]] = []
+    pending = [0] * len(records)
+    launched = 0
+    done: "queue.Queue[Dict]" = queue.Queue()
+
+    def launch(pool, row_index: int, start: int, count: int) -> None:
+        task = {
+            "row": records[row_index],
+            "row_index": row_index,
+            "root_seed": args.root_seed,
+            "metrics": args.metrics,
+            "start": start,
+            "count": count,
+        }
+        pool.apply_async(run_task, (task,), callback=done.put, error_callback=done.put)
+
+    with mp.Pool(num_workers) as pool:
+        pool_start = time.perf_counter()
+        in_flight = 0
+        while ready or batches or in_flight:
+            # deux lots par worker suffisent à occuper le pool
+            while in_flight < 2 * num_workers and (batches or ready):
+                if not batches:
+                    _, row_index = heapq.heappop(ready)
+                    estimate = estimates[row_index]
+                    if rounds[row_index] == 0:
+                        count = min(args.min_replicas, args.max_replicas)
+                    else:
+                        ratio = estimate.ratio(z, args.tolerance, args.rel_tolerance)
+                        count = next_round(estimate, ratio, args.min_replicas, args.max_replicas)
+                    if math.isfinite(budget):
+                        # budget restant partagé entre les lignes encore actives
+                        active = len(records) - len(status)
+                        count = min(count, math.ceil((budget - launched) / active))
+                    if count <= 0:
+                        status[row_index] = BUDGET
+                        continue
+                    launched += count
+                    rounds[row_index] += 1
+                    batches = split_round(row_index, estimate.count, count, args.batch_size)
+                    pending[row_index] = len(batches)
+                row_index, start, count = batches.pop(0)
+                launch(pool, row_index, start, count)
+                in_flight += 1
+            if not in_flight:
+                continue
+
+            with timer.phase("wait_results"):
+                result = done.get()
+            in_flight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            row_index = result["row_index"]
+            estimate = estimates[row_index]
+            estimate.merge(result["count"], result["mean"], result["m2"])
+            workers.add(result["worker"], result["phases"])
+            pending[row_index] -= 1
+            if pending[row_index]:
+                continue
+
+            # tour complet : test d'arrêt
+            ratio = estimate.ratio(z, args.tolerance, args.rel_tolerance)
+            if ratio <= 1:
+                status[row_index] = CONVERGED
+            elif estimate.count >= args.max_replicas:
+                status[row_index] = MAX_REPLICAS
+            elif launched >= budget:
+                status[row_index] = BUDGET
+            else:
+                heapq.heappush(ready, (-ratio, row_index))
+        pool_wall = time.perf_counter() - pool_start
+
+    with timer.phase("write"):
+        table = []
+        for row_index, (row, estimate) in enumerate(zip(records, estimates)):
+            record = {
+                "row_id": row_index,
+                **row,
+                "replicas": estimate.count,
+                "rounds": rounds[row_index],
+                "status": status[row_index],
+            }
+            for name in args.metrics:
+                record[f"mean_{name}"] = estimate.mean[name] if estimate.count else math.nan
+                record[f"std_{name}"] = estimate.std(name)
+                record[f"half_width_{name}"] = estimate.half_width(name, z)
+            table.append(record)
+        table = pd.DataFrame(table)
+        path = out_dir / "adaptive.csv"
+        table.to_csv(path, index=False)
+    print(f"Saved estimates to {path}")
+
+    counts = table["status"].value_counts()
+    print(
+        f"{int(table['replicas'].sum())} replicas: "
+        + ", ".join(f"{counts.get(name, 0)} {name}" for name in (CONVERGED, MAX_REPLICAS, BUDGET))
+        + f" (replicas per row: min {table['replicas'].min()}, max {table['replicas'].max()})"
+    )
+
+    write_run_stats(
+        out_dir, "run_adaptive", time.perf_counter() - start_time, timer, workers,
+        {
+            "rows": len(records),
+            "replicas": int(table["replicas"].sum()),
+            "steps": int((table["replicas"] * table["steps"]).sum()),
+            **{name: int(counts.get(name, 0)) for name in (CONVERGED, MAX_REPLICAS, BUDGET)},
+        },
+        worker_wall=pool_wall, num_workers=num_workers, confidence=args.confidence,
+        tolerance=args.tolerance, rel_tolerance=args.rel_tolerance,
+    )
+
+
+if __name__ == "__main__":
+    main()
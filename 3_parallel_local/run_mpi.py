@@ -1,8 +1,26 @@
 import argparse
-import mpi4py
-import matplotlib.pyplot as plt
+from pathlib import Path
+from typing import Dict, List, Optional
+import pandas as pd
+from mpi4py import MPI
 
-from model import State, run_simulation
+from cache import ResultCache, open_cache, simulate_row
+from model import ENGINES, State
+from output import FORMATS, ResultWriter
+from plots import PLOT_MODES, array_source, finish, init_plotter, plot_task, prepare_tasks, render_task
+from seeds import row_sequence
+from stats import PROFILE_DIR, PhaseTimer, WorkerStats, dump_profile, start_profiler, write_run_stats
+
+
+# Étiquettes des messages : tâche envoyée par le rang 0, résultat renvoyé
+TASK_TAG = 1
+RESULT_TAG = 2
+
+# Nombre de lignes d'avance confiées à chaque worker
+PREFETCH = 2
+
+# Graphiques à faire après la simulation (trajectoires déjà décimées)
+_plot_tasks: List[Dict] = []
 
 
 def parse_args():
@@ -13,7 +31,18 @@ def parse_args():
         - params: Path to CSV file with parameter combinations
         - out_dir: Output directory for results
         - workers: Number of worker processes ('auto' for automatic detection)
+        - record_every: Record the trajectories every k steps only
+        - summary_only: Keep only final metrics and occupancy statistics
+        - per_rank_files: Each rank writes its own metrics file
+        - idle_master: Rank 0 only schedules and does not simulate
+        - engine: Simulation engine
+        - root_seed: Seed of the whole sweep (None: use the seed column)
+        - cache_dir: Directory of the result cache (None: no cache)
+        - cache_size: Maximum size of the cache in MiB
+        - format: Output format (parquet, feather or csv)
         - plot: Boolean flag to generate plots after run
+        - plot_mode: One PNG per simulation, a facet figure or a tiled image
+        - profile: Write cProfile statistics of every rank
 
     Note:
         Use argparse.ArgumentParser to define all required and optional arguments
@@ -38,15 +67,299 @@ def parse_args():
         default="auto",
         help="Number of worker processes ('auto' for automatic detection)"
     )
+    parser.add_argument(
+        "--record-every",
+        type=int,
+        default=1,
+        help="Record the trajectories every k steps only"
+    )
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="Keep only final metrics and occupancy statistics, not trajectories"
+    )
+    parser.add_argument(
+        "--per-rank-files",
+        action="store_true",
+        help="Each rank writes metrics_rank<k>.csv; only row ids are sent to rank 0"
+    )
+    parser.add_argument(
+        "--idle-master",
+        action="store_true",
+        help="Rank 0 only schedules the rows and does not simulate any"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="python",
+        choices=ENGINES,
+        help="Simulation engine (use the same one in every runner for identical results)"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep: row i uses child i of SeedSequence(root_seed) instead of its seed column"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the result cache: rows already simulated are read back (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the result cache in MiB (least recently used entries are removed)"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="parquet",
+        choices=FORMATS,
+        help="Output format of the metrics table and trajectories (csv is an export option)"
+    )
     parser.add_argument(
         "--plot",
         action="store_true",
         help="Generate plots after run"
     )
+    parser.add_argument(
+        "--plot-mode",
+        type=str,
+        default="runs",
+        choices=PLOT_MODES,
+        help="'runs': simulation_<i>.png each, 'facets': one summary.png, 'tiles': one tiles.png mosaic"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every rank with cProfile (profile/rank_<k>.pstats next to run_stats.json)"
+    )
 
     return parser.parse_args()
 
 
+def run_row(
+    params: Dict,
+    record_every: int,
+    summary_only: bool,
+    root_seed: int = None,
+    engine: str = "python",
+    cache: ResultCache = None,
+    timer: PhaseTimer = None,
+) -> Dict:
+    """Run the simulation of one params.csv row and build its metrics record.
+
+    The simulation and record phases are added to ``timer`` when given.
+    """
+    timer = timer or PhaseTimer()
+    with timer.phase("simulate"):
+        sim_result = simulate_row(
+            params,
+            row_sequence(params, params["params_index"], root_seed),
+            cache=cache,
+            engine=engine,
+            record_every=record_every,
+            output="summary" if summary_only else "history",
+        )
+    with timer.phase("record"):
+        sim_result = sim_result.to_record(lists=False)
+        sim_result.update(params)
+    return sim_result
+
+
+def plot_sweep(comm, tasks: List[Dict], mode: str, out_dir: Path) -> List[Path]:
+    """Draw the plots of the sweep on all the ranks (collective).
+
+    The plot tasks of every rank (decimated trajectories) are gathered on
+    rank 0 and dealt back round-robin; each rank draws its share with one
+    reused Agg figure, and rank 0 writes the mosaic or facet figure.
+
+    Returns:
+        Paths of the written images on rank 0, [] on the other ranks
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    gathered = comm.gather(tasks, root=0)
+    shares = None
+    if rank == 0:
+        ordered = prepare_tasks([task for part in gathered for task in part], mode)
+        shares = [ordered[k::size] for k in range(size)]
+    mine = comm.scatter(shares, root=0)
+    init_plotter(mode)
+    results = comm.gather([render_task(task) for task in mine], root=0)
+    if rank != 0:
+        return []
+    return finish(mode, ordered, [result for part in results for result in part], out_dir)
+
+
+def queue_plot(row: Dict, args, out_dir: Path) -> None:
+    """Keep the decimated trajectories of a record for plot_sweep."""
+    i = row["params_index"]
+    source = array_source({name: row[name] for name in ("mailly", "moulin")}, args.record_every)
+    _plot_tasks.append(plot_task(i, f"Simulation {i}", source, out_dir))
+
+
+def keep_local(
+    row: Dict,
+    args,
+    out_dir: Path,
+    writer: Optional[ResultWriter],
+    timer: PhaseTimer,
+) -> Dict:
+    """Write a record to the rank's own file when there is one.
+
+    Returns:
+        The message for rank 0: the full record, or only its 'params_index'
+        when the record was written locally
+    """
+    if writer is None:
+        return row
+    with timer.phase("write"):
+        writer.write(row)
+    if args.plot and not args.summary_only:
+        with timer.phase("plot"):
+            queue_plot(row, args, out_dir)
+    return {"params_index": row["params_index"]}
+
+
+def work(
+    comm,
+    args,
+    out_dir: Path,
+    writer: Optional[ResultWriter] = None,
+    cache: Optional[ResultCache] = None,
+    timer: Optional[PhaseTimer] = None,
+) -> int:
+    """Worker loop of ranks > 0: run the rows sent by rank 0 until told to stop.
+
+    The next task is received while the current one runs (nonblocking
+    receive), so the worker does not wait for rank 0 between two rows.
+    Results go back with a nonblocking send.
+
+    Returns:
+        Number of rows run by this rank
+    """
+    timer = timer or PhaseTimer()
+    rows = 0
+    pending = comm.irecv(source=0, tag=TASK_TAG)
+    sending = None
+    while True:
+        with timer.phase("wait_task"):
+            params = pending.wait()
+        if params is None:
+            break
+        pending = comm.irecv(source=0, tag=TASK_TAG)
+
+        row = run_row(params, args.record_every, args.summary_only, args.root_seed, args.engine, cache, timer)
+        message = keep_local(row, args, out_dir, writer, timer)
+        rows += 1
+        if sending is not None:
+            with timer.phase("wait_send"):
+                sending.wait()
+        with timer.phase("send"):
+            sending = comm.isend(message, dest=0, tag=RESULT_TAG)
+    if sending is not None:
+        with timer.phase("wait_send"):
+            sending.wait()
+    return rows
+
+
+def schedule(
+    comm,
+    args,
+    param_list: List[Dict],
+    out_dir: Path,
+    writer: Optional[ResultWriter],
+    local_writer: Optional[ResultWriter] = None,
+    cache: Optional[ResultCache] = None,
+    timer: Optional[PhaseTimer] = None,
+    row_timer: Optional[PhaseTimer] = None,
+) -> int:
+    """Master loop of rank 0: hand out rows on demand and collect the results.
+
+    Rows are sorted longest first. Every worker holds up to PREFETCH rows
+    (fewer when the sweep has less than PREFETCH rows per rank); each result
+    it sends back is answered with its next row, so fast ranks take more
+    rows (dynamic load balancing). Unless --idle-master is set, rank 0 also
+    runs rows itself, taking the shortest ones from the end of the queue
+    (at least one is kept for it) and checking for results between two
+    rows.
+
+    Scheduling, receiving, writing and plotting go to ``timer``; the
+    phases of the rows run by rank 0 go to ``row_timer``.
+
+    Returns:
+        Number of rows run by rank 0
+    """
+    timer = timer or PhaseTimer()
+    row_timer = row_timer or PhaseTimer()
+    size = comm.Get_size()
+    queue = sorted(param_list, key=lambda params: params["steps"], reverse=True)
+    head, tail = 0, len(queue)
+    remaining = len(queue)
+    stopped = set()
+
+    def send_next(worker: int) -> None:
+        nonlocal head
+        with timer.phase("send"):
+            if head < tail:
+                comm.send(queue[head], dest=worker, tag=TASK_TAG)
+                head += 1
+            elif worker not in stopped:
+                comm.send(None, dest=worker, tag=TASK_TAG)
+                stopped.add(worker)
+
+    def collect(row: Dict) -> None:
+        nonlocal remaining
+        remaining -= 1
+        if writer is not None:
+            with timer.phase("write"):
+                writer.write(row)
+            if args.plot and not args.summary_only:
+                with timer.phase("plot"):
+                    queue_plot(row, args, out_dir)
+
+    # petites sweeps : moins de lignes d'avance, et au moins une ligne
+    # gardée pour le rang 0 quand il travaille
+    master_works = not args.idle_master or size == 1
+    ranks = size if master_works else size - 1
+    prefetch = max(1, min(PREFETCH, len(queue) // max(ranks, 1)))
+    reserved = 1 if master_works else 0
+    for _ in range(prefetch):
+        for worker in range(1, size):
+            if head < tail - reserved:
+                send_next(worker)
+
+    own_rows = 0
+    status = MPI.Status()
+    while remaining:
+        # le rang 0 prend les lignes les plus courtes, puis répond aux workers
+        if master_works and head < tail:
+            tail -= 1
+            own_rows += 1
+            row = run_row(queue[tail], args.record_every, args.summary_only, args.root_seed, args.engine, cache, row_timer)
+            collect(keep_local(row, args, out_dir, local_writer, row_timer))
+            while comm.Iprobe(source=MPI.ANY_SOURCE, tag=RESULT_TAG, status=status):
+                worker = status.Get_source()
+                with timer.phase("receive"):
+                    row = comm.recv(source=worker, tag=RESULT_TAG)
+                collect(row)
+                send_next(worker)
+            continue
+
+        with timer.phase("wait_results"):
+            row = comm.recv(source=MPI.ANY_SOURCE, tag=RESULT_TAG, status=status)
+        collect(row)
+        send_next(status.Get_source())
+
+    # workers dont la dernière ligne est partie sans signal d'arrêt
+    for worker in range(1, size):
+        send_next(worker)
+    return own_rows
+
+
 def main():
     """Main function to run parallel parameter sweep using MPI.
 
@@ -65,18 +378,39 @@ def main():
     - p2: Probability Moulin->Mailly
     - init_mailly: Initial bikes at Mailly
     - init_moulin: Initial bikes at Moulin
-    - seed: Random seed
+    - seed: Random seed (optional, see --root-seed)
+    - cap_mailly, cap_moulin (optional): Number of docks at each station,
+      empty or missing for unlimited capacity
 
     Output files:
-    - metrics.csv: Aggregated metrics for all runs
-    - Optional plots: PNG files for timeseries and metrics visualization
+    - metrics.parquet (or .feather / .csv, see --format): Aggregated scalar
+      metrics for all runs, one row per simulation written by rank 0 as soon
+      as it arrives (in completion order; sort on params_index)
+    - metrics_rank<k>.* instead with --per-rank-files: rows run by rank k
+    - timeseries/params_index=<i>/: Recorded trajectories of simulation i
+      (long format: time, mailly, moulin), or occupancy/ with --summary-only
+    - Optional plots (--plot): simulation_<i>.png per run, or one summary.png
+      or tiles.png (--plot-mode), drawn after the sweep by all the ranks
+      with the Agg backend
+    - run_stats.json: time spent in each phase on rank 0 (CSV parsing,
+      sending rows, waiting for and receiving results, writing, plotting)
+      and on every rank (simulation, record, waits), rank utilization and
+      counters; the ranks send their phases to rank 0 at the end (gather)
+    - profile/rank_<k>.pstats with --profile
 
     Note:
-        - Use the mpi4py module for parallel processing
+        - Rank 0 hands out rows one at a time (master-worker) with
+          nonblocking point-to-point messages instead of a round-robin split
+        - Full trajectories are never gathered: memory stays flat on rank 0
+        - Scaling test on one machine: mpirun -n 1, 2, 4 ... python run_mpi.py
     """
 
     
     args = parse_args()
+    start = MPI.Wtime()
+    profiler = start_profiler(args.profile)
+    timer = PhaseTimer()
+    row_timer = PhaseTimer()
 
     #Créer le répertoire de sortie s'il n'existe pas
     out_dir = Path(args.out_dir)
@@ -87,61 +421,83 @@ def main():
     rank = comm.Get_rank()
     size = comm.Get_size()
 
-    # if rank 0  we read the CSV and distribute work
+    # cache partagé par tous les rangs (écritures atomiques)
+    cache = open_cache(args.cache_dir, args.cache_size)
+
+    # un fichier par rang, ou un seul fichier écrit au fil de l'eau par le rang 0
+    local_writer = None
+    if args.per_rank_files:
+        local_writer = ResultWriter(
+            out_dir, args.format, args.record_every, name=f"metrics_rank{rank}", run_id="params_index"
+        )
+
     if rank == 0:
-        df_params = pd.read_csv(args.params)
-        param_list = df_params.to_dict(orient="records")
+        # seul le rang 0 lit le CSV : les lignes sont envoyées une à une
+        with timer.phase("read_params"):
+            df_params = pd.read_csv(args.params)
+            df_params = df_params.reset_index().rename(columns={"index": "params_index"})
+            param_list = df_params.to_dict(orient="records")
+        print(f"Running {len(param_list)} simulations on {size} ranks")
+
+        writer = None
+        if not args.per_rank_files:
+            writer = ResultWriter(out_dir, args.format, args.record_every, run_id="params_index")
+        sweep_start = MPI.Wtime()
+        rows = schedule(comm, args, param_list, out_dir, writer, local_writer, cache, timer, row_timer)
+        sweep_wall = MPI.Wtime() - sweep_start
+        print(f"Done in {sweep_wall:.2f}s, rank 0 ran {rows} of {len(param_list)} rows")
+
+        if writer is not None:
+            with timer.phase("write"):
+                writer.close()
+            print(f"Saved aggregated metrics to {writer.path}")
+        else:
+            print(f"Saved metrics to {out_dir}/metrics_rank* (sort on params_index)")
+
+        if cache is not None:
+            with timer.phase("wait_barrier"):
+                comm.Barrier()
+            with timer.phase("cache_prune"):
+                removed = cache.prune()
+            print(f"Result cache {cache.directory}: removed {removed} old entries")
     else:
-        param_list = None
-
-    param_list = comm.bcast(param_list, root=0)
-
-    # on distibue le travail seolon rank
-    results = []
-    for i, params in enumerate(param_list):
-        if i % size != rank:
-            continue  
-
-        # Run simulation
-        sim_result = run_simulation(
-            initial_mailly=int(params["init_mailly"]),
-            initial_moulin=int(params["init_moulin"]),
-            steps=int(params["steps"]),
-            p1=float(params["p1"]),
-            p2=float(params["p2"]),
-            seed=int(params["seed"])
-        )
+        rows = work(comm, args, out_dir, local_writer, cache, row_timer)
+        if cache is not None:
+            with row_timer.phase("wait_barrier"):
+                comm.Barrier()
 
-        sim_result["params_index"] = i
-        sim_result.update(params)
-        results.append(sim_result)
+    if local_writer is not None:
+        with row_timer.phase("write"):
+            local_writer.close()
 
-    # Rassembler tous les résultats au rang 0
-    all_results = comm.gather(results, root=0)
+    if args.plot and not args.summary_only:
+        with (timer if rank == 0 else row_timer).phase("plot"):
+            paths = plot_sweep(comm, _plot_tasks, args.plot_mode, out_dir)
+        if rank == 0:
+            print(f"Saved {len(paths)} plots to {out_dir} ({args.plot_mode}, {size} ranks)")
 
+    # phases et compteurs de chaque rang, rassemblés sur le rang 0
+    dump_profile([profiler], out_dir / PROFILE_DIR / f"rank_{rank}.pstats")
+    rank_stats = comm.gather({
+        "phases": row_timer.to_dict(),
+        "rows": rows,
+        "cache": (cache.hits, cache.misses) if cache is not None else (0, 0),
+    }, root=0)
     if rank == 0:
-        flat_results = [item for sublist in all_results for item in sublist]
-
-        # Convert to DataFrame
-        metrics_df = pd.DataFrame(flat_results)
-        metrics_csv_path = out_dir / "metrics.csv"
-        metrics_df.to_csv(metrics_csv_path, index=False)
-        print(f"Saved aggregated metrics to {metrics_csv_path}")
-
-        # plotting
-        if args.plot:
-            for i, row in metrics_df.iterrows():
-                plt.figure(figsize=(8, 4))
-                plt.plot(row["mailly"], label="Mailly")
-                plt.plot(row["moulin"], label="Moulin")
-                plt.title(f"Simulation {i}")
-                plt.xlabel("Time step")
-                plt.ylabel("Number of bikes")
-                plt.legend()
-                plt.tight_layout()
-                plot_path = out_dir / f"simulation_{i}.png"
-                plt.savefig(plot_path)
-                plt.close()
+        workers = WorkerStats()
+        for k, entry in enumerate(rank_stats):
+            workers.add(f"rank-{k}", entry["phases"], rows=entry["rows"])
+        counters = {
+            "rows": len(param_list),
+            "steps": int(df_params["steps"].sum()),
+            "cache_hits": sum(entry["cache"][0] for entry in rank_stats),
+            "cache_misses": sum(entry["cache"][1] for entry in rank_stats),
+        }
+        stats_path = write_run_stats(
+            out_dir, "run_mpi.py", MPI.Wtime() - start, timer, workers, counters,
+            worker_wall=sweep_wall, ranks=size, engine=args.engine, idle_master=args.idle_master,
+        )
+        print(f"Saved run statistics to {stats_path}")
 
 
 if __name__ == "__main__":
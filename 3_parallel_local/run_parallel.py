@@ -1,10 +1,35 @@
 import argparse
 from pathlib import Path
 import multiprocessing as mp
+from multiprocessing import shared_memory, util
+import os
+import pickle
+import time
+from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from model import State, run_simulation
+from cache import open_cache, simulate_row
+from model import ENGINES, State, history_dtypes
+from output import FORMATS, ResultWriter
+from seeds import row_sequence
+from stats import PROFILE_DIR, PhaseTimer, WorkerStats, dump_profile, start_profiler, timed_iter, write_run_stats
+from plots import PLOT_MODES, array_source, npy_source, plot_runs, plot_task, store_source
+from store import create_store, flush_store
+
+
+# Nombre de pas simulés visé par paquet de tâches envoyé à un worker
+CHUNK_STEPS = 10**7
+
+# Options de simulation communes à toutes les tâches d'un worker
+_options: Dict = {}
+
+# Trajectoires en mémoire partagée (--shared-memory) : (lignes, pas) par métrique
+_shared: Dict[str, np.ndarray] = {}
+_shared_blocks: List[shared_memory.SharedMemory] = []
+
+# Phases des lignes exécutées par ce worker, envoyées avec chaque résultat
+_timer = PhaseTimer()
 
 
 def parse_args():
@@ -15,7 +40,20 @@ def parse_args():
         - params: Path to CSV file with parameter combinations
         - out_dir: Output directory for results
         - workers: Number of worker processes ('auto' for automatic detection)
+        - record_every: Record the trajectories every k steps only
+        - summary_only: Keep only final metrics and occupancy statistics
+        - shared_memory: Write trajectories into shared memory instead of
+          sending them back through the pool
+        - trajectory_store: Write trajectories into memory-mapped .npy files
+        - engine: Simulation engine
+        - root_seed: Seed of the whole sweep (None: use the seed column)
+        - cache_dir: Directory of the result cache (None: no cache)
+        - cache_size: Maximum size of the cache in MiB
+        - format: Output format (parquet, feather or csv)
         - plot: Boolean flag to generate plots after run
+        - plot_mode: One PNG per simulation, a facet figure or a tiled image
+        - plot_workers: Number of plotting processes
+        - profile: Write cProfile statistics of the parent and the workers
 
     Note:
         Use argparse.ArgumentParser to define all required and optional arguments
@@ -41,14 +79,244 @@ def parse_args():
         default="auto",
         help="Number of worker processes ('auto' for automatic detection)"
     )
+    parser.add_argument(
+        "--record-every",
+        type=int,
+        default=1,
+        help="Record the trajectories every k steps only"
+    )
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="Keep only final metrics and occupancy statistics, not trajectories"
+    )
+    # deux façons exclusives de ne pas renvoyer les trajectoires par le pool
+    trajectories = parser.add_mutually_exclusive_group()
+    trajectories.add_argument(
+        "--shared-memory",
+        action="store_true",
+        help="Write trajectories into shared memory and save them as .npy files"
+    )
+    trajectories.add_argument(
+        "--trajectory-store",
+        action="store_true",
+        help="Write each trajectory into memory-mapped .npy files under trajectories/ (runs longer than memory)"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="python",
+        choices=ENGINES,
+        help="Simulation engine (use the same one in every runner for identical results)"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep: row i uses child i of SeedSequence(root_seed) instead of its seed column"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the result cache: rows already simulated are read back (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the result cache in MiB (least recently used entries are removed)"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="parquet",
+        choices=FORMATS,
+        help="Output format of the metrics table and trajectories (csv is an export option)"
+    )
     parser.add_argument(
         "--plot",
         action="store_true",
         help="Generate plots after simulations"
     )
+    parser.add_argument(
+        "--plot-mode",
+        type=str,
+        default="runs",
+        choices=PLOT_MODES,
+        help="'runs': simulation_<i>.png each, 'facets': one summary.png, 'tiles': one tiles.png mosaic"
+    )
+    parser.add_argument(
+        "--plot-workers",
+        type=str,
+        default=None,
+        help="Number of plotting processes ('auto' or a number; default: --workers)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the parent and every worker with cProfile (profile/*.pstats next to run_stats.json)"
+    )
 
     return parser.parse_args()
-    
+
+
+def create_shared_history(
+    rows: int,
+    records: int,
+    total: int,
+    steps: int,
+) -> Tuple[List[shared_memory.SharedMemory], Dict[str, Tuple[str, Tuple[int, int], str]]]:
+    """Allocate one (rows, records) shared array per history column.
+
+    Args:
+        rows: Number of simulations
+        records: Maximum number of recorded states of a simulation
+        total: Maximum total number of bikes of a simulation
+        steps: Maximum number of steps of a simulation
+
+    Returns:
+        Tuple containing:
+        - Shared memory blocks (to close and unlink at the end)
+        - Description (block name, shape, dtype) of each column for workers
+    """
+    blocks, spec = [], {}
+    for name, dtype in history_dtypes(total, steps).items():
+        nbytes = rows * records * dtype.itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        blocks.append(block)
+        spec[name] = (block.name, (rows, records), dtype.str)
+    return blocks, spec
+
+
+def attach_shared_history(spec: Dict) -> Tuple[List[shared_memory.SharedMemory], Dict[str, np.ndarray]]:
+    """NumPy views (no copy) of the shared arrays described by ``spec``."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def init_worker(
+    record_every: int,
+    summary_only: bool,
+    shared_spec: Dict = None,
+    engine: str = "python",
+    root_seed: int = None,
+    cache_dir: str = None,
+    cache_size: float = 1024,
+    store_dir: str = None,
+    profile_dir: str = None,
+) -> None:
+    """Store the simulation options shared by all the tasks of a worker.
+
+    With ``profile_dir``, the worker runs under cProfile and writes
+    ``worker_<pid>.pstats`` there when it exits (after pool.close()).
+    """
+    if profile_dir:
+        path = Path(profile_dir) / f"worker_{os.getpid()}.pstats"
+        util.Finalize(None, dump_profile, args=([start_profiler(True)], path), exitpriority=0)
+    _options["store_dir"] = store_dir
+    _options["engine"] = engine
+    _options["root_seed"] = root_seed
+    _options["cache"] = open_cache(cache_dir, cache_size)
+    _options["record_every"] = record_every
+    _options["output"] = "summary" if summary_only else "history"
+    if shared_spec:
+        blocks, arrays = attach_shared_history(shared_spec)
+        _shared_blocks.extend(blocks)
+        _shared.update(arrays)
+
+
+def run_row(sim_params: Dict) -> Dict:
+    """Run the simulation of one params.csv row (top-level, so picklable).
+
+    Args:
+        sim_params: Row of the parameter table with its 'simulation_id'
+
+    Returns:
+        Record for metrics.csv: metrics (and trajectories) followed by the
+        simulation id and the row parameters. With shared memory, the
+        trajectories are written in row simulation_id of the shared arrays
+        and only scalars are returned, with the number of recorded states.
+        Likewise with a trajectory store, whose files are in
+        ``trajectories/simulation_<simulation_id>/``.
+    """
+    out = None
+    if _shared:
+        out = {name: array[sim_params["simulation_id"]] for name, array in _shared.items()}
+    elif _options.get("store_dir") and _options.get("output") == "history":
+        steps = int(sim_params["steps"])
+        record_every = _options.get("record_every", 1)
+        out = create_store(
+            Path(_options["store_dir"]) / f"simulation_{sim_params['simulation_id']}",
+            history_dtypes(int(sim_params["init_mailly"]) + int(sim_params["init_moulin"]), steps),
+            steps // record_every,
+            record_every,
+        )
+    with _timer.phase("simulate"):
+        result = simulate_row(
+            sim_params,
+            row_sequence(sim_params, sim_params["simulation_id"], _options.get("root_seed")),
+            cache=_options.get("cache"),
+            out=out,
+            engine=_options.get("engine", "python"),
+            record_every=_options.get("record_every", 1),
+            output=_options.get("output", "history"),
+        )
+        if out is not None:
+            flush_store(out)
+    with _timer.phase("record"):
+        if out is not None:
+            record = dict(result.metrics)
+            record["records"] = len(result.mailly)
+        else:
+            record = result.to_record(lists=False)
+        record["simulation_id"] = sim_params["simulation_id"]
+        record.update(sim_params)
+    return record
+
+
+def run_task(sim_params: Dict) -> Tuple[bytes, Dict]:
+    """Run one row and pickle its record in the worker (the pool task of main).
+
+    The record is pickled here instead of by the pool so that the time spent
+    pickling is measured; the pool then only copies the bytes.
+
+    Returns:
+        The pickled record of run_row, and the phases of the row with the
+        worker that ran it and the cache hits and misses of the worker so far
+    """
+    record = run_row(sim_params)
+    with _timer.phase("serialize"):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    cache = _options.get("cache")
+    stats = {
+        "worker": f"process-{os.getpid()}",
+        "phases": _timer.take(),
+        "cache": (cache.hits, cache.misses) if cache is not None else None,
+    }
+    return payload, stats
+
+
+def chunk_size(steps: pd.Series, num_workers: int) -> int:
+    """Number of rows sent at once to a worker.
+
+    Large enough to amortize inter-process communication on many short rows,
+    small enough that each worker gets several chunks (for load balancing)
+    and that a chunk holds about CHUNK_STEPS steps of results.
+    """
+    rows = len(steps)
+    if rows == 0:
+        return 1
+    mean_steps = max(float(steps.mean()), 1.0)
+    balanced = rows // (4 * num_workers)
+    bounded = int(CHUNK_STEPS // mean_steps)
+    return max(1, min(balanced, bounded))
+
+
 def main():
     """Main function to run parallel parameter sweep using multiprocessing.
 
@@ -67,76 +335,177 @@ def main():
     - p2: Probability Moulin->Mailly
     - init_mailly: Initial bikes at Mailly
     - init_moulin: Initial bikes at Moulin
-    - seed: Random seed
+    - seed: Random seed (optional, see --root-seed)
+    - cap_mailly, cap_moulin (optional): Number of docks at each station,
+      empty or missing for unlimited capacity
 
     Output files:
-    - metrics.csv: Aggregated metrics for all runs
-    - Optional plots: PNG files for timeseries and metrics visualization
+    - metrics.parquet (or .feather / .csv, see --format): Aggregated scalar
+      metrics for all runs, one row per simulation written as soon as it
+      completes (so in completion order; use the simulation_id column to sort)
+    - timeseries/simulation_id=<i>/: Recorded trajectories of simulation i
+      (long format: time, mailly, moulin), or occupancy/ with --summary-only
+    - trajectories_<column>.npy with --shared-memory: (simulations, records)
+      array per history column, row i for simulation_id i; only the first
+      'records' entries of a row are used
+    - trajectories/simulation_<i>/<column>.npy with --trajectory-store: history
+      of simulation i written during the run, read with store.TrajectoryStore
+    - Optional plots (--plot): simulation_<i>.png per run, or one summary.png
+      or tiles.png (--plot-mode), drawn after the sweep by a process pool
+      with the Agg backend
+    - run_stats.json: time spent in each phase (CSV parsing, waiting for
+      results, unpickling, writing, plotting) in the parent and (simulation,
+      record, pickling) in each worker, worker utilization and counters
+    - profile/main.pstats, profile/worker_<pid>.pstats with --profile
 
     Note:
-        - Use multiprocessing for parallel processing
+        - Rows are scheduled longest first (by steps) with imap_unordered,
+          so long rows do not end up alone at the end of the sweep
+        - Results are never gathered in the parent: memory stays flat
     """
-    # TODO: Implement parallel parameter swep workflow
-
-    
     args = parse_args()
+    run_start = time.perf_counter()
+    profiler = start_profiler(args.profile)
+    timer = PhaseTimer()
+    workers = WorkerStats()
 
     #créer le répertoire de sortie
     out_dir = Path(args.output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     #  lire le fichier CSV avec les paramètres
-    simulation_table = pd.read_csv(args.csv_file)
-    simulation_table = simulation_table.reset_index().rename(columns={"index": "simulation_id"})
-    simulation_list = simulation_table.to_dict(orient="records")
+    with timer.phase("read_params"):
+        simulation_table = pd.read_csv(args.csv_file)
+        simulation_table = simulation_table.reset_index().rename(columns={"index": "simulation_id"})
+
+        # les simulations les plus longues d'abord
+        simulation_table = simulation_table.sort_values("steps", ascending=False, kind="stable")
+        simulation_list = simulation_table.to_dict(orient="records")
 
     #  déterminer le nombres de workers
     if args.workers == "auto":
         num_workers = mp.cpu_count()
     else:
         num_workers = int(args.workers)
+    chunksize = chunk_size(simulation_table["steps"], num_workers)
 
-    print(f"Running {len(simulation_list)} simulations using {num_workers} workers")
-
-# exécuter les simulation en paralèle et collecter les résultatt
-    with mp.Pool(num_workers) as pool:
-        sim_results = pool.map(d
-            lambda sim_params: run_simulation(
-                initial_mailly=int(sim_params["init_mailly"]),
-                initial_moulin=int(sim_params["init_moulin"]),
-                steps=int(sim_params["steps"]),
-                p1=float(sim_params["p1"]),
-                p2=float(sim_params["p2"]),
-                seed=int(sim_params["seed"])
-            ),
-            simulation_list
-        )
+    total = len(simulation_list)
+    total_steps = max(int(simulation_table["steps"].sum()), 1)
+
+    # tableaux partagés (lignes x pas enregistrés) remplis directement par les workers
+    blocks, shared_spec, shared = [], None, {}
+    if args.shared_memory and not args.summary_only and total:
+        max_total = int((simulation_table["init_mailly"] + simulation_table["init_moulin"]).max())
+        max_steps = int(simulation_table["steps"].max())
+        blocks, shared_spec = create_shared_history(total, max_steps // args.record_every, max_total, max_steps)
+        shared = {
+            name: np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            for block, (name, (_, shape, dtype)) in zip(blocks, shared_spec.items())
+        }
+        size = sum(block.size for block in blocks) / 2**20
+        print(f"Allocated {size:.1f} MiB of shared memory for the trajectories")
+    store_dir = None
+    if args.trajectory_store and not args.summary_only:
+        store_dir = str(out_dir / "trajectories")
+    profile_dir = str(out_dir / PROFILE_DIR) if args.profile else None
+    print(f"Running {total} simulations using {num_workers} workers (chunks of {chunksize})")
 
-    # ajouter les information de paramètres à chaque résultat
-    for res, sim_params in zip(sim_results, simulation_list):
-        res["simulation_id"] = sim_params["simulation_id"]
-        res.update(sim_params)
-
-#Sauvegarder les résultat agrégeés dans un cvs
-    results_df = pd.DataFrame(sim_results)
-    metrics_csv_path = out_dir / "metrics.csv"
-    results_df.to_csv(metrics_csv_path, index=False)
-    print(f"Saved aggregated metrics to {metrics_csv_path}")
-
-    # Générer éventuelement des graphihque
-    if args.plot:
-        for _, row in results_df.iterrows():
-            plt.figure(figsize=(8, 4))
-            plt.plot(row["mailly"], label="Mailly")
-            plt.plot(row["moulin"], label="Moulin")
-            plt.title(f"Simulation {row['simulation_id']}")
-            plt.xlabel("Time step")
-            plt.ylabel("Number of bikes")
-            plt.legend()
-            plt.tight_layout()
-            plot_path = out_dir / f"simulation_{row['simulation_id']}.png"
-            plt.savefig(plot_path)
-            plt.close()
+    # les blocs partagés sont libérés même si une simulation ou l'écriture échoue
+    try:
+        # exécuter les simulations en parallèle et écrire chaque résultat dès qu'il arrive
+        writer = ResultWriter(out_dir, args.format, args.record_every, run_id="simulation_id")
+        start = time.perf_counter()
+        last_report = start
+        done_steps = 0
+        result_bytes = 0
+        cache_counts = {}
+        plot_tasks = []
+        with writer, mp.Pool(
+            num_workers,
+            initializer=init_worker,
+            initargs=(args.record_every, args.summary_only, shared_spec, args.engine, args.root_seed, args.cache_dir, args.cache_size, store_dir, profile_dir),
+        ) as pool:
+            results = pool.imap_unordered(run_task, simulation_list, chunksize=chunksize)
+            for done, (payload, row_stats) in enumerate(timed_iter(results, timer, "wait_results"), start=1):
+                with timer.phase("deserialize"):
+                    row = pickle.loads(payload)
+                result_bytes += len(payload)
+                workers.add(row_stats["worker"], row_stats["phases"])
+                if row_stats["cache"] is not None:
+                    cache_counts[row_stats["worker"]] = row_stats["cache"]
+
+                with timer.phase("write"):
+                    writer.write(row)
+
+                if args.plot and not args.summary_only:
+                    # les graphiques sont faits après la simulation, dans un pool dédié
+                    with timer.phase("plot"):
+                        i = row["simulation_id"]
+                        if shared:
+                            source = npy_source(out_dir, i, row["records"], args.record_every)
+                        elif store_dir is not None:
+                            source = store_source(Path(store_dir) / f"simulation_{i}")
+                        else:
+                            source = array_source({name: row[name] for name in ("mailly", "moulin")}, args.record_every)
+                        plot_tasks.append(plot_task(i, f"Simulation {i}", source, out_dir))
+
+                # progression pondérée par les pas, au plus une fois par seconde
+                done_steps += int(row["steps"])
+                now = time.perf_counter()
+                if now - last_report >= 1.0 or done == total:
+                    elapsed = now - start
+                    eta = elapsed / max(done_steps, 1) * (total_steps - done_steps)
+                    print(f"[{done}/{total}] {elapsed:.1f}s elapsed, ~{eta:.1f}s left", flush=True)
+                    last_report = now
+
+            # arrêt propre des workers : ils écrivent leur profil en sortant
+            with timer.phase("shutdown"):
+                pool.close()
+                pool.join()
+            pool_wall = time.perf_counter() - start
+            with timer.phase("write"):
+                writer.close()
+
+        print(f"Saved aggregated metrics to {writer.path}")
+
+        cache = open_cache(args.cache_dir, args.cache_size)
+        if cache is not None:
+            with timer.phase("cache_prune"):
+                removed = cache.prune()
+            print(f"Result cache {cache.directory}: removed {removed} old entries")
+
+        if shared:
+            with timer.phase("write"):
+                for name in shared:
+                    np.save(out_dir / f"trajectories_{name}.npy", shared[name])
+            print(f"Saved trajectories to {out_dir}/trajectories_*.npy")
+    finally:
+        # libérer les vues avant de fermer les blocs
+        shared.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    if plot_tasks:
+        plot_workers = args.plot_workers or args.workers
+        plot_workers = mp.cpu_count() if plot_workers == "auto" else int(plot_workers)
+        with timer.phase("plot"):
+            paths = plot_runs(plot_tasks, out_dir, args.plot_mode, plot_workers)
+        print(f"Saved {len(paths)} plots to {out_dir} ({args.plot_mode}, {plot_workers} processes)")
+
+    dump_profile([profiler], out_dir / PROFILE_DIR / "main.pstats")
+    counters = {
+        "rows": total,
+        "steps": int(simulation_table["steps"].sum()),
+        "result_bytes": result_bytes,
+        "cache_hits": sum(hits for hits, _ in cache_counts.values()),
+        "cache_misses": sum(misses for _, misses in cache_counts.values()),
+    }
+    stats_path = write_run_stats(
+        out_dir, "run_parallel.py", time.perf_counter() - run_start, timer, workers, counters,
+        worker_wall=pool_wall, num_workers=num_workers, engine=args.engine, chunksize=chunksize,
+    )
+    print(f"Saved run statistics to {stats_path}")
 
 
 if __name__ == "__main__":
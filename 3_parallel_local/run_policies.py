@@ -0,0 +1,228 @@
+import argparse
+from pathlib import Path
+import multiprocessing as mp
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+from model import run_batch
+from policies import POLICY_PARAMETERS, make_policy
+from seeds import replica_sequences, row_sequence
+
+
+def parse_args():
+    """Parse command line arguments for the rebalancing policy sweep.
+
+    Returns:
+        Parsed arguments containing:
+        - params: Path to CSV file with the scenarios (same columns as params.csv)
+        - policies: Path to CSV file with the policies to compare
+        - out_dir: Output directory for the scores
+        - replicas: Number of replicas per (scenario, policy) combination
+        - batch_size: Maximum number of replicas simulated together by a worker
+        - move_cost: Weight of a truck move in the score, in unmet trips
+        - workers: Number of worker processes ('auto' for automatic detection)
+    """
+    parser = argparse.ArgumentParser(description="Compare rebalancing policies with batched replicas.")
+
+    parser.add_argument(
+        "--params",
+        type=str,
+        default="params.csv",
+        help="Path to CSV file with the scenarios"
+    )
+    parser.add_argument(
+        "--policies",
+        type=str,
+        default="policies.csv",
+        help="Path to CSV file with the policies (columns: policy, every, parameters)"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="results",
+        help="Directory to save policy_scores.csv"
+    )
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        default=100,
+        help="Number of replicas per (scenario, policy) combination"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=4096,
+        help="Maximum number of replicas simulated together by a worker"
+    )
+    parser.add_argument(
+        "--move-cost",
+        type=float,
+        default=1.0,
+        help="Weight of one truck move in the score, counted in unmet trips"
+    )
+    parser.add_argument(
+        "--workers",
+        type=str,
+        default="auto",
+        help="Number of worker processes ('auto' for automatic detection)"
+    )
+
+    return parser.parse_args()
+
+
+def make_tasks(
+    scenarios: pd.DataFrame,
+    policies: pd.DataFrame,
+    replicas: int,
+    batch_size: int,
+) -> List[Dict]:
+    """Group the (scenario, policy) combinations into batched tasks.
+
+    Combinations of the same scenario sharing the policy type and visit
+    interval run in one run_batch call, the policy parameters being given as
+    arrays over the replicas. All policies of a scenario use the same seeds
+    (common random numbers), so their differences are not blurred by noise.
+
+    Args:
+        scenarios: Rows of params.csv
+        policies: Rows of policies.csv with a 'policy_id' column
+        replicas: Number of replicas per combination
+        batch_size: Maximum number of replicas in one task
+
+    Returns:
+        List of task dictionaries for run_task
+    """
+    tasks = []
+    per_task = max(1, batch_size // replicas)
+    for scenario_id, scenario in scenarios.iterrows():
+        seeds = np.array(replica_sequences(row_sequence(scenario, scenario_id), replicas), dtype=object)
+        for (name, every), group in policies.groupby(["policy", "every"], sort=False):
+            for first in range(0, len(group), per_task):
+                rows = group.iloc[first:first + per_task]
+                parameters = {
+                    key: np.repeat(rows[key].to_numpy(dtype=float), replicas)
+                    for key in POLICY_PARAMETERS.get(name, ())
+                    if key in rows
+                }
+                tasks.append({
+                    "scenario_id": scenario_id,
+                    "scenario": scenario.to_dict(),
+                    "policy": name,
+                    "every": int(every),
+                    "parameters": parameters,
+                    "policy_ids": rows["policy_id"].tolist(),
+                    "seeds": np.tile(seeds, len(rows)),
+                })
+    return tasks
+
+
+def run_task(task: Dict) -> List[Dict]:
+    """Simulate one task and score each of its policies.
+
+    Returns:
+        One record per policy with the mean and standard error of the unmet
+        trips (departures and refused returns), truck moves and bikes moved
+    """
+    scenario = task["scenario"]
+    policy = make_policy(task["policy"], task["every"], **task["parameters"])
+    summary = run_batch(
+        int(scenario["init_mailly"]),
+        int(scenario["init_moulin"]),
+        int(scenario["steps"]),
+        float(scenario["p1"]),
+        float(scenario["p2"]),
+        task["seeds"],
+        output="summary",
+        capacity_mailly=scenario.get("cap_mailly"),
+        capacity_moulin=scenario.get("cap_moulin"),
+        policy=policy,
+    )
+    metrics = summary.metrics
+    unmet = (
+        metrics["unmet_mailly"]
+        + metrics["unmet_moulin"]
+        + metrics["unmet_return_mailly"]
+        + metrics["unmet_return_moulin"]
+    )
+    values = {
+        "unmet": unmet,
+        "truck_moves": metrics["truck_moves"],
+        "bikes_moved": metrics["bikes_moved"],
+    }
+
+    # une ligne de répliques par politique
+    records = []
+    count = len(task["policy_ids"])
+    for i, policy_id in enumerate(task["policy_ids"]):
+        record = {"scenario_id": task["scenario_id"], "policy_id": policy_id}
+        for key, value in values.items():
+            replicas = value.reshape(count, -1)[i]
+            record[f"mean_{key}"] = replicas.mean()
+            record[f"se_{key}"] = replicas.std(ddof=1) / np.sqrt(replicas.size) if replicas.size > 1 else np.nan
+        records.append(record)
+    return records
+
+
+def main():
+    """Score every (scenario, policy) combination and save policy_scores.csv.
+
+    Expected policies CSV columns:
+    - policy: 'none', 'threshold', 'periodic' or 'target'
+    - every: Number of steps between two visits of the truck
+    - low, refill: Parameters of 'threshold'
+    - amount: Parameter of 'periodic' (empty: balance fully)
+    - target_mailly, tolerance: Parameters of 'target'
+    - truck_capacity: Bikes carried per visit ('threshold', 'target'; empty: no limit)
+
+    The score of a policy is mean_unmet + move_cost * mean_truck_moves.
+    """
+    args = parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    scenarios = pd.read_csv(args.params)
+    policies = pd.read_csv(args.policies)
+    policies["every"] = policies["every"].fillna(1).astype(int)
+    policies = policies.reset_index().rename(columns={"index": "policy_id"})
+
+    if args.workers == "auto":
+        num_workers = mp.cpu_count()
+    else:
+        num_workers = int(args.workers)
+
+    tasks = make_tasks(scenarios, policies, args.replicas, args.batch_size)
+    print(
+        f"Scoring {len(policies)} policies on {len(scenarios)} scenarios "
+        f"({len(tasks)} tasks, {args.replicas} replicas each) using {num_workers} workers"
+    )
+
+    # les tâches sont indépendantes : l'ordre d'arrivée n'importe pas
+    records = []
+    with mp.Pool(num_workers) as pool:
+        for task_records in pool.imap_unordered(run_task, tasks):
+            records.extend(task_records)
+
+    scores = pd.DataFrame(records)
+    scores["score"] = scores["mean_unmet"] + args.move_cost * scores["mean_truck_moves"]
+    scores = (
+        scores.merge(scenarios.rename_axis("scenario_id").reset_index(), on="scenario_id")
+        .merge(policies, on="policy_id")
+        .sort_values(["scenario_id", "score"])
+    )
+    scores_path = out_dir / "policy_scores.csv"
+    scores.to_csv(scores_path, index=False)
+    print(f"Saved policy scores to {scores_path}")
+
+    # meilleure politique de chaque scénario
+    best = scores.groupby("scenario_id").head(1)
+    for _, row in best.iterrows():
+        print(
+            f"Scenario {row['scenario_id']}: best policy {row['policy_id']} ({row['policy']}, "
+            f"every {row['every']}) score {row['score']:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
 from pathlib import Path
+import sys
 import threading
+import time
+from typing import Dict, List, Optional
+import warnings
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from model import State, run_simulation
+from cache import ResultCache, open_cache, simulate_row
+from model import ENGINES, State, numba, run_simulation
+from output import FORMATS, ResultWriter
+from plots import PLOT_MODES, array_source, plot_runs, plot_task
+from seeds import row_sequence
+from stats import PROFILE_DIR, PhaseTimer, WorkerStats, dump_profile, start_profiler, write_run_stats
 
 
 def parse_args():
@@ -15,7 +25,17 @@ def parse_args():
         - params: Path to CSV file with parameter combinations
         - out_dir: Output directory for results
         - workers: Number of worker processes ('auto' for automatic detection)
+        - record_every: Record the trajectories every k steps only
+        - summary_only: Keep only final metrics and occupancy statistics
+        - engine: Simulation engine (default vectorized, same results as python)
+        - root_seed: Seed of the whole sweep (None: use the seed column)
+        - cache_dir: Directory of the result cache (None: no cache)
+        - cache_size: Maximum size of the cache in MiB
+        - format: Output format (parquet, feather or csv)
         - plot: Boolean flag to generate plots after run
+        - plot_mode: One PNG per simulation, a facet figure or a tiled image
+        - plot_workers: Number of plotting processes
+        - profile: Write cProfile statistics of the main and worker threads
 
     Note:
         Use argparse.ArgumentParser to define all required and optional arguments
@@ -42,17 +62,202 @@ def parse_args():
         "--workers",
         type=str,
         default="auto",
-        help="Number of worker threads ('auto' for automatic detection)"
+        help="Number of worker threads ('auto': one per CPU core)"
+    )
+    parser.add_argument(
+        "--record-every",
+        type=int,
+        default=1,
+        help="Record the trajectories every k steps only"
+    )
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="Keep only final metrics and occupancy statistics, not trajectories"
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="vectorized",
+        choices=ENGINES,
+        help="Simulation engine run by the threads (vectorized: same results as the python engine of the other runners)"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep: row i uses child i of SeedSequence(root_seed) instead of its seed column"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the result cache: rows already simulated are read back (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the result cache in MiB (least recently used entries are removed)"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="parquet",
+        choices=FORMATS,
+        help="Output format of the metrics table and trajectories (csv is an export option)"
     )
     parser.add_argument(
         "--plot",
         action="store_true",
         help="Generate plots after simulations"
     )
+    parser.add_argument(
+        "--plot-mode",
+        type=str,
+        default="runs",
+        choices=PLOT_MODES,
+        help="'runs': simulation_<i>.png each, 'facets': one summary.png, 'tiles': one tiles.png mosaic"
+    )
+    parser.add_argument(
+        "--plot-workers",
+        type=str,
+        default=None,
+        help="Number of plotting processes ('auto' or a number; default: --workers)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the main and worker threads with cProfile (profile/main.pstats next to run_stats.json)"
+    )
 
     return parser.parse_args()
 
 
+def gil_enabled() -> bool:
+    """Whether the GIL is active (False on a free-threaded 3.13t build run without it)."""
+    check = getattr(sys, "_is_gil_enabled", None)
+    return True if check is None else check()
+
+
+def cpu_count() -> int:
+    """Number of CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def check_engine(engine: str, num_workers: int) -> str:
+    """Warn when ``engine`` cannot run in parallel threads.
+
+    The numba kernel releases the GIL and the vectorized engine spends its
+    time in NumPy calls that release it too. The pure-Python engine only
+    scales on a free-threaded interpreter, so a warning is issued otherwise.
+    The engine is never chosen from what is installed: the same sweep must
+    give the same results whatever the machine.
+    """
+    if engine == "python" and num_workers > 1 and gil_enabled():
+        warnings.warn(
+            "engine='python' holds the GIL: threads will not run in parallel "
+            "(use a free-threaded Python or another engine)",
+            RuntimeWarning,
+        )
+    return engine
+
+
+def run_row(
+    sim_params: Dict,
+    engine: str,
+    record_every: int,
+    output: str,
+    root_seed: int = None,
+    cache: ResultCache = None,
+    stats: WorkerStats = None,
+    writer: ResultWriter = None,
+) -> Dict:
+    """Run the simulation of one params.csv row and build its metrics record.
+
+    With ``writer``, the record is written by the calling thread
+    (ResultWriter is thread-safe). With ``stats``, the simulation, record
+    and write phases are added to the entry of the current thread.
+    """
+    timer = PhaseTimer()
+    with timer.phase("simulate"):
+        result = simulate_row(
+            sim_params,
+            row_sequence(sim_params, sim_params["simulation_id"], root_seed),
+            cache=cache,
+            engine=engine,
+            record_every=record_every,
+            output=output,
+        )
+    with timer.phase("record"):
+        result = result.to_record(lists=False)
+        result["simulation_id"] = sim_params["simulation_id"]
+        result.update(sim_params)
+    if writer is not None:
+        with timer.phase("write"):
+            writer.write(result)
+    if stats is not None:
+        stats.add(threading.current_thread().name, timer.to_dict())
+    return result
+
+
+def run_sweep(
+    simulation_list: List[Dict],
+    num_workers: int,
+    engine: str,
+    record_every: int = 1,
+    output: str = "history",
+    root_seed: int = None,
+    cache: ResultCache = None,
+    stats: WorkerStats = None,
+    profilers: List = None,
+    writer: ResultWriter = None,
+    plot_dir: Path = None,
+) -> List[Dict]:
+    """Run all the rows with a pool of ``num_workers`` threads.
+
+    Each record is written to ``writer`` by the thread that ran it as soon
+    as the row is done, so no record is kept until the end of the sweep.
+
+    Args:
+        stats: Per-thread phases of the rows, filled when given
+        profilers: List receiving one running cProfile profiler per worker
+            thread, when given (see stats.dump_profile)
+        writer: Output of the records (None: records are dropped, e.g. in
+            bench_threads.py)
+        plot_dir: Directory of the plots, to get the plot tasks of the rows
+
+    Returns:
+        Plot tasks (decimated trajectories) in the order of
+        ``simulation_list`` with ``plot_dir``, otherwise an empty list
+    """
+    if engine == "numba" and numba is not None:
+        # compiler le noyau une seule fois avant de lancer les threads
+        run_simulation(1, 1, 1, 0.5, 0.5, seed=0, engine="numba", output=output)
+    initializer = None
+    if profilers is not None:
+        def initializer():
+            profilers.append(start_profiler(True))
+
+    def run(sim_params: Dict) -> Optional[Dict]:
+        record = run_row(sim_params, engine, record_every, output, root_seed, cache, stats, writer)
+        if plot_dir is None:
+            return None
+        return plot_task(
+            record["simulation_id"],
+            f"Simulation {record['simulation_id']}",
+            array_source({name: record[name] for name in ("mailly", "moulin")}, record_every),
+            plot_dir,
+        )
+
+    with ThreadPoolExecutor(max_workers=num_workers, initializer=initializer) as pool:
+        futures = [pool.submit(run, sim_params) for sim_params in simulation_list]
+        tasks = [future.result() for future in futures]
+    return [task for task in tasks if task is not None]
+
+
 def main():
     """Main function to run parallel parameter sweep using threading.
 
@@ -71,97 +276,109 @@ def main():
     - p2: Probability Moulin->Mailly
     - init_mailly: Initial bikes at Mailly
     - init_moulin: Initial bikes at Moulin
-    - seed: Random seed
+    - seed: Random seed (optional, see --root-seed)
+    - cap_mailly, cap_moulin (optional): Number of docks at each station,
+      empty or missing for unlimited capacity
 
     Output files:
-    - metrics.csv: Aggregated metrics for all runs
-    - Optional plots: PNG files for timeseries and metrics visualization
+    - metrics.parquet (or .feather / .csv, see --format): Aggregated scalar
+      metrics for all runs
+    - timeseries/simulation_id=<i>/: Recorded trajectories of simulation i
+      (long format: time, mailly, moulin), or occupancy/ with --summary-only
+    - Optional plots (--plot): simulation_<i>.png per run, or one summary.png
+      or tiles.png (--plot-mode), drawn after the sweep by a process pool
+      with the Agg backend
+    - run_stats.json: time spent in each phase (CSV parsing, sweep, writing,
+      plotting) in the main thread and (simulation, record, write) in each
+      worker thread, thread utilization and counters
+    - profile/main.pstats with --profile: main and worker threads merged
 
     Note:
-        - Use the threading module for parallel processing
+        - A pool of one thread per CPU core runs the rows; the default
+          vectorized engine releases the GIL in NumPy, so the threads really
+          run in parallel, and gives the same results as the python engine
+        - On free-threaded CPython (3.13t) every engine scales
+        - Each worker thread writes its records to the shared ResultWriter
+          as soon as its row is done, in completion order (sort on
+          simulation_id); trajectories are not kept until the end
     """
     args = parse_args()
+    run_start = time.perf_counter()
+    profilers = [start_profiler(args.profile)]
+    timer = PhaseTimer()
+    workers = WorkerStats()
 
     # Créer le répertoire de sortie
     out_dir = Path(args.output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # lire le fichier Csv avec les paramètres
-    simulation_table = pd.read_csv(args.csv_file)
-    simulation_table = simulation_table.reset_index().rename(
-        columns={"index": "simulation_id"}
-    )
-    simulation_list = simulation_table.to_dict(orient="records")
+    with timer.phase("read_params"):
+        simulation_table = pd.read_csv(args.csv_file)
+        simulation_table = simulation_table.reset_index().rename(
+            columns={"index": "simulation_id"}
+        )
+        simulation_list = simulation_table.to_dict(orient="records")
 
     # Déterminer le nombre de workers
     if args.workers == "auto":
-        num_workers = len(simulation_list)
+        num_workers = cpu_count()
     else:
         num_workers = int(args.workers)
+    engine = check_engine(args.engine, num_workers)
 
-    print(f"Running {len(simulation_list)} simulations using {num_workers} threads")
+    gil = "GIL enabled" if gil_enabled() else "free-threaded"
+    print(f"Running {len(simulation_list)} simulations using {num_workers} threads ({engine} engine, {gil})")
 
-    # Structures partagées
-    simulation_results = []
-    results_lock = threading.Lock()
-    index_lock = threading.Lock()
-    current_index = {"value": 0}
-    
-# fonction exécutée par chaque thread
-    def worker():
-        while True:
-            with index_lock:
-                #if current 
-                if current_index["value"] >= len(simulation_list):
-                    return
-                sim_params = simulation_list[current_index["value"]]
-                current_index["value"] += 1
-
-            result = run_simulation(
-                initial_mailly=int(sim_params["init_mailly"]),
-                initial_moulin=int(sim_params["init_moulin"]),
-                steps=int(sim_params["steps"]),
-                p1=float(sim_params["p1"]),
-                p2=float(sim_params["p2"]),
-                seed=int(sim_params["seed"])
+    # exécuter les lignes dans le pool de threads, chaque thread écrit ses lignes
+    cache = open_cache(args.cache_dir, args.cache_size)
+    plot = args.plot and not args.summary_only
+    start = time.perf_counter()
+    with ResultWriter(out_dir, args.format, args.record_every, run_id="simulation_id") as writer:
+        with timer.phase("wait_sweep"):
+            plot_tasks = run_sweep(
+                simulation_list,
+                num_workers,
+                engine,
+                record_every=args.record_every,
+                output="summary" if args.summary_only else "history",
+                root_seed=args.root_seed,
+                cache=cache,
+                stats=workers,
+                profilers=profilers if args.profile else None,
+                writer=writer,
+                plot_dir=out_dir if plot else None,
             )
+        sweep_wall = time.perf_counter() - start
+        with timer.phase("write"):
+            writer.close()
+    print(f"Saved aggregated metrics to {writer.path}")
+    if cache is not None:
+        with timer.phase("cache_prune"):
+            removed = cache.prune()
+        print(f"Result cache: {cache.hits} hits, {cache.misses} misses, removed {removed} old entries")
+
+    # Générer éventuellement des graphiques, dans un pool de processus (matplotlib garde le GIL)
+    if plot:
+        plot_workers = args.plot_workers or args.workers
+        plot_workers = cpu_count() if plot_workers == "auto" else int(plot_workers)
+        with timer.phase("plot"):
+            paths = plot_runs(plot_tasks, out_dir, args.plot_mode, plot_workers)
+        print(f"Saved {len(paths)} plots to {out_dir} ({args.plot_mode}, {plot_workers} processes)")
+
+    dump_profile(profilers, out_dir / PROFILE_DIR / "main.pstats")
+    counters = {
+        "rows": len(simulation_list),
+        "steps": int(simulation_table["steps"].sum()),
+        "cache_hits": cache.hits if cache is not None else 0,
+        "cache_misses": cache.misses if cache is not None else 0,
+    }
+    stats_path = write_run_stats(
+        out_dir, "run_threads.py", time.perf_counter() - run_start, timer, workers, counters,
+        worker_wall=sweep_wall, num_workers=num_workers, engine=engine, gil_enabled=gil_enabled(),
+    )
+    print(f"Saved run statistics to {stats_path}")
 
-            result["simulation_id"] = sim_params["simulation_id"]
-            result.update(sim_params)
-
-            with results_lock:
-                simulation_results.append(result)
-
-# Lancer les threads et collecter les résultats
-    threads = []
-    for _ in range(num_workers):
-        t = threading.Thread(target=worker)
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
-
-    #sauvegarder les résultat agrégés
-    results_df = pd.DataFrame(simulation_results)
-    metrics_csv_path = out_dir / "metrics.csv"
-    results_df.to_csv(metrics_csv_path, index=False)
-    print(f"Saved aggregated metrics to {metrics_csv_path}")
-
-    # Générer éventuellement des graphiques
-    if args.plot:
-        for _, row in results_df.iterrows():
-            plt.figure(figsize=(8, 4))
-            plt.plot(row["mailly"], label="Mailly")
-            plt.plot(row["moulin"], label="Moulin")
-            plt.title(f"Simulation {row['simulation_id']}")
-            plt.xlabel("Time step")
-            plt.ylabel("Number of bikes")
-            plt.legend()
-            plt.tight_layout()
-            plot_path = out_dir / f"simulation_{row['simulation_id']}.png"
-            plt.savefig(plot_path)
-            plt.close()
 
 if __name__ == "__main__":
     main()
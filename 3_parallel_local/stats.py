@@ -0,0 +1,194 @@
+import cProfile
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import pstats
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# Fichier des statistiques d'exécution, écrit à côté de metrics.*
+STATS_FILE = "run_stats.json"
+
+# Sous-répertoire des profils cProfile (--profile)
+PROFILE_DIR = "profile"
+
+# Les phases dont le nom commence ainsi sont de l'attente (hors utilisation)
+IDLE_PREFIX = "wait"
+
+
+class PhaseTimer:
+    """Wall time and call count of each phase of a run.
+
+    A phase costs two perf_counter() calls, so timers can stay on around
+    every row. Not thread-safe: use one timer per thread or process.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as one call of phase ``name``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def merge(self, phases: Dict[str, Dict]) -> None:
+        """Add phases in the format of to_dict() (e.g. sent by a worker)."""
+        for name, phase in phases.items():
+            self.add(name, phase["seconds"], phase["calls"])
+
+    def busy(self) -> float:
+        """Time spent in phases that are not waits (IDLE_PREFIX)."""
+        return sum(seconds for name, seconds in self.seconds.items() if not name.startswith(IDLE_PREFIX))
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {
+            name: {"seconds": self.seconds[name], "calls": self.calls[name]}
+            for name in sorted(self.seconds, key=self.seconds.get, reverse=True)
+        }
+
+    def take(self) -> Dict[str, Dict]:
+        """Phases recorded since the last take(), which resets the timer."""
+        phases = self.to_dict()
+        self.seconds, self.calls = {}, {}
+        return phases
+
+
+class WorkerStats:
+    """Rows, phases and utilization of each worker (thread, process or rank).
+
+    add() may be called from several threads.
+    """
+
+    def __init__(self):
+        self._workers: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, worker: str, phases: Dict[str, Dict], rows: int = 1) -> None:
+        """Record the phases of ``rows`` rows run by ``worker``."""
+        with self._lock:
+            entry = self._workers.setdefault(worker, {"rows": 0, "timer": PhaseTimer()})
+            entry["rows"] += rows
+            entry["timer"].merge(phases)
+
+    def totals(self) -> PhaseTimer:
+        """Phases summed over all the workers."""
+        total = PhaseTimer()
+        for entry in self._workers.values():
+            total.merge(entry["timer"].to_dict())
+        return total
+
+    def to_dict(self, wall: float) -> Dict[str, Dict]:
+        """Per worker: rows, busy time and utilization (busy time over ``wall``)."""
+        return {
+            worker: {
+                "rows": entry["rows"],
+                "busy_seconds": entry["timer"].busy(),
+                "utilization": entry["timer"].busy() / wall if wall > 0 else None,
+                "phases": entry["timer"].to_dict(),
+            }
+            for worker, entry in sorted(self._workers.items())
+        }
+
+
+def timed_iter(iterable: Iterable, timer: PhaseTimer, name: str) -> Iterator:
+    """Yield the items of ``iterable``, timing each wait for the next one as phase ``name``."""
+    iterator = iter(iterable)
+    while True:
+        with timer.phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def start_profiler(enabled: bool) -> Optional[cProfile.Profile]:
+    """A running cProfile profiler, or None when profiling is off."""
+    if not enabled:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ : un seul profileur actif par interpréteur
+        return None
+    return profiler
+
+
+def dump_profile(profilers: List[Optional[cProfile.Profile]], path: Path) -> Optional[Path]:
+    """Stop ``profilers`` and write their merged statistics to ``path`` (pstats format).
+
+    Returns:
+        The path written, or None when there was nothing to profile
+    """
+    profilers = [profiler for profiler in profilers if profiler is not None]
+    if not profilers:
+        return None
+    for profiler in profilers:
+        profiler.disable()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(path)
+    return path
+
+
+def write_run_stats(
+    out_dir,
+    runner: str,
+    wall: float,
+    timer: PhaseTimer,
+    workers: WorkerStats,
+    counters: Dict,
+    worker_wall: Optional[float] = None,
+    **info,
+) -> Path:
+    """Write ``run_stats.json`` in ``out_dir``.
+
+    It holds the wall time of the run, the phases of the main process (or
+    rank 0), the phases summed over the workers, the rows, busy time and
+    utilization of each worker, the counters (rows, steps, bytes, cache
+    hits...), any extra ``info`` (workers, engine...) and the profile files.
+    Utilization is busy time over ``worker_wall``, the time the workers
+    were up (default: ``wall``).
+
+    Returns:
+        Path of the written file
+    """
+    out_dir = Path(out_dir)
+    worker_wall = wall if worker_wall is None else worker_wall
+    worker_table = workers.to_dict(worker_wall)
+    utilizations = [entry["utilization"] for entry in worker_table.values() if entry["utilization"] is not None]
+    profile_dir = out_dir / PROFILE_DIR
+    stats = {
+        "runner": runner,
+        "pid": os.getpid(),
+        **info,
+        "wall_seconds": wall,
+        "worker_wall_seconds": worker_wall,
+        "phases": timer.to_dict(),
+        "unaccounted_seconds": wall - sum(timer.seconds.values()),
+        "worker_phases": workers.totals().to_dict(),
+        "mean_utilization": sum(utilizations) / len(utilizations) if utilizations else None,
+        "workers": worker_table,
+        "counters": counters,
+        "profiles": sorted(str(path) for path in profile_dir.glob("*.pstats")) if profile_dir.is_dir() else [],
+    }
+    path = out_dir / STATS_FILE
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+    return path
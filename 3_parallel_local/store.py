@@ -0,0 +1,157 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence
+import numpy as np
+
+
+# Colonnes de l'historique, un fichier .npy par colonne
+COLUMNS = ("mailly", "moulin", "unmet_mailly", "unmet_moulin")
+
+# Description du magasin : nombre d'enregistrements et pas entre deux
+META_FILE = "store.json"
+
+# Nombre d'enregistrements lus à la fois par chunks() et binned()
+CHUNK_RECORDS = 2**22
+
+
+def create_store(
+    directory,
+    dtypes: Dict[str, np.dtype],
+    records: int,
+    record_every: int = 1,
+) -> Dict[str, np.memmap]:
+    """Create the .npy files of a trajectory store, mapped in memory.
+
+    The arrays can be passed as ``out`` to run_simulation: the engines then
+    write the history straight to disk, one block of steps at a time, and
+    the operating system writes the dirty pages back as memory is needed.
+
+    Args:
+        directory: Directory of the store (created if needed)
+        dtypes: Dtype of each history column (see model.history_dtypes)
+        records: Number of recorded states (steps // record_every)
+        record_every: Number of steps between two recorded states
+
+    Returns:
+        Writable memory-mapped array of each column
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    columns = {
+        name: np.lib.format.open_memmap(directory / f"{name}.npy", mode="w+", dtype=dtype, shape=(records,))
+        for name, dtype in dtypes.items()
+    }
+    with open(directory / META_FILE, "w") as f:
+        json.dump({"records": records, "record_every": record_every}, f)
+    return columns
+
+
+def flush_store(columns: Dict[str, np.memmap]) -> None:
+    """Write the pages of a store created by create_store back to disk."""
+    for column in columns.values():
+        if isinstance(column, np.memmap):
+            column.flush()
+
+
+class TrajectoryStore:
+    """Lazy read-only access to a trajectory store.
+
+    Columns are opened with ``np.load(mmap_mode="r")`` on first use and
+    every window is a view of the mapping, so only the pages that are
+    actually read are loaded and nothing is copied. Time arguments are
+    step numbers (record ``i`` holds the state after step
+    ``(i + 1) * record_every``), as in ``SimulationResult.time``.
+
+    Example:
+        store = TrajectoryStore("results/trajectories/simulation_0")
+        window = store.window(1_000_000, 2_000_000, columns=("mailly",))
+        envelope = store.binned("mailly", bins=2000)
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / META_FILE) as f:
+            meta = json.load(f)
+        self.records = meta["records"]
+        self.record_every = meta["record_every"]
+        self._columns: Dict[str, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return self.records
+
+    def __getitem__(self, name: str) -> np.memmap:
+        """Whole column ``name``, mapped in memory."""
+        if name not in self._columns:
+            if name not in COLUMNS:
+                raise KeyError(f"Unknown column {name!r}, expected one of {COLUMNS}")
+            self._columns[name] = np.load(self.directory / f"{name}.npy", mmap_mode="r")
+        return self._columns[name]
+
+    def records_between(self, start: Optional[int] = None, stop: Optional[int] = None) -> slice:
+        """Records of the steps ``start <= t < stop`` (None: from the first / to the last)."""
+        k = self.record_every
+        first = 0 if start is None else min(max(-(-start // k) - 1, 0), self.records)
+        last = self.records if stop is None else min(max(-(-stop // k) - 1, first), self.records)
+        return slice(first, last)
+
+    def time(self, start: Optional[int] = None, stop: Optional[int] = None) -> np.ndarray:
+        """Step numbers of the records between ``start`` and ``stop``."""
+        rows = self.records_between(start, stop)
+        return np.arange(rows.start + 1, rows.stop + 1, dtype=np.int64) * self.record_every
+
+    def window(
+        self,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        columns: Sequence[str] = ("mailly", "moulin"),
+    ) -> Dict[str, np.ndarray]:
+        """Views (no copy) of ``columns`` for the steps ``start <= t < stop``."""
+        rows = self.records_between(start, stop)
+        return {name: self[name][rows] for name in columns}
+
+    def chunks(
+        self,
+        columns: Sequence[str] = ("mailly", "moulin"),
+        chunk_records: int = CHUNK_RECORDS,
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """Iterate over the store in windows of ``chunk_records`` records.
+
+        Each window holds views of ``columns`` and its 'time' (step numbers),
+        so an aggregation over the whole run needs one window in memory.
+        """
+        for first in range(0, self.records, chunk_records):
+            rows = slice(first, min(first + chunk_records, self.records))
+            window = {name: self[name][rows] for name in columns}
+            window["time"] = np.arange(rows.start + 1, rows.stop + 1, dtype=np.int64) * self.record_every
+            yield window
+
+    def binned(self, name: str, bins: int, chunk_records: int = CHUNK_RECORDS) -> Dict[str, np.ndarray]:
+        """Min, mean and max of column ``name`` over ``bins`` consecutive time bins.
+
+        This is the envelope to plot for a run too long to draw point by
+        point; it is computed in windows of at most ``chunk_records``
+        records, so memory does not depend on the length of the run.
+
+        Returns:
+            'time' (last step of each bin), 'min', 'mean' and 'max' arrays
+        """
+        column = self[name]
+        bins = max(1, min(bins, self.records))
+        edges = np.linspace(0, self.records, bins + 1).astype(np.int64)
+        low = np.empty(bins, dtype=column.dtype)
+        high = np.empty(bins, dtype=column.dtype)
+        mean = np.empty(bins)
+        for b in range(bins):
+            lo, hi, total = None, None, 0.0
+            for first in range(edges[b], edges[b + 1], chunk_records):
+                part = column[first:min(first + chunk_records, edges[b + 1])]
+                lo = part.min() if lo is None else min(lo, part.min())
+                hi = part.max() if hi is None else max(hi, part.max())
+                total += float(part.sum(dtype=np.float64))
+            if lo is None:
+                # magasin vide
+                low[b], high[b], mean[b] = 0, 0, np.nan
+                continue
+            low[b], high[b] = lo, hi
+            mean[b] = total / (edges[b + 1] - edges[b])
+        return {"time": edges[1:] * self.record_every, "min": low, "mean": mean, "max": high}
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+
+# Les modules de la simulation sont importés depuis 3_parallel_local
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
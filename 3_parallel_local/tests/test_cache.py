@@ -0,0 +1,46 @@
+import numpy as np
+
+from cache import ResultCache, simulate_row
+from model import history_dtypes
+from store import create_store
+
+
+ROW = {"steps": 5000, "p1": 0.5, "p2": 0.47, "init_mailly": 10, "init_moulin": 2}
+
+
+def test_round_trip(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    first = simulate_row(ROW, 7, cache, engine="vectorized")
+    second = simulate_row(ROW, 7, cache, engine="vectorized")
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.metrics == first.metrics
+    assert np.array_equal(second.unmet_mailly, first.unmet_mailly)
+
+
+def test_store(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    expected = simulate_row(ROW, 7, cache, engine="vectorized")
+    entries = list(cache.directory.glob("*/*.pkl"))
+
+    # une entrée existante remplit le magasin
+    out = create_store(tmp_path / "hit", history_dtypes(12, ROW["steps"]), ROW["steps"], 1)
+    result = simulate_row(ROW, 7, cache, out=out, engine="vectorized")
+    assert cache.hits == 1
+    assert np.array_equal(out["moulin"], expected.moulin)
+    assert result.metrics == expected.metrics
+
+    # un historique écrit dans un magasin n'est pas ajouté au cache
+    out = create_store(tmp_path / "miss", history_dtypes(12, ROW["steps"]), ROW["steps"], 1)
+    simulate_row(ROW, 8, cache, out=out, engine="vectorized")
+    assert list(cache.directory.glob("*/*.pkl")) == entries
+
+
+def test_counters_shared_by_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = ResultCache(tmp_path / "cache")
+    cache.put("ab" * 32, {"value": 1})
+    keys = ["ab" * 32, "cd" * 32] * 2000
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(cache.get, keys))
+    assert (cache.hits, cache.misses) == (2000, 2000)
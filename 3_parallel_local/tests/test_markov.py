@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from markov import (
+    VALIDATED_METRICS,
+    distribution_after,
+    expected_metrics,
+    stationary_distribution,
+    transition_matrix,
+    validate_row,
+)
+
+
+@pytest.mark.parametrize("lo, hi", [(0, None), (3, 9)])
+def test_stationary_distribution(lo, hi):
+    transition = transition_matrix(12, 0.4, 0.35, lo, hi).toarray()
+    assert np.allclose(transition.sum(axis=1), 1.0)
+    # itération de la puissance depuis la loi uniforme
+    current = np.full(transition.shape[0], 1.0 / transition.shape[0])
+    for _ in range(5000):
+        current = current @ transition
+    assert np.allclose(stationary_distribution(12, 0.4, 0.35, lo, hi), current, atol=1e-12)
+
+
+@pytest.mark.parametrize("lo, hi", [(0, None), (2, 7)])
+def test_squaring_matches_matvec(lo, hi):
+    squaring = distribution_after(4, 10, 777, 0.5, 0.45, method="squaring", lo=lo, hi=hi)
+    matvec = distribution_after(4, 10, 777, 0.5, 0.45, method="matvec", lo=lo, hi=hi)
+    for a, b in zip(squaring, matvec):
+        assert np.allclose(a, b, rtol=1e-9, atol=1e-12)
+    assert squaring[0].sum() == pytest.approx(1.0)
+    assert squaring[1].sum() == pytest.approx(777)
+
+
+def test_capacities_against_monte_carlo():
+    # pas de colonne seed : flux par défaut de la ligne (seeds.row_sequence)
+    row = {"steps": 300, "p1": 0.5, "p2": 0.45, "init_mailly": 6, "init_moulin": 4,
+           "cap_mailly": 8, "cap_moulin": 7}
+    check = validate_row(row, replicas=4000).set_index("metric")
+    assert list(check.index) == list(VALIDATED_METRICS)
+    assert (check["z"].abs() < 4).all(), check
+    # les capacités sont actives : retours refusés aux deux stations
+    assert check.loc["unmet_return_mailly", "exact"] > 0
+    assert check.loc["unmet_return_moulin", "exact"] > 0
+    uncapped = expected_metrics(6, 4, 300, 0.5, 0.45)
+    assert uncapped["unmet_return_mailly"] == 0
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from model import run_simulation
+
+pytest.importorskip("numba")
+
+
+# Nombre de graines par moteur
+SEEDS = 600
+
+# Métriques finales et statistiques d'occupation comparées
+COMPARED = (
+    "unmet_mailly",
+    "unmet_moulin",
+    "unmet_return_mailly",
+    "final_imbalance",
+    "mean_mailly",
+    "std_mailly",
+    "time_empty_mailly",
+    "time_full_mailly",
+)
+
+
+def sample(engine: str, **row) -> dict:
+    """Compared values of SEEDS runs of ``row``, one array per name."""
+    records = [
+        run_simulation(seed=seed, engine=engine, output="summary", **row).to_record(lists=False)
+        for seed in range(SEEDS)
+    ]
+    return {name: np.array([record[name] for record in records], dtype=float) for name in COMPARED}
+
+
+@pytest.mark.parametrize("row", [
+    dict(initial_mailly=6, initial_moulin=6, steps=400, p1=0.5, p2=0.47),
+    dict(initial_mailly=8, initial_moulin=4, steps=400, p1=0.3, p2=0.35, capacity_mailly=10, capacity_moulin=7),
+])
+def test_same_distribution(row):
+    # le moteur numba a son propre flux aléatoire : seules les lois se comparent
+    reference, compiled = sample("python", **row), sample("numba", **row)
+    for name in COMPARED:
+        a, b = reference[name], compiled[name]
+        if a.var() == b.var() == 0:
+            # métrique constante (station jamais vide avec ces capacités)
+            assert a.mean() == b.mean(), name
+            continue
+        z = (a.mean() - b.mean()) / np.sqrt((a.var(ddof=1) + b.var(ddof=1)) / SEEDS)
+        assert abs(z) < 4, (name, a.mean(), b.mean())
+        assert 0.7 < b.var(ddof=1) / a.var(ddof=1) < 1.4, (name, a.var(), b.var())
@@ -0,0 +1,38 @@
+import csv
+from pathlib import Path
+import subprocess
+import sys
+
+
+# Répertoire de run_adaptive.py
+HERE = Path(__file__).resolve().parent.parent
+
+
+def run_adaptive(tmp_path: Path, *options: str):
+    """Run run_adaptive.py on two short rows and return the rows of adaptive.csv."""
+    params = tmp_path / "params.csv"
+    params.write_text(
+        "steps,p1,p2,init_mailly,init_moulin,seed\n"
+        "200,0.5,0.47,10,2,123\n"
+        "100,0.55,0.45,12,3,126\n"
+    )
+    out_dir = tmp_path / "out"
+    subprocess.run(
+        [sys.executable, "run_adaptive.py", "--params", str(params), "--out-dir", str(out_dir),
+         "--workers", "1", "--tolerance", "3", *options],
+        cwd=HERE, check=True, capture_output=True,
+    )
+    with open(out_dir / "adaptive.csv", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_without_budget(tmp_path):
+    rows = run_adaptive(tmp_path)
+    assert [row["status"] for row in rows] == ["converged", "converged"]
+    assert all(int(row["replicas"]) >= 100 for row in rows)
+
+
+def test_budget(tmp_path):
+    rows = run_adaptive(tmp_path, "--tolerance", "0.01", "--budget", "300")
+    assert sum(int(row["replicas"]) for row in rows) <= 300
+    assert {row["status"] for row in rows} == {"budget"}
@@ -0,0 +1,43 @@
+import tracemalloc
+import numpy as np
+import pytest
+
+import model
+from model import run_batch, run_simulation
+
+
+def test_matches_run_simulation():
+    seeds = np.arange(6)
+    batch = run_batch(8, 4, 300, 0.5, 0.45, seeds, record_every=7, capacity_mailly=10, block_entries=6 * 5)
+    for i, seed in enumerate(seeds):
+        single = run_simulation(8, 4, 300, 0.5, 0.45, int(seed), record_every=7, capacity_mailly=10)
+        assert np.array_equal(batch.mailly[i], single.mailly)
+        assert np.array_equal(batch.unmet_moulin[i], single.unmet_moulin)
+        for name, value in single.metrics.items():
+            assert batch.metrics[name][i] == value
+
+
+@pytest.mark.parametrize("output", ["history", "summary"])
+def test_without_numba(monkeypatch, output):
+    steps = np.array([0, 50, 120, 200])
+    compiled = run_batch(6, 6, steps, 0.5, 0.5, np.arange(4), output=output, capacity_moulin=9, block_entries=4 * 16)
+    monkeypatch.setattr(model, "numba", None)
+    arrays = run_batch(6, 6, steps, 0.5, 0.5, np.arange(4), output=output, capacity_moulin=9, block_entries=4 * 16)
+    for name, value in compiled.metrics.items():
+        assert np.array_equal(arrays.metrics[name], value)
+    if output == "summary":
+        assert np.array_equal(arrays.occupancy, compiled.occupancy)
+    else:
+        assert np.array_equal(arrays.mailly, compiled.mailly)
+
+
+def test_memory_budget():
+    replicas, steps = 1000, 2000
+    run_batch(10, 5, 10, 0.5, 0.48, np.arange(2), output="summary")  # compilation numba hors mesure
+    tracemalloc.start()
+    summary = run_batch(10, 5, steps, 0.5, 0.48, np.arange(replicas), output="summary", block_entries=50 * replicas)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert summary.occupancy.sum() == replicas * steps
+    # les tirages d'un seul bloc de tous les pas occuperaient 32 Mo
+    assert peak < 8e6
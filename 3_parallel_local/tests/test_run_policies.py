@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from run_policies import make_tasks, run_task
+
+
+def scores(policies: pd.DataFrame, replicas: int = 50) -> pd.DataFrame:
+    # Mailly se vide : p1 > p2, peu de vélos au départ
+    scenarios = pd.DataFrame([{
+        "steps": 2000, "p1": 0.5, "p2": 0.33, "init_mailly": 6, "init_moulin": 6, "seed": 7,
+        "cap_mailly": 12, "cap_moulin": 12,
+    }])
+    policies = policies.assign(policy_id=range(len(policies)))
+    records = []
+    for task in make_tasks(scenarios, policies, replicas, batch_size=1000):
+        records.extend(run_task(task))
+    return pd.DataFrame(records).set_index("policy_id").sort_index()
+
+
+def test_threshold_policy_lowers_unmet_demand():
+    table = scores(pd.DataFrame([
+        {"policy": "none", "every": 1, "low": np.nan, "refill": np.nan, "truck_capacity": np.nan},
+        {"policy": "threshold", "every": 1, "low": 2, "refill": 6, "truck_capacity": np.nan},
+    ]))
+    none, threshold = table.loc[0], table.loc[1]
+
+    assert none["mean_truck_moves"] == 0 and none["mean_bikes_moved"] == 0
+    assert threshold["mean_truck_moves"] > 0 and threshold["mean_bikes_moved"] > 0
+    # mêmes graines pour les deux politiques : l'écart n'est pas du bruit
+    gap = none["mean_unmet"] - threshold["mean_unmet"]
+    assert gap > 4 * np.hypot(none["se_unmet"], threshold["se_unmet"])
@@ -0,0 +1,142 @@
+import argparse
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+
+# Modules qui ne doivent pas être importés au démarrage de run_one.py
+HEAVY_MODULES = ("pandas", "pyarrow", "matplotlib")
+
+# Répertoire de run_one.py
+HERE = Path(__file__).resolve().parent
+
+
+def parse_args():
+    """Parse command line arguments for the startup benchmark.
+
+    Returns:
+        Parsed arguments containing:
+        - repeat: Number of runs of each measure (the median is reported)
+        - steps: Number of steps of the benchmark row
+        - budget_ms: Import time budget of run_one.py in milliseconds
+    """
+    parser = argparse.ArgumentParser(description="Cold start time of run_one.py (python -X importtime).")
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs of each measure (the median is reported)"
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=1000,
+        help="Number of steps of the benchmark row (a short array task)"
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=100,
+        help="Import time budget of run_one.py in milliseconds"
+    )
+
+    return parser.parse_args()
+
+
+def import_times(statement: str) -> Dict[str, int]:
+    """Cumulative import time (µs) of the packages imported by ``statement``.
+
+    Runs ``python -X importtime -c statement`` in a fresh interpreter and
+    parses its report ("import time: self | cumulative | module", children
+    listed before their importer, one more level of indentation). The time
+    of a package is the sum over its submodules imported from outside it,
+    e.g. 'numpy' counts numpy.random too, which numpy imports lazily.
+    """
+    done = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        depth = (len(module) - len(module.lstrip())) // 2
+        entries.append((depth, module.strip(), int(cumulative)))
+
+    # parcours des importeurs vers les importés (ordre inverse du rapport)
+    times: Dict[str, int] = {}
+    importers: List[tuple] = []
+    for depth, module, cumulative in reversed(entries):
+        while importers and importers[-1][0] >= depth:
+            importers.pop()
+        package = module.split(".")[0]
+        if not importers or importers[-1][1] != package:
+            times[package] = times.get(package, 0) + cumulative
+        importers.append((depth, package))
+    return times
+
+
+def wall_time(command: List[str]) -> float:
+    """Wall-clock time (s) of one run of ``command`` in the run_one.py directory."""
+    start = time.perf_counter()
+    subprocess.run(command, cwd=HERE, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def median_ms(values: List[float]) -> float:
+    return statistics.median(values) / 1000
+
+
+def main():
+    """Measure the cold start of run_one.py.
+
+    Reports the median over --repeat fresh interpreters of:
+    - the import time of run_one (python -X importtime), split into NumPy,
+      which the simulation needs, and the rest of the entry point
+    - the heavy modules (pandas, pyarrow, matplotlib) imported at startup,
+      which should be none
+    - the wall-clock time of a whole one-row task with --format csv (lean
+      path) and --format parquet (imports pyarrow), next to an empty
+      interpreter and a bare "import numpy"
+    """
+    args = parse_args()
+
+    runs = [import_times("import run_one") for _ in range(args.repeat)]
+    total = median_ms([run["run_one"] for run in runs])
+    numpy = median_ms([run.get("numpy", 0) for run in runs])
+    heavy = sorted({name for run in runs for name in run if name.split(".")[0] in HEAVY_MODULES})
+
+    print(f"import run_one: {total:7.1f} ms (numpy {numpy:.1f} ms, rest of the entry point {total - numpy:.1f} ms)")
+    print(f"heavy modules at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        params = Path(tmp) / "params.csv"
+        params.write_text(f"steps,p1,p2,init_mailly,init_moulin,seed\n{args.steps},0.5,0.47,10,2,123\n")
+        commands = {
+            "python -c pass": [sys.executable, "-c", "pass"],
+            "python -c 'import numpy'": [sys.executable, "-c", "import numpy"],
+        }
+        for fmt in ("csv", "parquet"):
+            commands[f"run_one.py --format {fmt}"] = [
+                sys.executable, "run_one.py", "--params", str(params), "--row-index", "0",
+                "--out-dir", os.path.join(tmp, fmt), "--format", fmt,
+            ]
+        for name, command in commands.items():
+            seconds = statistics.median(wall_time(command) for _ in range(args.repeat))
+            print(f"{name:<28} {1000 * seconds:8.1f} ms")
+
+    verdict = "within" if total <= args.budget_ms else "over"
+    print(f"run_one import time {total:.1f} ms is {verdict} the {args.budget_ms:.0f} ms budget")
+    if total > args.budget_ms and numpy > args.budget_ms / 2:
+        print(f"(numpy alone takes {numpy:.1f} ms to import on this machine)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+import pickle
+import tempfile
+from typing import Any, Dict, Optional
+import numpy as np
+
+from model import MODEL_VERSION
+
+
+# Taille maximale du cache par défaut, en octets
+DEFAULT_MAX_BYTES = 2**30
+
+
+def _normalize(value):
+    """JSON-friendly form of a key field (NaN -> None, SeedSequence -> its stream)."""
+    if isinstance(value, np.random.SeedSequence):
+        return {"entropy": value.entropy, "spawn_key": list(value.spawn_key)}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def make_key(**fields) -> str:
+    """Hash of the fields that determine a result (order does not matter)."""
+    text = json.dumps({name: _normalize(value) for name, value in fields.items()}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of simulation results keyed by make_key.
+
+    Entries are pickle files under ``directory/<2 first hex digits>/``. A
+    new entry is written to a temporary file and renamed into place, which
+    is atomic, so concurrent workers (processes, threads, MPI ranks, array
+    tasks) never see a partial entry; two writers of the same key write the
+    same result. Reading an entry updates its modification time, and
+    prune() removes the least recently used entries beyond ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Cached result of ``key``, or None when it is not cached."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # absente, ou supprimée par prune() entre-temps
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Any) -> None:
+        """Store ``result`` under ``key`` (atomic rename of a temporary file)."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def prune(self) -> int:
+        """Remove the least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            Number of removed entries
+        """
+        entries = []
+        for path in self.directory.glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def open_cache(directory: Optional[str], max_mb: float) -> Optional[ResultCache]:
+    """ResultCache for the --cache-dir / --cache-size options (None: no cache)."""
+    if directory is None:
+        return None
+    return ResultCache(directory, max_bytes=int(max_mb * 2**20))
+
+
+def row_key(params: Dict, seed, **options) -> str:
+    """Cache key of one params.csv row run with the given seed and options."""
+    return make_key(
+        version=MODEL_VERSION,
+        steps=int(params["steps"]),
+        p1=float(params["p1"]),
+        p2=float(params["p2"]),
+        init_mailly=int(params["init_mailly"]),
+        init_moulin=int(params["init_moulin"]),
+        cap_mailly=params.get("cap_mailly"),
+        cap_moulin=params.get("cap_moulin"),
+        seed=seed,
+        **options,
+    )
+
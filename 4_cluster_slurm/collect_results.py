@@ -1,29 +1,287 @@
 import argparse
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, Iterable, Iterator, List, Optional
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from output import EXTENSIONS, FORMATS, ResultWriter, read_dataset, read_table, resolve_format, write_table
+
+
+# Fichier des runs déjà collectés, dans le répertoire de sortie
+MANIFEST = "manifest.json"
+
+# Table des métriques en cours d'écriture, renommée en "metrics" une fois complète
+PARTIAL_METRICS = "metrics_partial"
+
+# Nombre de runs soumis d'avance par thread au pool
+READ_AHEAD = 4
+
+# Préfixe des répertoires des tâches regroupant plusieurs lignes (run_one.py --rows)
+PACKED_PREFIX = "rows_"
+
+# Description d'une tâche groupée (lignes demandées et ROWS_PER_TASK), voir run_one.py
+TASK_FILE = "task.json"
 
 
 def parse_args():
     """Parse command line arguments for collecting distributed results.
-    
+
     Returns:
         Parsed arguments containing:
         - in_dir: Input directory containing subdirectories with individual run results
         - out_dir: Output directory for aggregated results
+        - params: Parameter file of the sweep, to report the rows with no results
+        - rows_per_task: ROWS_PER_TASK of the sweep, to map rows to array task ids
+        - workers: Number of threads reading the run directories
+        - full: Ignore the manifest and collect every run again
+        - format: Output format of the aggregated results
         - plot: Boolean flag to generate plots after collection
-    
+
     Note:
         Use argparse.ArgumentParser to define all required and optional arguments
     """
-    # TODO: Implement argument parsing
-    pass
+    parser = argparse.ArgumentParser(description="Aggregate the results of the Slurm array tasks.")
+
+    parser.add_argument(
+        "--in-dir",
+        type=str,
+        default="results",
+        help="Directory with one numbered subdirectory per run (output of run_one.py)"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="aggregated",
+        help="Directory to save the aggregated results"
+    )
+    parser.add_argument(
+        "--params",
+        type=str,
+        default=None,
+        help="Parameter file of the sweep: rows without a run directory are reported as missing"
+    )
+    parser.add_argument(
+        "--rows-per-task",
+        type=int,
+        default=None,
+        help="ROWS_PER_TASK of the sweep, to print the array tasks to resubmit (default: recorded in the task.json of the packed tasks, else 1)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(32, (os.cpu_count() or 1) * 4),
+        help="Number of threads reading the run directories (I/O bound)"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest of the previous collection and read every run again"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="parquet",
+        choices=FORMATS,
+        help="Output format of metrics and timeseries (csv is an export option)"
+    )
+    parser.add_argument(
+        "--plot",
+        action="store_true",
+        help="Generate plots after collection"
+    )
+
+    return parser.parse_args()
+
+
+def fingerprint(run_dir: Path) -> List[List]:
+    """Name, size and modification time (ns) of the files of a run directory."""
+    files = []
+    with os.scandir(run_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return sorted(files)
+
+
+def is_run_dir(name: str) -> bool:
+    """Whether ``name`` is a run directory: one row (its index) or a packed task."""
+    return name.isdigit() or name.startswith(PACKED_PREFIX)
+
+
+def run_dir_rows(name: str) -> range:
+    """Rows of a run directory: its row, or the rows of a packed task (rows_<start>_<stop>_<step>)."""
+    if name.isdigit():
+        return range(int(name), int(name) + 1)
+    return range(*(int(bound) for bound in name[len(PACKED_PREFIX):].split("_")))
+
+
+def run_dir_order(path: Path) -> int:
+    """Sort key of a run directory: its row, or the first row of a packed task."""
+    return run_dir_rows(path.name).start
+
+
+def read_run(run_dir: Path) -> Optional[List[Dict]]:
+    """Record (metrics, 'param_*' metadata, trajectories) of a one-row directory, as a list."""
+    metrics = read_table(run_dir / "metrics")
+    if metrics is None or metrics.empty:
+        return None
+    record = {"run_id": int(run_dir.name)}
+    record.update(metrics.iloc[0].to_dict())
+
+    metadata_path = run_dir / "metadata.json"
+    if metadata_path.exists():
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        for key, value in metadata.items():
+            if not isinstance(value, (list, dict)):
+                record[f"param_{key}"] = value
+
+    timeseries = read_table(run_dir / "timeseries")
+    if timeseries is not None:
+        record["mailly"] = timeseries["mailly"].to_numpy()
+        record["moulin"] = timeseries["moulin"].to_numpy()
+    return [record]
+
+
+def read_packed(task_dir: Path) -> Optional[List[Dict]]:
+    """Records of a packed task, already in the aggregated layout (run_one.py --rows)."""
+    metrics = read_table(task_dir / "metrics")
+    if metrics is None:
+        return None
+    series = {}
+    if (task_dir / "timeseries").exists() or (task_dir / "timeseries.csv").exists():
+        timeseries = read_dataset(task_dir / "timeseries")
+        series = {int(run_id): run.sort_values("time") for run_id, run in timeseries.groupby("run_id")}
+    records = metrics.to_dict(orient="records")
+    for record in records:
+        run = series.get(int(record["run_id"]))
+        if run is not None:
+            record["mailly"] = run["mailly"].to_numpy()
+            record["moulin"] = run["moulin"].to_numpy()
+    return records
+
+
+def collect_run(run_dir: Path, known: Dict[str, Dict], writer: ResultWriter) -> Dict:
+    """Read one run directory and write it, unless it is unchanged since the last collection.
+
+    Args:
+        run_dir: Numbered directory, or packed task directory, written by run_one.py
+        known: Manifest entry ('files' fingerprint and 'run_ids') of each directory
+        writer: Aggregated output; the metrics rows (with 'param_*' metadata)
+            and trajectories are written from the calling thread
+
+    Returns:
+        Dictionary with 'name', 'files' (fingerprint), 'run_ids' and 'status':
+        "unchanged", "collected" or the error that made the directory unreadable
+    """
+    entry = known.get(run_dir.name)
+    loaded = {"name": run_dir.name, "files": fingerprint(run_dir), "run_ids": [], "status": "unchanged"}
+    if entry is not None and entry["files"] == loaded["files"]:
+        loaded["run_ids"] = entry["run_ids"]
+        return loaded
+
+    try:
+        read = read_run if run_dir.name.isdigit() else read_packed
+        records = read(run_dir)
+        if records is None:
+            loaded["status"] = "no metrics"
+            return loaded
+        for record in records:
+            writer.write(record)
+    except Exception as error:  # fichier tronqué par une tâche interrompue, JSON invalide...
+        loaded["status"] = f"{type(error).__name__}: {error}"
+        return loaded
+    loaded["run_ids"] = [int(record["run_id"]) for record in records]
+    loaded["status"] = "collected"
+    return loaded
+
+
+def collect_runs(
+    run_dirs: Iterable[Path],
+    known: Dict[str, Dict],
+    writer: ResultWriter,
+    workers: int,
+) -> Iterator[Dict]:
+    """collect_run over ``run_dirs`` with a thread pool, yielding the statuses in order.
+
+    Reading and writing the partition of a run both happen in the pool
+    (pyarrow releases the GIL); at most READ_AHEAD runs per thread are
+    submitted ahead, so the pool never holds the whole sweep.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for run_dir in run_dirs:
+            pending.append(pool.submit(collect_run, run_dir, known, writer))
+            if len(pending) >= READ_AHEAD * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_manifest(out_dir: Path, fmt: str) -> Dict:
+    """Manifest of the previous collection into ``out_dir`` (empty if unusable)."""
+    empty = {"format": fmt, "runs": {}, "failed": {}, "missing": []}
+    try:
+        with open(out_dir / MANIFEST) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get("format") != fmt:
+        return empty
+    return manifest
+
+
+def write_manifest(out_dir: Path, manifest: Dict) -> None:
+    """Write the manifest atomically (temporary file + rename)."""
+    tmp = out_dir / f"{MANIFEST}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, out_dir / MANIFEST)
+
+
+def rows_per_task(run_dirs: List[Path]) -> Optional[int]:
+    """ROWS_PER_TASK of the sweep, as recorded in the task.json of its packed tasks.
+
+    The directory names cannot tell it: the last task is clipped to the end
+    of params.csv. Returns 1 without packed tasks, None when their task.json
+    files are missing or disagree.
+    """
+    sizes, packed = set(), False
+    for path in run_dirs:
+        if not path.name.startswith(PACKED_PREFIX):
+            continue
+        packed = True
+        try:
+            with open(path / TASK_FILE) as f:
+                size = json.load(f).get("rows_per_task")
+        except (OSError, ValueError):
+            continue
+        if size:
+            sizes.add(int(size))
+    if len(sizes) == 1:
+        return sizes.pop()
+    return None if packed else 1
+
+
+def array_spec(ids: Iterable[int]) -> str:
+    """Slurm --array specification of ``ids`` (e.g. '3,7-9'), to resubmit them."""
+    ranges = []
+    for i in sorted(ids):
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
 
 
 def main():
     """Main function to collect and aggregate results from distributed simulations.
-    
+
     This function should:
     1. Parse command line arguments
     2. Scan input directory for numbered subdirectories (one per simulation run)
@@ -31,26 +289,154 @@ def main():
     4. Aggregate metrics and timeseries data
     5. Save aggregated results to CSV files
     6. Optionally generate plots
-    
+
     Expected input structure:
     - {in_dir}/0/metrics.csv, timeseries.csv, metadata.json
     - {in_dir}/1/metrics.csv, timeseries.csv, metadata.json
     - ...
-    
-    Output files:
-    - metrics.csv: Aggregated metrics for all runs with run_id column
-    - timeseries.csv: Tidy format timeseries data for all runs
+    - {in_dir}/rows_<start>_<stop>_<step>/metrics.parquet, timeseries/,
+      metadata.json: packed task (run_one.py --rows), many runs at once
+
+    Output files (written with output.ResultWriter, see --format):
+    - metrics.parquet: Aggregated metrics for all runs with run_id column,
+      sorted by run_id
+    - timeseries/run_id=<i>/: Tidy (long) timeseries of run i, one row per
+      step (time, mailly, moulin); timeseries.csv with --format csv
+    - manifest.json: Fingerprint (file names, sizes, mtimes) and run ids of
+      every collected directory, and the failed and missing rows
     - Optional plots: PNG files for timeseries and metrics visualization
-    
+
     Note:
         - Extract run_id from subdirectory name (should be integer)
         - Merge metadata parameters into metrics with 'param_' prefix
-        - Convert timeseries to tidy format (melt operation)
+        - Convert timeseries to tidy format (one row per run and step)
         - Handle missing files gracefully
         - Sort subdirectories numerically for consistent processing
+        - A thread pool reads the run directories and writes their
+          timeseries partitions; metrics rows are streamed in row groups
+        - A rerun only reads the runs that are new or whose files changed:
+          the metrics of the other runs are copied from the previous table
+          and their timeseries partitions are left in place (with
+          --format csv, everything is collected again)
+        - Runs without metrics, or whose files cannot be read, are reported
+          as failed; with --params, rows without a directory as missing
+        - The metrics table is written to metrics_partial, sorted by run_id
+          and renamed over metrics; manifest.json is written last, so an
+          interrupted collection leaves the previous table and manifest
     """
-    # TODO: Implement results collection and aggregation workflow
-    pass
+    args = parse_args()
+    in_dir = Path(args.in_dir)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fmt = resolve_format(args.format)
+
+    # sous-répertoires numérotés et tâches groupées, dans l'ordre des lignes
+    with os.scandir(in_dir) as entries:
+        run_dirs = sorted(
+            (Path(entry.path) for entry in entries if entry.is_dir() and is_run_dir(entry.name)),
+            key=run_dir_order,
+        )
+
+    # runs déjà collectés : la sortie CSV n'est pas incrémentale
+    manifest = read_manifest(out_dir, fmt)
+    previous = None
+    if not args.full and fmt != "csv" and manifest["runs"]:
+        previous = read_table(out_dir / "metrics")
+    if previous is None:
+        manifest["runs"] = {}
+        shutil.rmtree(out_dir / "timeseries", ignore_errors=True)
+    known = manifest["runs"]
+
+    runs, failed = {}, {}
+    unchanged, collected = set(), 0
+    for extension in EXTENSIONS.values():
+        # table partielle d'une collecte interrompue
+        (out_dir / f"{PARTIAL_METRICS}{extension}").unlink(missing_ok=True)
+    # la table précédente reste en place tant que la nouvelle n'est pas complète
+    with ResultWriter(out_dir, fmt, name=PARTIAL_METRICS, run_id="run_id") as writer:
+        for loaded in collect_runs(run_dirs, known, writer, args.workers):
+            if loaded["status"] == "unchanged":
+                unchanged.update(loaded["run_ids"])
+            elif loaded["status"] != "collected":
+                failed[loaded["name"]] = loaded["status"]
+                continue
+            else:
+                collected += len(loaded["run_ids"])
+            runs[loaded["name"]] = {"files": loaded["files"], "run_ids": loaded["run_ids"]}
+
+        # lignes des runs inchangés, recopiées de la table précédente
+        if previous is not None:
+            writer.write_frame(previous[previous["run_id"].isin(unchanged)])
+
+    # lignes dans l'ordre des runs (l'ordre d'arrivée dépend des threads),
+    # puis remplacement atomique de la table ; le manifeste est écrit en dernier
+    metrics_path = out_dir / f"metrics{EXTENSIONS[fmt]}"
+    metrics = read_table(out_dir / PARTIAL_METRICS)
+    if metrics is not None:
+        metrics = metrics.sort_values("run_id", kind="stable").reset_index(drop=True)
+        os.replace(write_table(metrics, out_dir / PARTIAL_METRICS, fmt), metrics_path)
+    else:
+        metrics_path.unlink(missing_ok=True)
+
+    # trajectoires des runs disparus ou désormais en échec
+    present = {run_id for entry in runs.values() for run_id in entry["run_ids"]}
+    duplicates = sum(len(entry["run_ids"]) for entry in runs.values()) - len(present)
+    if duplicates:
+        print(f"Warning: {duplicates} runs appear in several directories (row dir and packed task?)")
+    for run_id in {run_id for entry in known.values() for run_id in entry["run_ids"]} - present:
+        shutil.rmtree(out_dir / "timeseries" / f"run_id={run_id}", ignore_errors=True)
+
+    # lignes sans résultat : toutes les lignes d'une tâche groupée en échec
+    failed_rows = {row for name in failed for row in run_dir_rows(name)} - present
+    known_rows = present | failed_rows
+    expected = set(range(len(pd.read_csv(args.params)))) if args.params else set(range(max(known_rows, default=-1) + 1))
+    if args.params:
+        failed_rows &= expected
+    missing = sorted(expected - known_rows)
+
+    manifest.update({"format": fmt, "runs": runs, "failed": failed, "missing": missing})
+    write_manifest(out_dir, manifest)
+
+    print(f"Collected {collected} new or changed runs, kept {len(unchanged)} unchanged runs into {metrics_path}")
+    for name, error in sorted(failed.items())[:10]:
+        print(f"  failed {name}: {error}")
+    # sweep_array.sbatch lance les lignes [id * ROWS_PER_TASK, (id + 1) * ROWS_PER_TASK) de la tâche id
+    per_task = args.rows_per_task or rows_per_task(run_dirs)
+    for label, rows in (("failed", failed_rows), ("missing", missing)):
+        if not rows:
+            continue
+        if per_task is None:
+            print(f"{len(rows)} {label} runs (rows {array_spec(rows)}): "
+                  "ROWS_PER_TASK unknown, pass --rows-per-task to get the array task ids")
+            continue
+        tasks = {row // per_task for row in rows}
+        export = f" --export=ALL,ROWS_PER_TASK={per_task}" if per_task > 1 else ""
+        print(f"{len(rows)} {label} runs in {len(tasks)} tasks: --array={array_spec(tasks)}{export}")
+
+    if args.plot and runs:
+        import matplotlib.pyplot as plt
+
+        metrics_df = read_table(out_dir / "metrics").sort_values("run_id")
+        plt.figure(figsize=(8, 4))
+        plt.bar(metrics_df["run_id"] - 0.2, metrics_df["unmet_mailly"], width=0.4, label="Mailly")
+        plt.bar(metrics_df["run_id"] + 0.2, metrics_df["unmet_moulin"], width=0.4, label="Moulin")
+        plt.xlabel("Run")
+        plt.ylabel("Unmet requests")
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(out_dir / "unmet.png")
+        plt.close()
+
+        timeseries = read_dataset(out_dir / "timeseries")
+        plt.figure(figsize=(8, 4))
+        for run_id, run in timeseries.groupby("run_id"):
+            plt.plot(run["time"], run["mailly"], label=f"Run {run_id}")
+        plt.xlabel("Time step")
+        plt.ylabel("Bikes at Mailly")
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(out_dir / "timeseries_mailly.png")
+        plt.close()
 
 
 if __name__ == "__main__":
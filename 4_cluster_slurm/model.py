@@ -1,7 +1,11 @@
 from dataclasses import dataclass
-from typing import Tuple, Dict
+from typing import Dict, Tuple, Union
 import numpy as np
-import pandas as pd
+
+
+# Version des résultats, à incrémenter quand la simulation change ses sorties
+# (invalide les résultats en cache, voir cache.py)
+MODEL_VERSION = 2
 
 
 @dataclass
@@ -40,11 +44,26 @@ def step(
         - If a station has no bikes available, increment the appropriate unmet demand counter
         - Update the state by moving bikes between stations based on probabilities
     """
-    # TODO: Implement the step logic including unmet tracking
-    pass
+    # Mailly vers Moulin
+    if rng.random() < p1:
+        if state.mailly == 0:
+            metrics["unmet_mailly"] += 1
+        else:
+            state.mailly -= 1
+            state.moulin += 1
+
+    # Moulin vers Mailly
+    if rng.random() < p2:
+        if state.moulin == 0:
+            metrics["unmet_moulin"] += 1
+        else:
+            state.moulin -= 1
+            state.mailly += 1
 
+    return state
 
-def run_simulation(initial: State, steps: int, p1: float, p2: float, seed: int):
+
+def run_simulation(initial: State, steps: int, p1: float, p2: float, seed: Union[int, np.random.SeedSequence]):
     """Run a complete bike-sharing simulation with extended metrics.
 
     Args:
@@ -52,11 +71,15 @@ def run_simulation(initial: State, steps: int, p1: float, p2: float, seed: int):
         steps: Number of simulation steps to run
         p1: Probability of movement from Mailly to Moulin
         p2: Probability of movement from Moulin to Mailly
-        seed: Random seed for reproducibility
+        seed: Random seed for reproducibility, an int or a SeedSequence
+            (see seeds.py); draws are taken in the same order as the python
+            engine of 3_parallel_local, so both give the same trajectory
 
     Returns:
         Tuple containing:
-        - DataFrame with columns ['time', 'mailly', 'moulin'] tracking bike counts over time
+        - Dictionary of NumPy columns 'time', 'mailly', 'moulin' tracking bike
+          counts over time (pass it to pandas.DataFrame for a table; it is
+          written as is by output.write_table)
         - Dictionary with metrics including:
             - 'unmet_mailly': Number of unmet requests at Mailly
             - 'unmet_moulin': Number of unmet requests at Moulin
@@ -67,5 +90,24 @@ def run_simulation(initial: State, steps: int, p1: float, p2: float, seed: int):
         - Record state at each time step for the DataFrame
         - Calculate final imbalance as mailly - moulin
     """
-    # TODO: Implement the simulation loop with extended metrics
-    pass
+    rng = np.random.default_rng(seed)
+    state = State(mailly=initial.mailly, moulin=initial.moulin)
+    metrics = {"unmet_mailly": 0, "unmet_moulin": 0}
+
+    # vélos bornés par le total : entiers compacts
+    total = initial.mailly + initial.moulin
+    dtype = np.uint16 if total <= np.iinfo(np.uint16).max else np.int64
+    mailly = np.empty(steps, dtype=dtype)
+    moulin = np.empty(steps, dtype=dtype)
+    for t in range(steps):
+        state = step(state, p1, p2, rng, metrics)
+        mailly[t] = state.mailly
+        moulin[t] = state.moulin
+
+    timeseries = {
+        "time": np.arange(1, steps + 1, dtype=np.int64),
+        "mailly": mailly,
+        "moulin": moulin,
+    }
+    metrics["final_imbalance"] = state.mailly - state.moulin
+    return timeseries, metrics
@@ -0,0 +1,107 @@
+from array import array
+import csv
+import io
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+
+# Suffixe de l'index binaire des lignes de params.csv (un décalage uint64 par ligne)
+INDEX_SUFFIX = ".idx"
+
+
+def parse_value(text: str) -> Union[int, float]:
+    """Value of a params.csv field as pandas would read it (empty: NaN)."""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text) if text.strip() else float("nan")
+
+
+def index_path(params) -> Path:
+    """Path of the row index of ``params`` (params.csv -> params.csv.idx)."""
+    params = Path(params)
+    return params.with_name(params.name + INDEX_SUFFIX)
+
+
+def build_index(params) -> int:
+    """Write the byte offset of every data row of ``params`` to its index file.
+
+    With the index, read_rows seeks straight to a row instead of scanning
+    the file, which matters for array tasks far down a large sweep. The
+    index is ignored once params.csv is newer than it.
+
+    Returns:
+        Number of data rows
+    """
+    offsets = array("Q")
+    with open(params, "rb") as f:
+        f.readline()  # en-tête
+        offset = f.tell()
+        for line in f:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    if offsets.itemsize != 8:
+        raise RuntimeError("array('Q') is not 64-bit on this platform")
+    tmp = index_path(params).with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        offsets.tofile(f)
+    os.replace(tmp, index_path(params))
+    return len(offsets)
+
+
+def _row_offset(params, row: int) -> Optional[int]:
+    """Byte offset of data row ``row`` from an up-to-date index (None: no usable index)."""
+    path = index_path(params)
+    try:
+        if path.stat().st_mtime_ns < os.stat(params).st_mtime_ns:
+            return None
+        with open(path, "rb") as f:
+            f.seek(8 * row)
+            entry = array("Q", f.read(8))
+    except OSError:
+        return None
+    if len(entry) != 1:
+        # au-delà de la dernière ligne
+        return os.stat(params).st_size
+    return entry[0]
+
+
+def read_rows(
+    params,
+    start: int = 0,
+    stop: Optional[int] = None,
+    step: int = 1,
+) -> List[Tuple[int, Dict]]:
+    """Rows ``start:stop:step`` of a parameter file, read with the csv module.
+
+    Only the header and the requested lines are parsed: with an index (see
+    build_index) the file is read from the first requested row on,
+    otherwise the lines before it are skipped without parsing. Fields must
+    not contain newlines (plain numeric parameter files).
+
+    Returns:
+        (row index, row) pairs; values are ints, floats, or NaN when empty
+    """
+    rows = []
+    with open(params, "rb") as f:
+        header = next(csv.reader([f.readline().decode()]))
+        offset = _row_offset(params, start) if start > 0 else None
+        first = 0
+        if offset is not None:
+            f.seek(offset)
+            first = start
+        # les lignes vides ne comptent pas, comme pour pandas et build_index
+        index = first - 1
+        for line in io.TextIOWrapper(f, newline=""):
+            if not line.strip():
+                continue
+            index += 1
+            if stop is not None and index >= stop:
+                break
+            if index < start or (index - start) % step:
+                continue
+            values = next(csv.reader([line]))
+            rows.append((index, {name: parse_value(value) for name, value in zip(header, values)}))
+    return rows
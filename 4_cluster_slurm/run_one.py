@@ -1,9 +1,22 @@
 import argparse
 import json
+import os
 from pathlib import Path
-import pandas as pd
+from typing import Dict, Tuple
 
+# pas de pandas ni de pyarrow au démarrage : l'import coûte plus qu'une ligne courte
+from cache import ResultCache, open_cache, row_key
 from model import State, run_simulation
+from output import FORMATS, ResultWriter, resolve_format, write_table
+from rows import build_index, read_rows
+from seeds import is_missing, row_sequence
+
+
+# Options communes à toutes les lignes d'une tâche (copiées dans les workers)
+_options: Dict = {}
+
+# Description d'une tâche groupée, écrite avant ses simulations (lue par collect_results.py)
+TASK_FILE = "task.json"
 
 
 def parse_args():
@@ -13,14 +26,239 @@ def parse_args():
         Parsed arguments containing:
         - params: Path to CSV file with parameter combinations (default: params.csv)
         - row_index: Index of the row to execute from the parameters file
+        - rows: Slice START:STOP[:STEP] of rows to execute in one task
+        - build_index: Write the binary row index of the parameter file and exit
+        - workers: Number of processes running the rows of --rows
         - out_dir: Output directory for this simulation's results
-        - base_seed: Base seed to use if row doesn't have seed column (default: 0)
-    
+        - base_seed: Seed of the whole sweep, used when the row has no seed
+          column (default: 0)
+        - root_seed: Seed of the whole sweep, used even when rows have seeds
+        - cache_dir: Directory of the result cache shared by the array tasks
+        - cache_size: Maximum size of the cache in MiB
+        - format: Output format of the run's tables (parquet, feather or csv)
+
     Note:
         Use argparse.ArgumentParser to define all required and optional arguments
     """
-    # TODO: Implement argument parsing
-    pass
+    parser = argparse.ArgumentParser(description="Run one row of the parameter file (one Slurm array task).")
+
+    parser.add_argument(
+        "--params",
+        type=str,
+        default="params.csv",
+        help="Path to CSV file with parameter combinations"
+    )
+    # une ligne par tâche, ou un paquet de lignes par tâche
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument(
+        "--row-index",
+        type=int,
+        help="Index of the row to run (SLURM_ARRAY_TASK_ID)"
+    )
+    selection.add_argument(
+        "--rows",
+        type=parse_rows,
+        help="Rows START:STOP[:STEP] to run in this task (Python slice, STOP is clipped to the file)"
+    )
+    selection.add_argument(
+        "--build-index",
+        action="store_true",
+        help="Write <params>.idx, the byte offset of each row, so that tasks seek straight to their rows"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("SLURM_CPUS_PER_TASK", 1)),
+        help="Number of processes running the rows of --rows (default: SLURM_CPUS_PER_TASK)"
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="results",
+        help="Output directory; results go to <out-dir>/<row-index>/"
+    )
+    parser.add_argument(
+        "--base-seed",
+        type=int,
+        default=0,
+        help="Seed of the sweep for rows without seed: row i uses child i of SeedSequence(base_seed)"
+    )
+    parser.add_argument(
+        "--root-seed",
+        type=int,
+        default=None,
+        help="Seed of the whole sweep, overriding the seed column (as --root-seed in 3_parallel_local)"
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the result cache: a row already simulated is read back (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=1024,
+        help="Maximum size of the result cache in MiB (least recently used entries are removed)"
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="csv",
+        choices=FORMATS,
+        help="Output format of timeseries and metrics (csv: written without importing pandas or pyarrow)"
+    )
+
+    return parser.parse_args()
+
+
+def parse_rows(text: str) -> slice:
+    """Slice of rows from 'START:STOP' or 'START:STOP:STEP' (fields may be empty)."""
+    fields = text.split(":")
+    if not 2 <= len(fields) <= 3:
+        raise argparse.ArgumentTypeError(f"expected START:STOP[:STEP], got {text!r}")
+    try:
+        bounds = [int(field) if field else None for field in fields]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected START:STOP[:STEP], got {text!r}") from None
+    if any(bound is not None and bound < 0 for bound in bounds[:2]):
+        raise argparse.ArgumentTypeError(f"START and STOP must be >= 0, got {text!r}")
+    if len(bounds) == 3 and bounds[2] is not None and bounds[2] < 1:
+        raise argparse.ArgumentTypeError(f"STEP must be >= 1, got {bounds[2]}")
+    return slice(*bounds)
+
+
+def simulate(
+    row: Dict,
+    row_index: int,
+    root_seed: int = None,
+    base_seed: int = 0,
+    cache: ResultCache = None,
+) -> Tuple[Dict, Dict, Dict]:
+    """Run one row of the parameter file, looked up in the result cache first.
+
+    Returns:
+        Tuple containing the timeseries (NumPy columns), the metrics and the
+        metadata of the run (row parameters, row index and seed stream)
+    """
+    # flux aléatoire de la ligne : graine de la ligne ou enfant de la graine du balayage
+    if root_seed is None and is_missing(row.get("seed")):
+        root_seed = base_seed
+    seed = row_sequence(row, row_index, root_seed)
+
+    # résultat déjà calculé par une exécution précédente du balayage
+    key = row_key(row, seed, output="timeseries")
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        timeseries, metrics = cached
+    else:
+        timeseries, metrics = run_simulation(
+            State(mailly=int(row["init_mailly"]), moulin=int(row["init_moulin"])),
+            steps=int(row["steps"]),
+            p1=float(row["p1"]),
+            p2=float(row["p2"]),
+            seed=seed,
+        )
+        if cache is not None:
+            cache.put(key, (timeseries, metrics))
+
+    metadata = {key: (value.item() if hasattr(value, "item") else value) for key, value in row.items()}
+    metadata.update({
+        "row_index": row_index,
+        "seed_entropy": seed.entropy,
+        "seed_spawn_key": list(seed.spawn_key),
+    })
+    return timeseries, metrics, metadata
+
+
+def init_worker(root_seed: int, base_seed: int, cache_dir: str, cache_size: float) -> None:
+    """Store the options shared by all the rows of a packed task."""
+    _options["root_seed"] = root_seed
+    _options["base_seed"] = base_seed
+    _options["cache"] = open_cache(cache_dir, cache_size)
+
+
+def run_packed_row(task: Tuple[int, Dict]) -> Dict:
+    """Run one row of a packed task (top-level, so picklable).
+
+    Returns:
+        Record for the task's metrics table: 'run_id', metrics, 'param_*'
+        metadata (as in collect_results.py) and the trajectories
+    """
+    row_index, row = task
+    timeseries, metrics, metadata = simulate(
+        row, row_index, _options.get("root_seed"), _options.get("base_seed", 0), _options.get("cache")
+    )
+    record = {"run_id": row_index}
+    record.update(metrics)
+    for key, value in metadata.items():
+        if not isinstance(value, (list, dict)):
+            record[f"param_{key}"] = value
+    record["mailly"] = timeseries["mailly"]
+    record["moulin"] = timeseries["moulin"]
+    return record
+
+
+def packed_dir_name(start: int, stop: int, step: int) -> str:
+    """Output directory of the packed task running rows ``start:stop:step``."""
+    return f"rows_{start}_{stop}_{step}"
+
+
+def prune_cache(args) -> None:
+    """Remove the least recently used cache entries beyond --cache-size, at the end of a task."""
+    cache = open_cache(args.cache_dir, args.cache_size)
+    if cache is None:
+        return
+    removed = cache.prune()
+    if removed:
+        print(f"Result cache: removed {removed} old entries")
+
+
+def run_packed(args) -> None:
+    """Run the rows of --rows in a process pool and write one output for the task.
+
+    The task directory holds the same layout as the output of
+    collect_results.py (metrics table with 'run_id' and 'param_*' columns,
+    timeseries dataset partitioned by run_id), plus a metadata.json listing
+    its rows, so one task writes a handful of files whatever its row count.
+    A task.json written before the simulations records the requested rows
+    and ROWS_PER_TASK (STOP - START with a step of 1), so collect_results.py
+    can map the rows of a failed task back to its array task id.
+    """
+    start, step = args.rows.start or 0, args.rows.step or 1
+    tasks = read_rows(args.params, start, args.rows.stop, step)
+    if not tasks:
+        print(f"Rows {start}:{args.rows.stop}: no row of {args.params} in this range")
+        return
+    # STOP absent ou au-delà de la fin du fichier : juste après la dernière ligne lue
+    stop = tasks[-1][0] + 1
+    task_dir = Path(args.out_dir) / packed_dir_name(start, stop, step)
+    options = (args.root_seed, args.base_seed, args.cache_dir, args.cache_size)
+
+    # taille demandée (et non celle du nom, tronqué à la fin du fichier)
+    per_task = args.rows.stop - start if args.rows.stop is not None and step == 1 else None
+    task_dir.mkdir(parents=True, exist_ok=True)
+    with open(task_dir / TASK_FILE, "w") as f:
+        json.dump({"rows": [start, args.rows.stop, step], "rows_per_task": per_task}, f, indent=2)
+
+    with ResultWriter(task_dir, args.format, run_id="run_id") as writer:
+        if args.workers > 1 and len(tasks) > 1:
+            import multiprocessing as mp
+
+            with mp.Pool(min(args.workers, len(tasks)), initializer=init_worker, initargs=options) as pool:
+                for record in pool.imap_unordered(run_packed_row, tasks):
+                    writer.write(record)
+        else:
+            init_worker(*options)
+            for task in tasks:
+                writer.write(run_packed_row(task))
+
+    with open(task_dir / "metadata.json", "w") as f:
+        json.dump({"rows": [start, stop, step], "row_count": len(tasks)}, f, indent=2)
+    print(f"Rows {start}:{stop}:{step} ({len(tasks)} rows, {args.workers} workers): saved results to {task_dir}")
+    prune_cache(args)
 
 
 def main():
@@ -30,7 +268,8 @@ def main():
     1. Parse command line arguments
     2. Read the parameters CSV file
     3. Extract the specified row by index
-    4. Handle seed generation (use row seed or base_seed + row_index)
+    4. Handle seed generation (row seed, or child row_index of the sweep's
+       SeedSequence: see seeds.row_sequence)
     5. Run the simulation with extracted parameters
     6. Save results to individual output directory
     7. Save metadata about the run
@@ -43,18 +282,66 @@ def main():
     - p2: Probability Moulin->Mailly
     - seed: Random seed (optional)
     
-    Output structure:
+    Output structure (.csv, or .parquet / .feather with --format):
     - {out_dir}/{row_index}/timeseries.csv: Simulation timeseries
     - {out_dir}/{row_index}/metrics.csv: Simulation metrics
     - {out_dir}/{row_index}/metadata.json: Run parameters and metadata
+
+    With --rows START:STOP:STEP, one directory for the whole task instead:
+    - {out_dir}/rows_{START}_{STOP}_{STEP}/metrics.csv: One row per run
+      (run_id, metrics, param_* columns)
+    - {out_dir}/rows_{START}_{STOP}_{STEP}/timeseries.csv: Long timeseries
+      (timeseries/run_id=<i>/ with parquet or feather)
+    - {out_dir}/rows_{START}_{STOP}_{STEP}/metadata.json: Rows of the task
+    - {out_dir}/rows_{START}_{STOP}_{STEP}/task.json: Requested rows and
+      ROWS_PER_TASK, written before the simulations
     
     Note:
         - Create subdirectory named after row_index
         - Handle missing seed column gracefully
+        - With --cache-dir, the row is looked up in the result cache before
+          simulating; at the end of the task the least recently used
+          entries are removed until the cache fits in --cache-size
         - Save metadata as JSON with all parameters including final seed used
+        - The stream of a row depends only on the sweep and the row index, so
+          the results match run_parallel.py / run_threads.py / run_mpi.py
+          (python engine) for the same sweep
+        - --rows packs many rows in one array task: they run in a pool of
+          --workers processes and only the task's Python startup and CSV
+          read are paid once
+        - Startup stays light: the row is read with the csv module (seeking
+          to it with the index of --build-index), outputs are written with
+          the csv module or NumPy, and pandas / pyarrow are only imported
+          for --format parquet or feather (see bench_startup.py)
     """
-    # TODO: Implement single simulation workflow for cluster execution
-    pass
+    args = parse_args()
+
+    if args.build_index:
+        count = build_index(args.params)
+        print(f"Indexed {count} rows of {args.params}")
+        return
+    if args.rows is not None:
+        run_packed(args)
+        return
+
+    # lire la ligne demandée (directement à son décalage si params.csv est indexé)
+    found = read_rows(args.params, args.row_index, args.row_index + 1) if args.row_index >= 0 else []
+    if not found:
+        raise IndexError(f"Row {args.row_index} out of range of {args.params}")
+    row = found[0][1]
+
+    cache = open_cache(args.cache_dir, args.cache_size)
+    timeseries, metrics, metadata = simulate(row, args.row_index, args.root_seed, args.base_seed, cache)
+
+    run_dir = Path(args.out_dir) / str(args.row_index)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    fmt = resolve_format(args.format)
+    write_table(timeseries, run_dir / "timeseries", fmt)
+    write_table({name: [value] for name, value in metrics.items()}, run_dir / "metrics", fmt)
+    with open(run_dir / "metadata.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+    print(f"Row {args.row_index}: saved results to {run_dir}")
+    prune_cache(args)
 
 
 if __name__ == "__main__":
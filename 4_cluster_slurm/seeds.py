@@ -0,0 +1,59 @@
+import math
+from typing import Dict, List, Optional
+import numpy as np
+
+
+def is_missing(value) -> bool:
+    """Whether a params.csv field is empty (None or NaN), without importing pandas."""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def row_sequence(
+    row: Dict,
+    row_index: int,
+    root_seed: Optional[int] = None,
+) -> np.random.SeedSequence:
+    """Random stream of one params.csv row.
+
+    The stream depends only on the sweep and the row index, never on the
+    worker, thread, rank or array task that runs the row, so every runner
+    produces the same results for the same sweep.
+
+    Args:
+        row: Row of the parameter table
+        row_index: Position of the row in params.csv
+        root_seed: Seed of the whole sweep. When given, row ``i`` gets child
+            ``i`` of ``SeedSequence(root_seed)`` (as ``spawn`` would give it)
+            and the 'seed' column is ignored
+
+    Returns:
+        ``SeedSequence(root_seed).spawn(...)[row_index]`` with a root seed,
+        otherwise ``SeedSequence(row['seed'])`` (the stream of
+        ``default_rng(row['seed'])``), or child ``row_index`` of
+        ``SeedSequence(0)`` when the row has no seed
+
+    Raises:
+        ValueError: If the seed of the row or of the sweep is negative
+    """
+    if root_seed is None:
+        seed = row.get("seed")
+        if not is_missing(seed):
+            if int(seed) < 0:
+                raise ValueError(f"Row {row_index}: seed must be a non-negative integer, got {seed}")
+            return np.random.SeedSequence(int(seed))
+        root_seed = 0
+    if int(root_seed) < 0:
+        raise ValueError(f"Root seed must be a non-negative integer, got {root_seed}")
+    return np.random.SeedSequence(int(root_seed), spawn_key=(int(row_index),))
+
+
+def replica_sequences(parent: np.random.SeedSequence, replicas: int) -> List[np.random.SeedSequence]:
+    """Independent streams of the replicas of one row.
+
+    Replica ``i`` is child ``i`` of ``parent``, built directly from its spawn
+    key: unlike ``parent.spawn``, calling this twice gives the same streams.
+    """
+    return [
+        np.random.SeedSequence(parent.entropy, spawn_key=parent.spawn_key + (i,))
+        for i in range(replicas)
+    ]
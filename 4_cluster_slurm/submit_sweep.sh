@@ -0,0 +1,30 @@
+#!/bin/bash
+# Submit sweep_array.sbatch with an array sized from the row count of params.csv.
+#
+# Usage: ./submit_sweep.sh [PARAMS] [ROWS_PER_TASK] [CPUS_PER_TASK] [extra sbatch options...]
+#   ./submit_sweep.sh params.csv              # one row per task (results/<row>/)
+#   ./submit_sweep.sh params.csv 1000 8       # 1000 rows per task on 8 cores
+#
+# A million-row sweep with 1000 rows per task is an array of 1000 tasks.
+set -euo pipefail
+
+PARAMS=${1:-params.csv}
+ROWS_PER_TASK=${2:-1}
+CPUS_PER_TASK=${3:-1}
+shift $(( $# < 3 ? $# : 3 ))
+
+# lignes de données non vides (sans l'en-tête), comme rows.build_index,
+# puis nombre de tâches arrondi au-dessus
+ROWS=$(awk 'NR > 1 && NF { n++ } END { print n + 0 }' "${PARAMS}")
+if [ "${ROWS}" -le 0 ]; then
+    echo "No rows in ${PARAMS}" >&2
+    exit 1
+fi
+TASKS=$(( (ROWS + ROWS_PER_TASK - 1) / ROWS_PER_TASK ))
+
+# index des lignes : chaque tâche lit directement ses lignes de params.csv
+python run_one.py --params "${PARAMS}" --build-index
+
+echo "${ROWS} rows, ${ROWS_PER_TASK} per task: array 0-$(( TASKS - 1 ))"
+sbatch --array="0-$(( TASKS - 1 ))" --cpus-per-task="${CPUS_PER_TASK}" \
+    --export="ALL,PARAMS=${PARAMS},ROWS_PER_TASK=${ROWS_PER_TASK}" "$@" sweep_array.sbatch